@@ -632,6 +632,11 @@ EOF
     chown vesla:vesla "$INSTALL_DIR/server/.env"
     chmod 600 "$INSTALL_DIR/server/.env"
     
+    # Blob store, releases and log archive; mounted into the API container,
+    # which runs as the vesla user and can't write a directory Docker creates
+    mkdir -p "$INSTALL_DIR/server/data"
+    chown vesla:vesla "$INSTALL_DIR/server/data"
+    
     log_success "API server configuration generated"
     log_info "API Token: $api_token (save this securely!)"
 }
@@ -4,17 +4,38 @@ Main Flask application for handling deployments
 """
 
 import os
+import re
+import gzip
+import zlib
+import json
 import yaml
 import logging
 import tempfile
+import threading
+import time
 from pathlib import Path
 from functools import wraps
-from flask import Flask, request, jsonify
+from typing import Iterator, Optional, Pattern, Union
+from flask import Flask, Response, request, jsonify, stream_with_context
 import docker
+from concurrent.futures import ThreadPoolExecutor
 
 from dns_manager import DNSManager
-from builder import ImageBuilder, BuildError
-from deployer import ContainerDeployer, DeploymentError
+from autoscaler import Autoscaler
+from blob_store import BlobStore, BlobStoreError
+from build_context import ContextError, split_tarball
+from builder import ImageBuilder, BuildError, BuildResult
+from buildpack_registry import BuildpackRegistry
+from deps_cache import DepsCache
+from deployer import APP_FIELDS, ContainerDeployer, DeploymentError, DeployResult, LogFilter
+from image_gc import ImageGC
+from log_archive import MAX_SEARCH_LIMIT, LogArchive
+import metrics
+from jobs import JobQueue
+from pipeline import DeployPipeline
+from releases import ReleaseStore, ReleaseError
+from server_ip import ServerIPResolver
+from state_cache import StateCache
 
 # Configure logging
 logging.basicConfig(
@@ -31,13 +52,116 @@ CONFIG_PATH = Path(__file__).parent / "config.yaml"
 with open(CONFIG_PATH) as f:
     config = yaml.safe_load(f)
 
+# Persistent server state (blob store, ...)
+DATA_DIR = Path(config.get("storage", {}).get("data_dir") or Path(__file__).parent / "data")
+
+# Traefik's metrics entrypoint: by name on vesla-network from the API
+# container, or the port Traefik publishes on localhost for host installs
+TRAEFIK_METRICS_URL = ("http://traefik:8082/metrics" if Path("/.dockerenv").exists()
+                       else "http://127.0.0.1:8082/metrics")
+
+# Largest tail returned in a JSON log response; bigger ones must be streamed
+MAX_JSON_LOG_TAIL = 10000
+
+# Relative times accepted for log 'since' and 'until', e.g. 10m
+SINCE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Longest regular expression accepted for log 'grep'
+MAX_GREP_LENGTH = 500
+
+# Buffered responses smaller than this aren't worth gzipping
+GZIP_MIN_SIZE = 1024
+
 # Initialize Docker client
 docker_client = docker.from_env()
 
 # Initialize managers
 dns_manager = DNSManager(config["digitalocean"]["api_token"])
-image_builder = ImageBuilder(docker_client)
-container_deployer = ContainerDeployer(docker_client, config["docker"]["network"])
+deps_cache = None
+if config["build"].get("deps_cache", True):
+    deps_cache = DepsCache(
+        docker_client,
+        max_size=config["build"].get("deps_cache_max_size_mb", 10240) * 1024 * 1024
+    )
+    deps_cache.load()
+image_builder = ImageBuilder(
+    docker_client,
+    buildkit=config["build"].get("buildkit", False),
+    buildpacks=BuildpackRegistry.load(config["build"].get("buildpacks_dir")),
+    deps_cache=deps_cache,
+    max_concurrent_builds=config["build"].get("max_concurrent_builds", 2)
+)
+container_deployer = ContainerDeployer(
+    docker_client,
+    config["docker"]["network"],
+    max_replicas=config["docker"].get("max_replicas", 10)
+)
+blob_store = BlobStore(DATA_DIR / "blobs")
+release_store = ReleaseStore(DATA_DIR / "releases")
+server_ip_resolver = ServerIPResolver(
+    override=config.get("server", {}).get("public_ip"),
+    ttl=config.get("server", {}).get("ip_refresh_interval", 3600)
+)
+server_ip_resolver.start()
+# Each followed log stream holds a server thread until the client goes away
+log_streams = threading.BoundedSemaphore(config.get("server", {}).get("max_log_streams", 4))
+job_queue = JobQueue(max_concurrent_builds=config["build"].get("max_concurrent_builds", 2))
+# Each running deployment runs up to two pipeline steps at once
+pipeline_executor = ThreadPoolExecutor(
+    max_workers=2 * job_queue.max_concurrent_builds,
+    thread_name_prefix="vesla-pipeline"
+)
+gc_config = config.get("gc", {})
+image_gc = ImageGC(
+    docker_client,
+    release_store,
+    keep_releases=config["build"].get("keep_releases", 5),
+    interval=gc_config.get("interval", 3600),
+    check_interval=gc_config.get("check_interval", 60),
+    docker_root=gc_config.get("docker_root", "/var/lib/docker"),
+    min_free_percent=gc_config.get("min_free_percent", 10),
+    is_busy=job_queue.is_active
+)
+image_gc.start()
+autoscaler_config = config.get("autoscaler", {})
+autoscaler = None
+if autoscaler_config.get("enabled", True):
+    autoscaler = Autoscaler(
+        docker_client,
+        release_store,
+        # Its own kind, so a scale it queues never replaces one a user queued
+        scale=lambda app_name, replicas: job_queue.submit(app_name, run_scale, app_name, replicas,
+                                                          kind="autoscale").id,
+        metrics_url=autoscaler_config.get("metrics_url") or TRAEFIK_METRICS_URL,
+        max_replicas=container_deployer.max_replicas,
+        interval=autoscaler_config.get("interval", 30),
+        scale_up_cooldown=autoscaler_config.get("scale_up_cooldown", 60),
+        scale_down_cooldown=autoscaler_config.get("scale_down_cooldown", 300),
+        audit_path=autoscaler_config.get("audit_log") or str(DATA_DIR / "autoscaler-audit.log"),
+        is_busy=job_queue.is_active
+    )
+    autoscaler.start()
+state_cache_config = config.get("state_cache", {})
+state_cache = None
+if state_cache_config.get("enabled", True):
+    state_cache = StateCache(docker_client, resync_interval=state_cache_config.get("resync_interval", 300))
+    state_cache.start()
+log_archive_config = config.get("log_archive", {})
+log_archive = None
+if log_archive_config.get("enabled", True):
+    log_archive = LogArchive(
+        docker_client,
+        Path(log_archive_config.get("dir") or DATA_DIR / "logs"),
+        max_size=log_archive_config.get("max_size_mb", 2048) * 1024 * 1024,
+        max_age=log_archive_config.get("max_age_days", 14) * 86400,
+        flush_interval=log_archive_config.get("flush_interval", 10)
+    )
+    try:
+        log_archive.start()
+    except OSError as e:
+        logger.error(f"Log archive disabled, can't use {log_archive.directory}: {e}")
+        log_archive = None
+metrics.REGISTRY.register(metrics.StateCollector(job_queue, deps_cache, image_gc, state_cache, log_archive))
 
 
 # Authentication decorator
@@ -70,7 +194,18 @@ def require_auth(f):
 @app.route("/health", methods=["GET"])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "service": "vesla-server"}), 200
+    return jsonify({
+        "status": "healthy",
+        "service": "vesla-server",
+        "public_ip": server_ip_resolver.get()
+    }), 200
+
+
+@app.route("/metrics", methods=["GET"])
+@require_auth
+def get_metrics():
+    """Deploy phase timings, cache and error counters and queue gauges in Prometheus format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route("/api/deploy", methods=["POST"])
@@ -80,13 +215,21 @@ def deploy():
     Deploy an application
 
     Expected multipart/form-data with:
-    - code: Tarball file (.tar.gz)
-    - config: vesla.yaml content (text)
+    - code: Tarball file (.tar.gz), or
+    - manifest: JSON list of {"path", "hash", "mode"} entries whose blobs
+      were uploaded beforehand via /api/apps/<app>/sync and /blobs
+    - config: vesla.yaml content (text), or a project manifest with
+      'project' and a list of 'apps', each a vesla.yaml plus the 'path' of
+      the app's subdirectory in the upload
+    - rebuild: Optional; "true" builds even if the source is unchanged
+
+    The deployment runs in the background; poll GET /api/jobs/<job_id>
+    for its progress and result.
     """
     try:
         # Validate request
-        if "code" not in request.files:
-            return jsonify({"status": "error", "error": "Missing 'code' file"}), 400
+        if "code" not in request.files and "manifest" not in request.form:
+            return jsonify({"status": "error", "error": "Missing 'code' file or 'manifest' field"}), 400
 
         if "config" not in request.form:
             return jsonify({"status": "error", "error": "Missing 'config' field"}), 400
@@ -98,85 +241,675 @@ def deploy():
             return jsonify({"status": "error", "error": f"Invalid vesla.yaml: {str(e)}"}), 400
 
         # Validate vesla.yaml
-        validation_error = validate_vesla_config(vesla_config)
+        is_project = isinstance(vesla_config, dict) and "apps" in vesla_config
+        if is_project:
+            validation_error = validate_project_config(vesla_config)
+        else:
+            validation_error = validate_vesla_config(vesla_config)
         if validation_error:
             return jsonify({"status": "error", "error": validation_error}), 400
 
-        app_name = vesla_config["app"]
-        domain = vesla_config["domain"]
+        # Uploads of a project are stored under the project name
+        app_name = vesla_config["project"] if is_project else vesla_config["app"]
+
+        if "manifest" in request.form:
+            # Incremental upload: assemble the source tree from stored blobs
+            try:
+                manifest = json.loads(request.form["manifest"])
+                with metrics.phase("assemble"):
+                    tarball_path = blob_store.assemble(app_name, manifest)
+            except (ValueError, KeyError, TypeError, BlobStoreError) as e:
+                return jsonify({"status": "error", "error": f"Invalid manifest: {str(e)}"}), 400
+            blob_store.prune(app_name, max_age=config.get("storage", {}).get("blob_max_age", 30 * 86400))
+        else:
+            # Save tarball to temp file; the deploy job owns it from here on
+            code_file = request.files["code"]
+            with tempfile.NamedTemporaryFile(suffix=".tar.gz", delete=False) as tmp, metrics.phase("upload"):
+                tarball_path = tmp.name
+                code_file.save(tarball_path)
+
+        rebuild = request.form.get("rebuild", "").lower() in ("1", "true", "yes")
+        if is_project:
+            job = job_queue.submit(
+                app_name, run_project_deployment, tarball_path, vesla_config["apps"], rebuild,
+                cleanup=lambda: remove_tarball(tarball_path),
+                apps=[a["app"] for a in vesla_config["apps"]],
+                kind="project"
+            )
+            logger.info(f"Queued deployment of project {app_name} ({', '.join(job.apps)}) as job {job.id}")
+        else:
+            job = job_queue.submit(
+                app_name, run_deployment, tarball_path, vesla_config, rebuild,
+                cleanup=lambda: remove_tarball(tarball_path)
+            )
+            logger.info(f"Queued deployment for {app_name} at {vesla_config['domain']} as job {job.id}")
+
+        return jsonify({
+            "status": "queued",
+            "app": app_name,
+            "apps": job.apps,
+            "job_id": job.id,
+            "status_url": f"/api/jobs/{job.id}",
+            "queue_position": job_queue.position(job),
+            "message": "Deployment queued"
+        }), 202
 
-        logger.info(f"Starting deployment for {app_name} at {domain}")
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({"status": "error", "error": f"Internal server error: {str(e)}"}), 500
 
-        # Save tarball to temp file
-        code_file = request.files["code"]
-        with tempfile.NamedTemporaryFile(suffix=".tar.gz", delete=False) as tmp:
-            tarball_path = tmp.name
-            code_file.save(tarball_path)
 
-        try:
-            # Step 1: Build Docker image
-            logger.info(f"Building Docker image for {app_name}")
-            image_id, build_time = image_builder.build_image(
-                app_name,
-                tarball_path,
-                vesla_config,
-                max_build_time=config["build"]["max_build_time"]
-            )
+@app.route("/api/apps/<app_name>/sync", methods=["POST"])
+@require_auth
+def sync_manifest(app_name):
+    """
+    Start an incremental upload
 
-            # Step 2: Create DNS record
-            logger.info(f"Creating DNS record for {domain}")
-            subdomain, base_domain = parse_domain(domain)
-            server_ip = get_server_ip()
+    Expected JSON body: {"hashes": [sha256, ...]} for every file in the tree.
+    Returns the hashes the server doesn't have, which the client then
+    uploads to /api/apps/<app>/blobs before deploying with a manifest.
+    """
+    if not is_valid_app_name(app_name):
+        return jsonify({"status": "error", "error": "Invalid app name"}), 400
 
-            dns_success = dns_manager.create_a_record(subdomain, base_domain, server_ip)
-            if not dns_success:
-                logger.warning(f"Failed to create DNS record for {domain}, continuing anyway")
+    body = request.get_json(silent=True) or {}
+    hashes = body.get("hashes")
+    if not isinstance(hashes, list):
+        return jsonify({"status": "error", "error": "Missing 'hashes' list"}), 400
 
-            # Step 3: Deploy container
-            logger.info(f"Deploying container for {app_name}")
-            container_id = container_deployer.deploy_container(app_name, image_id, vesla_config)
+    try:
+        missing = blob_store.missing(app_name, hashes)
+    except BlobStoreError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
 
-            # Clean up old images
-            image_builder.cleanup_old_images(app_name)
+    return jsonify({"status": "success", "app": app_name, "missing": missing}), 200
 
-            logger.info(f"Successfully deployed {app_name} at https://{domain}")
 
-            return jsonify({
-                "status": "success",
-                "app": app_name,
-                "url": f"https://{domain}",
-                "container_id": container_id[:12],
-                "build_time": round(build_time, 2),
-                "message": "Deployment successful"
-            }), 200
+@app.route("/api/apps/<app_name>/blobs", methods=["POST"])
+@require_auth
+def upload_blobs(app_name):
+    """
+    Upload source blobs
 
-        finally:
-            # Clean up tarball
-            try:
-                os.unlink(tarball_path)
-            except Exception as e:
-                logger.warning(f"Failed to clean up tarball: {e}")
+    Expected multipart/form-data with:
+    - blobs: Tarball (.tar.gz) whose members are named by their SHA-256 hash
+    """
+    if not is_valid_app_name(app_name):
+        return jsonify({"status": "error", "error": "Invalid app name"}), 400
+
+    if "blobs" not in request.files:
+        return jsonify({"status": "error", "error": "Missing 'blobs' file"}), 400
+
+    try:
+        stored = blob_store.add_from_tarball(app_name, request.files["blobs"].stream)
+    except BlobStoreError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    return jsonify({"status": "success", "app": app_name, "stored": stored}), 200
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@require_auth
+def get_job(job_id):
+    """Get phase, progress and result of a deployment job"""
+    job = job_queue.get(job_id)
+
+    if job:
+        job_info = job.to_dict()
+        job_info["queue_position"] = job_queue.position(job)
+        return jsonify({"status": "success", "job": job_info}), 200
+    else:
+        return jsonify({"status": "error", "error": "Job not found"}), 404
+
+
+@app.route("/api/buildpacks", methods=["GET"])
+@require_auth
+def list_buildpacks():
+    """List registered buildpacks in detection order"""
+    buildpacks = sorted(image_builder.buildpacks.buildpacks.values(), key=lambda b: (-b.priority, b.name))
+    return jsonify({"status": "success", "buildpacks": [b.to_dict() for b in buildpacks]}), 200
+
+
+@app.route("/api/deps-cache", methods=["GET"])
+@require_auth
+def get_deps_cache():
+    """Get dependency image cache hits, misses and disk usage"""
+    if deps_cache is None:
+        return jsonify({"status": "success", "enabled": False}), 200
+    return jsonify({"status": "success", "enabled": True, "cache": deps_cache.stats()}), 200
+
+
+@app.route("/api/gc", methods=["GET"])
+@require_auth
+def get_gc():
+    """Get image collector counters and the reports of recent runs"""
+    return jsonify({"status": "success", "gc": image_gc.stats()}), 200
+
+
+@app.route("/api/gc", methods=["POST"])
+@require_auth
+def trigger_gc():
+    """Start an image collection in the background; poll GET /api/gc for its report"""
+    image_gc.trigger()
+    return jsonify({"status": "queued", "message": "Image collection started"}), 202
+
+
+@app.route("/api/autoscaler", methods=["GET"])
+@require_auth
+def get_autoscaler():
+    """Get the autoscaler's last evaluation and recent decisions"""
+    if autoscaler is None:
+        return jsonify({"status": "error", "error": "Autoscaler is disabled"}), 404
+    return jsonify({"status": "success", "autoscaler": autoscaler.stats()}), 200
+
+
+@app.route("/api/log-archive", methods=["GET"])
+@require_auth
+def get_log_archive():
+    """Get the log archive's size and collection counters"""
+    if log_archive is None:
+        return jsonify({"status": "error", "error": "Log archive is disabled"}), 404
+    return jsonify({"status": "success", "archive": log_archive.stats()}), 200
+
+
+@app.route("/api/queue", methods=["GET"])
+@require_auth
+def get_queue():
+    """Get build queue depth, running jobs and wait times"""
+    return jsonify({"status": "success", "queue": job_queue.stats()}), 200
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+@require_auth
+def cancel_job(job_id):
+    """Cancel a queued or running deployment job"""
+    job = job_queue.get(job_id)
+
+    if not job:
+        return jsonify({"status": "error", "error": "Job not found"}), 404
+
+    if job.done:
+        return jsonify({"status": "error", "error": f"Job already {job.status}"}), 409
+
+    job_queue.cancel(job)
+    return jsonify({"status": "success", "message": f"Cancelling job {job_id}"}), 202
+
+
+@app.route("/api/jobs/<job_id>/logs", methods=["GET"])
+@require_auth
+def get_job_logs(job_id):
+    """
+    Get build and deploy output of a job
+
+    Query parameters:
+    - offset: Number of lines already read (default 0)
+    - follow: If set, stream lines as plain text until the job finishes
+    """
+    job = job_queue.get(job_id)
+
+    if not job:
+        return jsonify({"status": "error", "error": "Job not found"}), 404
+
+    offset = request.args.get("offset", default=0, type=int)
+
+    if not request.args.get("follow"):
+        lines, next_offset = job.read_logs(offset)
+        return jsonify({
+            "status": "success",
+            "job_id": job.id,
+            "lines": lines,
+            "next_offset": next_offset,
+            "done": job.done
+        }), 200
+
+    def generate():
+        position = offset
+        while True:
+            finished = job.done
+            lines, position = job.read_logs(position, timeout=15)
+            if lines:
+                yield "\n".join(lines) + "\n"
+            elif finished:
+                break
+
+    return Response(stream_with_context(generate()), mimetype="text/plain")
+
+
+@metrics.track_job("deploy")
+def run_deployment(job, tarball_path: str, vesla_config: dict, rebuild: bool = False) -> dict:
+    """
+    Run the deployment pipeline for a queued deployment
+
+    DNS provisioning only depends on vesla.yaml, so it runs alongside the
+    image build; the container starts once both have finished. If a retained
+    release was built from the same source, its image is deployed as is.
+
+    Args:
+        job: Job tracking this deployment
+        tarball_path: Path to uploaded code tarball (removed when done)
+        vesla_config: Validated vesla.yaml configuration
+        rebuild: Build even if the source is unchanged
+
+    Returns:
+        Deployment result dictionary
+
+    Raises:
+        BuildError, DeploymentError: If a pipeline step fails
+    """
+    app_name = vesla_config["app"]
+    domain = vesla_config["domain"]
+    vesla_config = with_replicas(app_name, vesla_config)
+
+    # Everything from here on removes the tarball when done, even if planning fails
+    try:
+        release, build = plan_build(job, app_name, tarball_path, vesla_config, rebuild, job.log)
+
+        logger.info(f"Starting deployment for {app_name} at {domain} (release {release})")
+
+        def deploy(build, dns):
+            job.check_cancelled()
+            job.update("deploying", 85)
+            return container_deployer.deploy_container(app_name, build.image_id, vesla_config, log_callback=job.log)
+
+        pipeline = DeployPipeline(pipeline_executor, on_event=job.log)
+        pipeline.add("build", build)
+        pipeline.add("dns", lambda: provision_dns(domain))
+        pipeline.add("deploy", deploy, depends_on=["build", "dns"])
+
+        job.update("building", 10)
+        results = pipeline.run()
+        record_release(app_name, release, results["build"], vesla_config)
+
+        logger.info(f"Successfully deployed {app_name} release {release} at https://{domain}")
+
+        return dict(
+            app_result(app_name, release, vesla_config, results["build"], results["deploy"], results["dns"]),
+            timings=pipeline.timings,
+            message="Deployment successful"
+        )
 
     except BuildError as e:
+        job.check_cancelled()
         logger.error(f"Build error: {str(e)}")
-        return jsonify({"status": "error", "error": f"Build failed: {str(e)}"}), 500
+        raise BuildError(f"Build failed: {str(e)}") from e
 
     except DeploymentError as e:
         logger.error(f"Deployment error: {str(e)}")
-        return jsonify({"status": "error", "error": f"Deployment failed: {str(e)}"}), 500
+        if is_down(app_name):
+            revert_rollout(job, [app_name])
+        raise DeploymentError(f"Deployment failed: {str(e)}") from e
+
+    finally:
+        remove_tarball(tarball_path)
+
+
+@metrics.track_job("project")
+def run_project_deployment(job, tarball_path: str, apps: list, rebuild: bool = False) -> dict:
+    """
+    Build every app of a project from one upload, then roll them out together
+
+    Each app is built from its subdirectory of the upload. The builds run in
+    parallel as build slots free up (build.max_concurrent_builds across all
+    jobs) and share base image layers and dependency images. No container is
+    replaced until every image has been built, and if one app fails to roll
+    out, the apps already rolled out go back to their previous release.
+
+    Args:
+        job: Job tracking this deployment
+        tarball_path: Path to uploaded code tarball (removed when done)
+        apps: Validated vesla.yaml of each app, with the 'path' of its subdirectory
+        rebuild: Build even if the source is unchanged
+
+    Returns:
+        Deployment result dictionary with a result per app
+
+    Raises:
+        BuildError, DeploymentError: If a pipeline step fails
+    """
+    configs = {a["app"]: with_replicas(a["app"], {key: value for key, value in a.items() if key != "path"})
+               for a in apps}
+    contexts = {}
 
+    try:
+        job.update("preparing", 5)
+        with metrics.phase("split"):
+            contexts = split_tarball(tarball_path, {a["app"]: a["path"] for a in apps})
+    except ContextError as e:
+        raise BuildError(f"Build failed: {str(e)}") from e
+    finally:
+        remove_tarball(tarball_path)
+
+    logger.info(f"Starting deployment of {', '.join(configs)} for job {job.id}")
+
+    releases = {}
+    builds = [f"build:{name}" for name in configs]
+    executor = ThreadPoolExecutor(max_workers=2 * len(configs), thread_name_prefix="vesla-project")
+    pipeline = DeployPipeline(executor, on_event=job.log)
+
+    try:
+        for name, vesla_config in configs.items():
+            releases[name], build = plan_build(
+                job, name, contexts[name], vesla_config, rebuild,
+                lambda line, name=name: job.log(f"[{name}] {line}")
+            )
+
+            def build_app(name=name, build=build):
+                try:
+                    return build()
+                except BuildError as e:
+                    raise BuildError(f"{name}: {str(e)}") from e
+
+            def deploy(name=name, vesla_config=vesla_config, **results):
+                job.check_cancelled()
+                if job.phase != "deploying":
+                    job.update("deploying", 85)
+                try:
+                    return container_deployer.deploy_container(
+                        name, results[f"build:{name}"].image_id, vesla_config,
+                        log_callback=lambda line: job.log(f"[{name}] {line}")
+                    )
+                except DeploymentError as e:
+                    raise DeploymentError(f"{name}: {str(e)}") from e
+
+            pipeline.add(f"build:{name}", build_app)
+            pipeline.add(f"dns:{name}", lambda domain=vesla_config["domain"]: provision_dns(domain))
+            pipeline.add(f"deploy:{name}", deploy, depends_on=builds + [f"dns:{name}"])
+
+        try:
+            job.update("building", 10)
+            results = pipeline.run()
+
+            for name, vesla_config in configs.items():
+                record_release(name, releases[name], results[f"build:{name}"], vesla_config)
+
+            logger.info(f"Successfully deployed {', '.join(configs)}")
+
+            return {
+                "apps": [
+                    app_result(name, releases[name], vesla_config, results[f"build:{name}"],
+                               results[f"deploy:{name}"], results[f"dns:{name}"])
+                    for name, vesla_config in configs.items()
+                ],
+                "timings": pipeline.timings,
+                "message": "Deployment successful"
+            }
+
+        except Exception as e:
+            revert_rollout(job, [name for name in configs if f"deploy:{name}" in pipeline.results or is_down(name)])
+            if isinstance(e, BuildError):
+                job.check_cancelled()
+                logger.error(f"Build error: {str(e)}")
+                raise BuildError(f"Build failed: {str(e)}") from e
+            if isinstance(e, DeploymentError):
+                logger.error(f"Deployment error: {str(e)}")
+                raise DeploymentError(f"Deployment failed: {str(e)}") from e
+            raise
+
+    finally:
+        executor.shutdown(wait=False)
+        for path in contexts.values():
+            remove_tarball(path)
+
+
+def plan_build(job, app_name: str, tarball_path: str, vesla_config: dict, rebuild: bool,
+               log_callback) -> tuple:
+    """
+    Work out an app's next release and how to build its image
+
+    Returns:
+        Tuple of (release number, callable building the image)
+    """
+    release = release_store.next_number(app_name)
+    previous = release_store.current(app_name)
+    known_images = None if rebuild else {
+        r["source_hash"]: r["image_id"] for r in release_store.list(app_name) if r.get("source_hash")
+    }
+
+    def build() -> BuildResult:
+        return image_builder.build_image(
+            app_name,
+            tarball_path,
+            vesla_config,
+            max_build_time=config["build"]["max_build_time"],
+            log_callback=log_callback,
+            cancel_event=job.cancelled,
+            release=release,
+            cache_from=ImageBuilder.release_tag(app_name, previous["release"]) if previous else None,
+            known_images=known_images
+        )
+
+    return release, build
+
+
+def record_release(app_name: str, release: int, build_result: BuildResult, vesla_config: dict):
+    """Add a deployed release to the app's history"""
+    release_store.add(
+        app_name, release, build_result.image_id,
+        [ImageBuilder.release_tag(app_name, release), ImageBuilder.content_tag(app_name, build_result.image_id)],
+        vesla_config, build_time=None if build_result.reused else build_result.build_time,
+        source_hash=build_result.source_hash
+    )
+    release_store.set_replicas(app_name, vesla_config.get("replicas", 1))
+
+
+def with_replicas(app_name: str, vesla_config: dict) -> dict:
+    """
+    vesla.yaml with the app's current replica count filled in
+
+    An explicit 'replicas' in vesla.yaml wins; without one, deploys keep the
+    count the app was last deployed or scaled to.
+    """
+    if "replicas" in vesla_config:
+        return vesla_config
+    replicas = release_store.replicas(app_name)
+    return dict(vesla_config, replicas=replicas) if replicas else vesla_config
+
+
+def app_result(app_name: str, release: int, vesla_config: dict, build_result: BuildResult,
+               deployment: DeployResult, dns_configured: bool) -> dict:
+    """Result of deploying one app, as returned in job results"""
+    return {
+        "app": app_name,
+        "release": release,
+        "url": f"https://{vesla_config['domain']}",
+        "container_id": deployment.container_id[:12],
+        "replicas": len(deployment.container_ids),
+        "ready_time": round(deployment.ready_time, 2),
+        "build_time": round(build_result.build_time, 2),
+        "build_skipped": build_result.reused,
+        "dns_configured": dns_configured,
+    }
+
+
+def is_down(app_name: str) -> bool:
+    """Check whether a failed rollout left an app with a release but no container"""
+    return release_store.current(app_name) is not None and container_deployer.get_container_status(app_name) is None
+
+
+def revert_rollout(job, app_names: list):
+    """
+    Put apps of a failed deploy back on their current release
+
+    Apps deployed for the first time are removed instead. Failures are
+    logged; the original error is what the job reports.
+    """
+    for app_name in app_names:
+        current = release_store.current(app_name)
+        try:
+            if current:
+                job.log(f"Reverting {app_name} to release {current['release']}")
+                container_deployer.deploy_container(app_name, current["image_id"],
+                                                    with_replicas(app_name, current["config"]))
+            else:
+                job.log(f"Removing {app_name}, which had no earlier release")
+                container_deployer.remove_container(app_name)
+        except Exception as e:
+            logger.error(f"Could not revert {app_name}: {e}")
+            job.log(f"Could not revert {app_name}: {e}")
+
+
+@metrics.track_job("rollback")
+def run_rollback(job, app_name: str, release_number: int) -> dict:
+    """
+    Redeploy a retained release without building anything
+
+    Args:
+        job: Job tracking this rollback
+        app_name: Application name
+        release_number: Release to redeploy
+
+    Returns:
+        Rollback result dictionary
+
+    Raises:
+        ReleaseError: If the release is no longer retained
+        DeploymentError: If the container can't be started
+    """
+    release = release_store.get(app_name, release_number)
+    vesla_config = with_replicas(app_name, release["config"])
+    start_time = time.time()
+
+    job.update("deploying", 50)
+    job.log(f"Rolling back {app_name} to release {release_number} ({release['tags'][0]})")
+
+    try:
+        deployment = container_deployer.deploy_container(app_name, release["image_id"], vesla_config,
+                                                         log_callback=job.log)
+    except DeploymentError as e:
+        logger.error(f"Rollback error: {str(e)}")
+        raise DeploymentError(f"Rollback failed: {str(e)}") from e
+
+    release_store.set_current(app_name, release_number)
+    release_store.set_replicas(app_name, len(deployment.container_ids))
+    logger.info(f"Rolled back {app_name} to release {release_number}")
+
+    return {
+        "app": app_name,
+        "release": release_number,
+        "url": f"https://{vesla_config['domain']}",
+        "container_id": deployment.container_id[:12],
+        "ready_time": round(deployment.ready_time, 2),
+        "deploy_time": round(time.time() - start_time, 2),
+        "message": f"Rolled back to release {release_number}"
+    }
+
+
+@metrics.track_job("scale")
+def run_scale(job, app_name: str, replicas: int) -> dict:
+    """
+    Change the number of containers running an app's current release
+
+    Args:
+        job: Job tracking this scale operation
+        app_name: Application name
+        replicas: Number of containers to run
+
+    Returns:
+        Scale result dictionary
+
+    Raises:
+        ReleaseError: If the app has no current release
+        DeploymentError: If a new container never becomes ready
+    """
+    release = release_store.current(app_name)
+    if not release:
+        raise ReleaseError(f"App {app_name} has no current release")
+    vesla_config = with_replicas(app_name, release["config"])
+    start_time = time.time()
+
+    job.update("scaling", 50)
+    job.log(f"Scaling {app_name} to {replicas} container(s)")
+
+    try:
+        deployment = container_deployer.scale(app_name, release["image_id"], vesla_config, replicas,
+                                              log_callback=job.log)
+    except DeploymentError as e:
+        logger.error(f"Scale error: {str(e)}")
+        raise DeploymentError(f"Scaling failed: {str(e)}") from e
+
+    release_store.set_replicas(app_name, replicas)
+    logger.info(f"Scaled {app_name} to {replicas} container(s)")
+
+    return {
+        "app": app_name,
+        "release": release["release"],
+        "replicas": len(deployment.container_ids),
+        "container_ids": [container_id[:12] for container_id in deployment.container_ids],
+        "ready_time": round(deployment.ready_time, 2),
+        "deploy_time": round(time.time() - start_time, 2),
+        "message": f"Scaled to {replicas} container(s)"
+    }
+
+
+def provision_dns(domain: str) -> bool:
+    """
+    Point the app's domain at this server
+
+    Returns:
+        True if the A record is in place, False otherwise (deploys continue)
+    """
+    subdomain, base_domain = parse_domain(domain)
+    server_ip = server_ip_resolver.get()
+
+    if not server_ip:
+        logger.warning(f"Server public IP unknown, skipping DNS record for {domain}")
+        return False
+
+    with metrics.phase("dns"):
+        created = dns_manager.create_a_record(subdomain, base_domain, server_ip)
+    if not created:
+        logger.warning(f"Failed to create DNS record for {domain}, continuing anyway")
+        return False
+
+    return True
+
+
+def remove_tarball(tarball_path: str):
+    """Remove an uploaded code tarball"""
+    try:
+        os.unlink(tarball_path)
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "error": f"Internal server error: {str(e)}"}), 500
+        logger.warning(f"Failed to clean up tarball: {e}")
 
 
 @app.route("/api/apps", methods=["GET"])
 @require_auth
 def list_apps():
-    """List all deployed applications"""
+    """
+    List all deployed applications
+
+    Query parameters:
+    - fields: Comma-separated fields to include (default all)
+    - offset: Number of apps to skip (default 0)
+    - limit: Most apps to return (default all)
+    """
+    fields = [f for f in request.args.get("fields", "").split(",") if f] or None
+    unknown = sorted(set(fields or []) - set(APP_FIELDS))
+    if unknown:
+        return jsonify({
+            "status": "error",
+            "error": f"Unknown fields: {', '.join(unknown)}; available: {', '.join(APP_FIELDS)}"
+        }), 400
+
+    offset = request.args.get("offset", default=0, type=int)
+    limit = request.args.get("limit", type=int)
+    if offset < 0 or (limit is not None and limit < 1):
+        return jsonify({"status": "error", "error": "offset must be >= 0 and limit >= 1"}), 400
+
     try:
-        apps = container_deployer.list_all_apps()
-        return jsonify({"status": "success", "apps": apps, "total": len(apps)}), 200
+        if state_cache is not None and state_cache.seeded:
+            apps, as_of = state_cache.list_apps(fields), state_cache.as_of()
+        else:
+            apps, as_of = container_deployer.list_all_apps(fields), time.time()
+        page = apps[offset:offset + limit if limit is not None else None]
+        return jsonify({
+            "status": "success",
+            "apps": page,
+            "total": len(apps),
+            "offset": offset,
+            "limit": limit,
+            "as_of": as_of
+        }), 200
 
     except Exception as e:
         logger.error(f"Error listing apps: {str(e)}")
@@ -188,10 +921,13 @@ def list_apps():
 def get_app_status(app_name):
     """Get status of a deployed application"""
     try:
-        status = container_deployer.get_container_status(app_name)
+        if state_cache is not None and state_cache.seeded:
+            status, as_of = state_cache.app_status(app_name), state_cache.as_of()
+        else:
+            status, as_of = container_deployer.get_container_status(app_name), time.time()
 
         if status:
-            return jsonify({"status": "success", "app": app_name, "container": status}), 200
+            return jsonify({"status": "success", "app": app_name, "container": status, "as_of": as_of}), 200
         else:
             return jsonify({"status": "error", "error": "App not found"}), 404
 
@@ -209,6 +945,8 @@ def delete_app(app_name):
         success = container_deployer.remove_container(app_name)
 
         if success:
+            image_builder.remove_app_images(app_name, release_store.list(app_name))
+            release_store.delete(app_name)
             logger.info(f"Successfully deleted app: {app_name}")
             return jsonify({"status": "success", "message": f"App {app_name} deleted"}), 200
         else:
@@ -219,23 +957,330 @@ def delete_app(app_name):
         return jsonify({"status": "error", "error": str(e)}), 500
 
 
+@app.route("/api/apps/<app_name>/releases", methods=["GET"])
+@require_auth
+def list_releases(app_name):
+    """List retained releases of an application, newest first"""
+    try:
+        current = release_store.current(app_name)
+        releases = [
+            {
+                "release": r["release"],
+                "image": r["tags"][0],
+                "image_id": r["image_id"],
+                "build_time": r["build_time"],
+                "created_at": r["created_at"],
+                "current": current is not None and r["release"] == current["release"],
+            }
+            for r in release_store.list(app_name)
+        ]
+    except ReleaseError as e:
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+    return jsonify({"status": "success", "app": app_name, "releases": releases}), 200
+
+
+@app.route("/api/apps/<app_name>/rollback", methods=["POST"])
+@require_auth
+def rollback_app(app_name):
+    """
+    Queue a rollback to a retained release
+
+    Expects JSON {"release": <number>}; without it, rolls back to the release
+    before the current one. Returns 202 with the job ID.
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        if data.get("release") is not None:
+            release = release_store.get(app_name, int(data["release"]))
+        else:
+            release = release_store.previous(app_name)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "error": "'release' must be a number"}), 400
+    except ReleaseError as e:
+        return jsonify({"status": "error", "error": str(e)}), 404
+
+    job = job_queue.submit(app_name, run_rollback, app_name, release["release"], kind="rollback")
+    logger.info(f"Queued rollback job {job.id} for {app_name} to release {release['release']}")
+
+    return jsonify({
+        "status": "queued",
+        "job_id": job.id,
+        "app": app_name,
+        "release": release["release"],
+        "status_url": f"/api/jobs/{job.id}",
+        "queue_position": job_queue.position(job),
+        "message": f"Rollback to release {release['release']} queued"
+    }), 202
+
+
+@app.route("/api/apps/<app_name>/scale", methods=["POST"])
+@require_auth
+def scale_app(app_name):
+    """
+    Queue a change of the number of containers running an app
+
+    Expects JSON {"replicas": <number>}. The app's current release is
+    started on the extra containers, or the surplus ones are stopped; later
+    deploys keep the count unless vesla.yaml sets 'replicas'. Returns 202
+    with the job ID.
+    """
+    data = request.get_json(silent=True) or {}
+    replicas = data.get("replicas")
+    max_replicas = container_deployer.max_replicas
+
+    if isinstance(replicas, bool) or not isinstance(replicas, int) or not 1 <= replicas <= max_replicas:
+        return jsonify({"status": "error", "error": f"'replicas' must be a number from 1 to {max_replicas}"}), 400
+
+    try:
+        release = release_store.current(app_name)
+    except ReleaseError as e:
+        return jsonify({"status": "error", "error": str(e)}), 500
+    if not release:
+        return jsonify({"status": "error", "error": "App not found"}), 404
+
+    job = job_queue.submit(app_name, run_scale, app_name, replicas, kind="scale")
+    logger.info(f"Queued scale job {job.id} for {app_name} to {replicas} container(s)")
+
+    return jsonify({
+        "status": "queued",
+        "job_id": job.id,
+        "app": app_name,
+        "replicas": replicas,
+        "status_url": f"/api/jobs/{job.id}",
+        "queue_position": job_queue.position(job),
+        "message": f"Scaling to {replicas} container(s) queued"
+    }), 202
+
+
 @app.route("/api/apps/<app_name>/logs", methods=["GET"])
 @require_auth
 def get_app_logs(app_name):
-    """Get logs from a deployed application"""
+    """
+    Get logs from a deployed application
+
+    Query parameters:
+    - tail: Number of lines, per replica when streaming, or 'all'
+      (default 100, or all when streaming with grep)
+    - since, until: Only lines after/before this Unix time, or this long
+      ago (e.g. 30s, 10m, 2h)
+    - grep: Only lines whose message matches this regular expression
+    - stdout, stderr: Set to 0 to leave out that output stream
+    - follow: If set, stream lines as plain text as the app writes them
+    - stream: If set, stream the lines as plain text instead of returning JSON
+
+    Responses are gzipped for clients that accept it.
+    """
+    follow = bool(request.args.get("follow"))
+    streamed = follow or bool(request.args.get("stream"))
+
     try:
-        tail = request.args.get("tail", default=100, type=int)
-        logs = container_deployer.get_container_logs(app_name, tail=tail)
+        # Search everything by default, unless the result has to fit in JSON
+        tail = parse_tail(request.args.get("tail"),
+                          default="all" if request.args.get("grep") and streamed else 100)
+        log_filter = LogFilter(
+            since=parse_since(request.args.get("since")),
+            until=parse_since(request.args.get("until"), "until"),
+            stdout=request.args.get("stdout", "1") != "0",
+            stderr=request.args.get("stderr", "1") != "0",
+            pattern=parse_grep(request.args.get("grep"))
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    if not log_filter.stdout and not log_filter.stderr:
+        return jsonify({"status": "error", "error": "stdout and stderr can't both be left out"}), 400
+
+    if not streamed:
+        if tail == "all" or tail > MAX_JSON_LOG_TAIL:
+            return jsonify({
+                "status": "error",
+                "error": f"tail above {MAX_JSON_LOG_TAIL} must be streamed; add stream=1"
+            }), 400
 
-        if logs is not None:
-            return jsonify({"status": "success", "app": app_name, "logs": logs}), 200
-        else:
-            return jsonify({"status": "error", "error": "App not found"}), 404
+        try:
+            logs = container_deployer.get_container_logs(app_name, tail=tail, log_filter=log_filter)
+
+            if logs is not None:
+                return gzipped(jsonify({"status": "success", "app": app_name, "logs": logs})), 200
+            else:
+                return jsonify({"status": "error", "error": "App not found"}), 404
+
+        except Exception as e:
+            logger.error(f"Error getting app logs: {str(e)}")
+            return jsonify({"status": "error", "error": str(e)}), 500
 
+    if follow and not log_streams.acquire(blocking=False):
+        return jsonify({"status": "error", "error": "Too many log streams open; try again later"}), 429
+
+    try:
+        lines = container_deployer.stream_container_logs(app_name, tail=tail, log_filter=log_filter,
+                                                         follow=follow)
     except Exception as e:
+        if follow:
+            log_streams.release()
         logger.error(f"Error getting app logs: {str(e)}")
         return jsonify({"status": "error", "error": str(e)}), 500
 
+    if lines is None:
+        if follow:
+            log_streams.release()
+        return jsonify({"status": "error", "error": "App not found"}), 404
+
+    # A snapshot is sent in large chunks; followed lines go out as they come
+    chunks = lines if follow else batched(lines)
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip():
+        chunks = gzip_stream(chunks, flush_each=follow)
+        headers["Content-Encoding"] = "gzip"
+
+    response = Response(stream_with_context(chunks), mimetype="text/plain", headers=headers)
+    if follow:
+        response.call_on_close(log_streams.release)
+    return response
+
+
+@app.route("/api/logs/search", methods=["GET"])
+@require_auth
+def search_logs():
+    """
+    Search the archived logs of all apps
+
+    Query parameters:
+    - q: Words every returned line must contain, case-insensitive
+    - apps: Comma-separated app names (default: all)
+    - from, to: Only lines after/before this Unix time, or this long ago
+      (e.g. 30s, 10m, 2h)
+    - limit: Most lines to return, newest first (default 100, max 1000)
+    """
+    if log_archive is None:
+        return jsonify({"status": "error", "error": "Log archive is disabled"}), 404
+
+    apps = [name for name in request.args.get("apps", "").split(",") if name] or None
+    try:
+        start = parse_since(request.args.get("from"), "from")
+        end = parse_since(request.args.get("to"), "to")
+        limit = request.args.get("limit", "100")
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_SEARCH_LIMIT:
+            raise ValueError(f"'limit' must be a number from 1 to {MAX_SEARCH_LIMIT}")
+        result = log_archive.search(request.args.get("q", ""), apps=apps, start=start, end=end, limit=int(limit))
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    for match in result["matches"]:
+        del match["time"]
+    return gzipped(jsonify({"status": "success", **result})), 200
+
+
+def parse_tail(value: Optional[str], default: Union[int, str]) -> Union[int, str]:
+    """
+    Parse a log 'tail' parameter
+
+    Raises:
+        ValueError: If value is neither a number nor 'all'
+    """
+    if not value:
+        return default
+    if value == "all":
+        return value
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        raise ValueError(f"Invalid 'tail': {value}; use a number of lines or 'all'")
+
+
+def parse_grep(value: Optional[str]) -> Optional[Pattern]:
+    """
+    Compile a log 'grep' parameter
+
+    Raises:
+        ValueError: If value is too long or isn't a valid regular expression
+    """
+    if not value:
+        return None
+    if len(value) > MAX_GREP_LENGTH:
+        raise ValueError(f"'grep' is longer than {MAX_GREP_LENGTH} characters")
+    try:
+        return re.compile(value)
+    except re.error as e:
+        raise ValueError(f"Invalid 'grep': {e}")
+
+
+def accepts_gzip() -> bool:
+    """Whether the client accepts a gzipped response"""
+    return request.accept_encodings["gzip"] > 0
+
+
+def gzipped(response: Response) -> Response:
+    """Gzip a buffered response for clients that accept it"""
+    response.vary.add("Accept-Encoding")
+    if accepts_gzip() and response.content_length and response.content_length > GZIP_MIN_SIZE:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def gzip_stream(chunks: Iterator[str], flush_each: bool = False) -> Iterator[bytes]:
+    """
+    Gzip a text stream as it is sent
+
+    Args:
+        chunks: Text to compress
+        flush_each: Flush after every chunk so the client can decompress
+            it right away, for streams that are read as they are written
+
+    Yields:
+        Compressed bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if flush_each:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def batched(lines: Iterator[str], size: int = 64 * 1024) -> Iterator[str]:
+    """Join lines into chunks of about size characters"""
+    batch, length = [], 0
+    for line in lines:
+        batch.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(batch)
+            batch, length = [], 0
+    if batch:
+        yield "".join(batch)
+
+
+def parse_since(value: Optional[str], name: str = "since") -> Optional[float]:
+    """
+    Parse a log 'since' or 'until' parameter
+
+    Args:
+        value: Unix time, or a duration ago such as 30s, 10m, 2h or 1d
+        name: Parameter name for the error message
+
+    Returns:
+        Unix time, or None if value is empty
+
+    Raises:
+        ValueError: If value is neither
+    """
+    if not value:
+        return None
+    unit = SINCE_UNITS.get(value[-1])
+    try:
+        since = time.time() - float(value[:-1]) * unit if unit else float(value)
+    except ValueError:
+        since = 0
+    if since <= 0:
+        raise ValueError(f"Invalid '{name}': {value}; use a Unix time or a duration like 10m")
+    return since
+
 
 def validate_vesla_config(vesla_config: dict) -> str:
     """
@@ -252,8 +1297,7 @@ def validate_vesla_config(vesla_config: dict) -> str:
         return "Missing required field: 'domain'"
 
     # Validate app name (alphanumeric and hyphens only)
-    app_name = vesla_config["app"]
-    if not app_name.replace("-", "").replace("_", "").isalnum():
+    if not is_valid_app_name(vesla_config["app"]):
         return "App name must contain only letters, numbers, hyphens, and underscores"
 
     # Validate domain
@@ -264,9 +1308,89 @@ def validate_vesla_config(vesla_config: dict) -> str:
         allowed = ", ".join(config["allowed_domains"])
         return f"Domain must use one of the allowed base domains: {allowed}"
 
+    port = (vesla_config.get("env") or {}).get("PORT")
+    if port is not None and not (str(port).isdigit() and 1 <= int(port) <= 65535):
+        return "'env.PORT' must be a port number from 1 to 65535"
+
+    replicas = vesla_config.get("replicas", 1)
+    max_replicas = container_deployer.max_replicas
+    if isinstance(replicas, bool) or not isinstance(replicas, int) or not 1 <= replicas <= max_replicas:
+        return f"'replicas' must be a number from 1 to {max_replicas}"
+
+    autoscale = vesla_config.get("autoscale")
+    if autoscale is not None:
+        return validate_autoscale(autoscale, max_replicas)
+
+    return None
+
+
+def validate_autoscale(autoscale: dict, max_replicas: int) -> str:
+    """
+    Validate the autoscale policy of a vesla.yaml
+
+    Returns:
+        Error message if validation fails, None if valid
+    """
+    if not isinstance(autoscale, dict):
+        return "'autoscale' must be a mapping"
+
+    min_replicas = autoscale.get("min_replicas", 1)
+    top = autoscale.get("max_replicas", max_replicas)
+    for value in (min_replicas, top):
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= max_replicas:
+            return f"autoscale min_replicas and max_replicas must be numbers from 1 to {max_replicas}"
+    if min_replicas > top:
+        return "autoscale min_replicas can't be above max_replicas"
+
+    targets = [autoscale.get(key) for key in ("target_latency", "target_cpu")]
+    if all(target is None for target in targets):
+        return "autoscale needs target_latency (seconds) or target_cpu (percent)"
+    for target in targets:
+        if target is not None and (isinstance(target, bool) or not isinstance(target, (int, float)) or target <= 0):
+            return "autoscale target_latency and target_cpu must be positive numbers"
+
     return None
 
 
+def validate_project_config(project_config: dict) -> str:
+    """
+    Validate a project manifest: a project name and the apps to deploy from it
+
+    Returns:
+        Error message if validation fails, None if valid
+    """
+    if not is_valid_app_name(project_config.get("project")):
+        return "Project name must contain only letters, numbers, hyphens, and underscores"
+
+    apps = project_config["apps"]
+    if not isinstance(apps, list) or not apps:
+        return "'apps' must be a non-empty list"
+
+    names = set()
+    for app_config in apps:
+        if not isinstance(app_config, dict):
+            return "Each entry of 'apps' must be a vesla.yaml mapping"
+
+        path = app_config.get("path", "")
+        if not isinstance(path, str) or path.startswith("/") or ".." in path.split("/"):
+            return f"Invalid path for app {app_config.get('app')}: {path!r}"
+
+        error = validate_vesla_config(app_config)
+        if error:
+            return f"{app_config.get('app', 'app')}: {error}"
+
+        if app_config["app"] in names:
+            return f"App {app_config['app']} is listed more than once"
+        names.add(app_config["app"])
+
+    return None
+
+
+def is_valid_app_name(app_name) -> bool:
+    """App names may contain only letters, numbers, hyphens, and underscores"""
+    return isinstance(app_name, str) and app_name.replace("-", "").replace("_", "").isalnum()
+
+
 def parse_domain(fqdn: str) -> tuple:
     """
     Parse fully qualified domain name into subdomain and base domain
@@ -284,20 +1408,6 @@ def parse_domain(fqdn: str) -> tuple:
         raise ValueError(f"Invalid domain format: {fqdn}")
 
 
-def get_server_ip() -> str:
-    """Get server's public IP address"""
-    import socket
-    import urllib.request
-
-    try:
-        # Try to get public IP from external service
-        with urllib.request.urlopen('https://api.ipify.org', timeout=5) as response:
-            return response.read().decode('utf-8')
-    except Exception:
-        # Fallback to local IP (might not be public)
-        return socket.gethostbyname(socket.gethostname())
-
-
 if __name__ == "__main__":
     logger.info("Starting Vesla Server API")
     logger.info(f"Allowed domains: {config['allowed_domains']}")
@@ -0,0 +1,426 @@
+"""
+Autoscaler for Vesla
+Scales app replicas from Traefik request metrics and container CPU usage
+"""
+
+import json
+import logging
+import logging.handlers
+import math
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import docker
+import requests
+from docker.errors import APIError, DockerException
+from prometheus_client.parser import text_string_to_metric_families
+
+from metrics import AUTOSCALER_DECISIONS
+from releases import ReleaseStore, ReleaseError
+
+logger = logging.getLogger(__name__)
+
+# Traefik's per-service request duration histogram; its _count and _sum
+# give the request rate and average latency
+TRAEFIK_DURATION = "traefik_service_request_duration_seconds"
+
+# Decisions kept for the API
+MAX_DECISIONS = 100
+
+# Size of the audit log before it is rotated, and rotated files kept
+AUDIT_MAX_BYTES = 10 * 1024 * 1024
+AUDIT_BACKUPS = 3
+
+
+class Autoscaler:
+    """
+    Background replica autoscaler
+
+    Apps opt in with an 'autoscale' policy in vesla.yaml:
+
+        autoscale:
+          min_replicas: 1
+          max_replicas: 5
+          target_latency: 0.3  # Average seconds per request
+          target_cpu: 70       # Percent of each container's CPU limit
+
+    Every interval seconds the autoscaler scrapes Traefik's metrics and
+    samples the CPU usage of the app's containers. Each signal is compared
+    to its target, and the replica count is scaled in proportion to the
+    signal furthest above (or, when all are below, closest to) its target,
+    within min_replicas and max_replicas. An app that got no requests since
+    the last evaluation counts as idle. Differences within tolerance are
+    ignored.
+
+    Scaling runs as a scale job, so it never overlaps a deploy. Apps with a
+    job queued or running are left alone, and each app waits a cooldown
+    after being scaled (longer before scaling down than up). Every decision
+    to scale, or not to scale despite the metrics, is written as a JSON
+    line to the audit log.
+    """
+
+    def __init__(self, docker_client: docker.DockerClient, release_store: ReleaseStore,
+                 scale: Callable[[str, int], str], metrics_url: str, max_replicas: int = 10,
+                 interval: int = 30, scale_up_cooldown: int = 60, scale_down_cooldown: int = 300,
+                 tolerance: float = 0.1, audit_path: Optional[str] = None,
+                 is_busy: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            docker_client: Docker client
+            release_store: Release history; policies come from current releases
+            scale: Queues scaling an app to a replica count, returns the job ID
+            metrics_url: URL of Traefik's Prometheus metrics
+            max_replicas: Upper bound for max_replicas of any policy
+            interval: Seconds between evaluations
+            scale_up_cooldown: Seconds after scaling an app before it is scaled up
+            scale_down_cooldown: Seconds after scaling an app before it is scaled down
+            tolerance: Relative distance from a target that doesn't trigger scaling
+            audit_path: File the decisions are appended to (none if unset)
+            is_busy: Returns True for apps with a job queued or running
+        """
+        self.docker = docker_client
+        self.release_store = release_store
+        self.scale = scale
+        self.metrics_url = metrics_url
+        self.max_replicas = max_replicas
+        self.interval = interval
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.tolerance = tolerance
+        self.is_busy = is_busy or (lambda app_name: False)
+
+        self.runs = 0
+        self.last_run = None
+        self.last_error = None
+        self.apps = {}  # App name -> signals and desired replicas of the last evaluation
+        self.decisions = deque(maxlen=MAX_DECISIONS)
+        self._traffic = {}  # App name -> (time, request count, duration sum) of the last scrape
+        self._cpu_samples = {}  # Container ID -> (CPU usage, system CPU usage)
+        self._last_scaled = {}  # App name -> (time, replicas) of the last scaling queued
+        self._last_hold = {}
+        self._scrape_warned = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._audit = None
+        if audit_path:
+            self._audit = logging.getLogger(f"{__name__}.audit")
+            self._audit.propagate = False
+            self._audit.setLevel(logging.INFO)
+            Path(audit_path).parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                audit_path, maxBytes=AUDIT_MAX_BYTES, backupCount=AUDIT_BACKUPS, delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._audit.addHandler(handler)
+
+    def start(self):
+        """Start evaluating from a background thread"""
+        thread = threading.Thread(target=self._loop, name="vesla-autoscaler", daemon=True)
+        thread.start()
+
+    def stop(self):
+        """Stop the background thread after the current evaluation"""
+        self._stop.set()
+
+    def evaluate(self) -> List[dict]:
+        """
+        Run one evaluation of every app with an autoscale policy
+
+        Returns:
+            Decisions taken (scale or hold), empty if nothing needed to change
+        """
+        now = time.time()
+        policies = self._policies()
+        if not policies:
+            with self._lock:
+                self.runs += 1
+                self.last_run = now
+                self.apps = {}
+            return []
+
+        traffic = self._scrape()
+        containers = self._running_containers()
+        cpu = self._cpu_usage({app_name: containers.get(app_name, []) for app_name, policy in policies.items()
+                               if policy.get("target_cpu")})
+
+        decisions, apps = [], {}
+        for app_name, policy in policies.items():
+            current = len(containers.get(app_name, []))
+            latency, rate = self._traffic_signal(app_name, traffic, now)
+            if current == 0:
+                continue  # Stopped or never started; nothing to scale
+
+            signals = {"latency": latency, "cpu": cpu.get(app_name)}
+            desired, reason = self._desired(current, policy, signals, rate)
+            apps[app_name] = {
+                "replicas": current,
+                "desired": desired,
+                "latency": _rounded(latency, 3),
+                "requests_per_second": _rounded(rate, 2),
+                "cpu_percent": _rounded(signals["cpu"], 1),
+                "min_replicas": policy["min_replicas"],
+                "max_replicas": policy["max_replicas"],
+            }
+
+            if desired != current:
+                decision = self._decide(app_name, current, desired, reason, apps[app_name], now)
+                if decision:
+                    decisions.append(decision)
+            else:
+                self._last_hold.pop(app_name, None)
+
+        with self._lock:
+            self.runs += 1
+            self.last_run = now
+            self.apps = apps
+        return decisions
+
+    def stats(self) -> dict:
+        """Autoscaler state, last evaluation and recent decisions for the API"""
+        with self._lock:
+            return {
+                "metrics_url": self.metrics_url,
+                "interval": self.interval,
+                "scale_up_cooldown": self.scale_up_cooldown,
+                "scale_down_cooldown": self.scale_down_cooldown,
+                "runs": self.runs,
+                "last_run": self.last_run,
+                "last_error": self.last_error,
+                "apps": dict(self.apps),
+                "decisions": list(reversed(self.decisions)),
+            }
+
+    def _loop(self):
+        """Background thread: evaluate every interval"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.evaluate()
+            except Exception as e:
+                logger.error(f"Autoscaler evaluation failed: {e}")
+
+    def _policies(self) -> Dict[str, dict]:
+        """Autoscale policies from the current release of every app"""
+        policies = {}
+        for app_name in self.release_store.apps():
+            try:
+                release = self.release_store.current(app_name)
+            except ReleaseError as e:
+                logger.warning(f"Could not read releases of {app_name}: {e}")
+                continue
+            autoscale = (release or {}).get("config", {}).get("autoscale")
+            if autoscale:
+                policies[app_name] = {
+                    "min_replicas": int(autoscale.get("min_replicas", 1)),
+                    "max_replicas": int(autoscale.get("max_replicas", self.max_replicas)),
+                    "target_latency": autoscale.get("target_latency"),
+                    "target_cpu": autoscale.get("target_cpu"),
+                }
+        return policies
+
+    def _scrape(self) -> Optional[Dict[str, Tuple[float, float]]]:
+        """
+        Request count and total duration per app from Traefik
+
+        Returns:
+            Mapping of app name to (requests, seconds) since Traefik started,
+            or None if the metrics can't be read
+        """
+        try:
+            response = requests.get(self.metrics_url, timeout=5)
+            response.raise_for_status()
+            families = list(text_string_to_metric_families(response.text))
+        except (requests.RequestException, ValueError) as e:
+            with self._lock:
+                self.last_error = f"Could not read Traefik metrics: {e}"
+            if not self._scrape_warned:
+                logger.warning(f"Could not read Traefik metrics from {self.metrics_url}: {e}; "
+                               "autoscaling on CPU only until they can be read (see autoscaler.metrics_url)")
+                self._scrape_warned = True
+            return None
+
+        with self._lock:
+            self.last_error = None
+        self._scrape_warned = False
+
+        traffic = {}
+        for family in families:
+            if family.name != TRAEFIK_DURATION:
+                continue
+            for sample in family.samples:
+                # Docker provider services are named <app>@docker
+                app_name = sample.labels.get("service", "").split("@", 1)[0]
+                count, total = traffic.get(app_name, (0.0, 0.0))
+                if sample.name == f"{TRAEFIK_DURATION}_count":
+                    traffic[app_name] = (count + sample.value, total)
+                elif sample.name == f"{TRAEFIK_DURATION}_sum":
+                    traffic[app_name] = (count, total + sample.value)
+        return traffic
+
+    def _traffic_signal(self, app_name: str, traffic: Optional[Dict[str, Tuple[float, float]]],
+                        now: float) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Average latency and request rate of an app since the last scrape
+
+        Returns:
+            Tuple of (seconds per request, requests per second). Latency is 0
+            for an app without requests, and both are None without data.
+        """
+        if traffic is None:
+            return None, None
+
+        count, total = traffic.get(app_name, (0.0, 0.0))
+        previous = self._traffic.get(app_name)
+        self._traffic[app_name] = (now, count, total)
+        if previous is None:
+            return None, None
+
+        elapsed, requests_done = now - previous[0], count - previous[1]
+        if requests_done < 0 or elapsed <= 0:
+            return None, None  # Traefik restarted and its counters were reset
+        if requests_done == 0:
+            return 0.0, 0.0
+        return (total - previous[2]) / requests_done, requests_done / elapsed
+
+    def _running_containers(self) -> Dict[str, list]:
+        """Running Vesla containers by app name"""
+        containers = {}
+        for container in self.docker.containers.list(filters={"label": "vesla.managed=true", "status": "running"}):
+            containers.setdefault(container.labels.get("vesla.app"), []).append(container)
+        return containers
+
+    def _cpu_usage(self, containers: Dict[str, list]) -> Dict[str, float]:
+        """
+        Average CPU usage of each app's containers since the last evaluation
+
+        Usage is in percent of a container's CPU limit (or of the host's CPUs
+        without a limit). Each container is sampled once per evaluation and
+        compared with its previous sample, so no stats call blocks.
+
+        Returns:
+            Mapping of app name to percent, for apps with two samples
+        """
+        usage, samples = {}, {}
+        for app_name, app_containers in containers.items():
+            percents = []
+            for container in app_containers:
+                try:
+                    stats = container.stats(stream=False, one_shot=True)
+                except (APIError, DockerException) as e:
+                    logger.debug(f"Could not read stats of {container.name}: {e}")
+                    continue
+
+                cpu_stats = stats.get("cpu_stats", {})
+                total = cpu_stats.get("cpu_usage", {}).get("total_usage")
+                system = cpu_stats.get("system_cpu_usage")
+                if total is None or system is None:
+                    continue
+                samples[container.id] = (total, system)
+
+                previous = self._cpu_samples.get(container.id)
+                if previous is None or system <= previous[1]:
+                    continue
+                online = cpu_stats.get("online_cpus") or 1
+                cores = (total - previous[0]) / (system - previous[1]) * online
+                limit = (container.attrs.get("HostConfig", {}).get("NanoCpus") or 0) / 1e9 or online
+                percents.append(cores / limit * 100)
+
+            if percents:
+                usage[app_name] = sum(percents) / len(percents)
+
+        self._cpu_samples = samples  # Forget containers that are gone
+        return usage
+
+    def _desired(self, current: int, policy: dict, signals: Dict[str, Optional[float]],
+                 rate: Optional[float]) -> Tuple[int, str]:
+        """
+        Replica count a policy asks for
+
+        Returns:
+            Tuple of (replicas, reason)
+        """
+        ratios = []
+        if policy.get("target_latency") and signals["latency"] is not None:
+            ratios.append(("latency", signals["latency"] / float(policy["target_latency"]),
+                           f"latency {signals['latency']:.3f}s, target {policy['target_latency']}s"))
+        if policy.get("target_cpu") and signals["cpu"] is not None:
+            ratios.append(("cpu", signals["cpu"] / float(policy["target_cpu"]),
+                           f"CPU {signals['cpu']:.0f}%, target {policy['target_cpu']}%"))
+
+        desired, reason = current, "within targets"
+        if ratios:
+            _, ratio, reason = max(ratios, key=lambda signal: signal[1])
+            if rate == 0 and ratio == 0:
+                reason = "no requests"
+            if abs(ratio - 1) > self.tolerance:
+                desired = math.ceil(current * ratio)
+
+        bounded = min(max(desired, policy["min_replicas"]), policy["max_replicas"])
+        if bounded != desired and bounded != current:
+            reason = f"{reason}; limited to {policy['min_replicas']}-{policy['max_replicas']} replicas"
+        return bounded, reason
+
+    def _decide(self, app_name: str, current: int, desired: int, reason: str,
+                signals: dict, now: float) -> Optional[dict]:
+        """
+        Scale an app, or hold it if it's busy or cooling down
+
+        Returns:
+            The decision, or None for a hold identical to the app's last one
+        """
+        direction = "up" if desired > current else "down"
+        cooldown = self.scale_up_cooldown if direction == "up" else self.scale_down_cooldown
+        last_time, last_target = self._last_scaled.get(app_name, (0, None))
+        since_scaled = now - last_time
+        job_id = None
+
+        if desired == last_target and since_scaled < cooldown:
+            return None  # Scaling to this count was just queued and may still be running
+        if self.is_busy(app_name):
+            action, hold_reason = "hold", "job in progress"
+        elif since_scaled < cooldown:
+            action, hold_reason = "hold", f"cooldown, {cooldown - since_scaled:.0f}s left"
+        else:
+            action, hold_reason = f"scale_{direction}", None
+
+        if action == "hold":
+            if self._last_hold.get(app_name) == (desired, hold_reason.split(",")[0]):
+                return None
+            self._last_hold[app_name] = (desired, hold_reason.split(",")[0])
+            reason = f"{reason} ({hold_reason})"
+        else:
+            self._last_hold.pop(app_name, None)
+            try:
+                job_id = self.scale(app_name, desired)
+            except Exception as e:
+                action, reason = "error", f"{reason}; could not queue scaling: {e}"
+            else:
+                self._last_scaled[app_name] = (now, desired)
+
+        decision = {
+            "time": now,
+            "app": app_name,
+            "action": action,
+            "from": current,
+            "to": desired,
+            "reason": reason,
+            "job_id": job_id,
+            "signals": {key: signals[key] for key in ("latency", "requests_per_second", "cpu_percent")},
+        }
+
+        with self._lock:
+            self.decisions.append(decision)
+        AUTOSCALER_DECISIONS.labels(action=action).inc()
+        if self._audit:
+            self._audit.info(json.dumps(decision))
+
+        log = logger.warning if action == "error" else logger.info
+        log(f"Autoscaler: {app_name} {action} {current} -> {desired} ({reason})")
+        return decision
+
+
+def _rounded(value: Optional[float], digits: int) -> Optional[float]:
+    return round(value, digits) if value is not None else None
@@ -0,0 +1,213 @@
+"""
+Blob Store for Vesla
+Content-addressed per-app storage of source files for incremental uploads
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobStoreError(Exception):
+    """Raised for invalid manifests or blob uploads"""
+    pass
+
+
+class BlobStore:
+    """
+    Stores source files by SHA-256 content hash, one directory per app
+
+    The CLI sends a manifest of paths and hashes, uploads only the blobs the
+    store is missing, and the server assembles the build context from the
+    store.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def missing(self, app_name: str, hashes: Iterable[str]) -> List[str]:
+        """
+        Find which blobs an app's store doesn't have yet
+
+        Args:
+            app_name: Application name
+            hashes: SHA-256 hex digests
+
+        Returns:
+            Hashes that need to be uploaded, in input order, without duplicates
+        """
+        missing, seen = [], set()
+        for digest in hashes:
+            _check_hash(digest)
+            if digest not in seen and not self._blob_path(app_name, digest).exists():
+                missing.append(digest)
+            seen.add(digest)
+        return missing
+
+    def add_from_tarball(self, app_name: str, fileobj: BinaryIO) -> int:
+        """
+        Store blobs from an uploaded tarball whose members are named by hash
+
+        Each blob's content is hashed while it is written and rejected if it
+        doesn't match its name.
+
+        Args:
+            app_name: Application name
+            fileobj: Gzipped tar stream of blobs
+
+        Returns:
+            Number of blobs stored
+
+        Raises:
+            BlobStoreError: If the upload is malformed or a hash doesn't match
+        """
+        stored = 0
+
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+                for member in tar:
+                    if not member.isreg():
+                        continue
+                    digest = os.path.basename(member.name)
+                    _check_hash(digest)
+                    self._write_blob(app_name, digest, tar.extractfile(member))
+                    stored += 1
+        except tarfile.TarError as e:
+            raise BlobStoreError(f"Invalid blob upload: {e}")
+
+        logger.info(f"Stored {stored} blobs for {app_name}")
+        return stored
+
+    def assemble(self, app_name: str, manifest: List[dict]) -> str:
+        """
+        Build an uncompressed tarball of a source tree from stored blobs
+
+        Args:
+            app_name: Application name
+            manifest: Entries of {"path", "hash", "mode"} for files,
+                {"path", "link"} for symlinks or {"path", "dir": true} for
+                empty directories
+
+        Returns:
+            Path to the assembled tarball (caller removes it)
+
+        Raises:
+            BlobStoreError: If the manifest is invalid or blobs are missing
+        """
+        missing = self.missing(app_name, [entry["hash"] for entry in manifest if "hash" in entry])
+        if missing:
+            raise BlobStoreError(f"{len(missing)} blobs missing from store")
+
+        fd, tarball_path = tempfile.mkstemp(suffix=".tar", prefix=f"vesla-{app_name}-")
+        now = int(time.time())
+
+        try:
+            with os.fdopen(fd, "wb") as out, tarfile.open(fileobj=out, mode="w") as tar:
+                for entry in manifest:
+                    path = _check_path(entry.get("path", ""))
+                    info = tarfile.TarInfo(path)
+                    info.mtime = now
+
+                    if "link" in entry:
+                        info.type = tarfile.SYMTYPE
+                        info.linkname = entry["link"]
+                        tar.addfile(info)
+                        continue
+
+                    if entry.get("dir"):
+                        info.type = tarfile.DIRTYPE
+                        info.mode = 0o755
+                        tar.addfile(info)
+                        continue
+
+                    blob_path = self._blob_path(app_name, entry["hash"])
+                    info.size = blob_path.stat().st_size
+                    info.mode = int(entry.get("mode", 0o644)) & 0o777
+                    with open(blob_path, "rb") as blob:
+                        tar.addfile(info, blob)
+
+                    # Mark blobs as recently used for prune()
+                    os.utime(blob_path)
+        except Exception:
+            os.unlink(tarball_path)
+            raise
+
+        return tarball_path
+
+    def prune(self, app_name: str, max_age: int) -> int:
+        """
+        Remove an app's blobs not used by any assembly within max_age seconds
+
+        Returns:
+            Number of blobs removed
+        """
+        app_dir = self._app_dir(app_name)
+        if not app_dir.exists():
+            return 0
+
+        cutoff = time.time() - max_age
+        removed = 0
+        for blob_path in app_dir.glob("*/*"):
+            try:
+                if blob_path.stat().st_mtime < cutoff:
+                    blob_path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+
+        if removed:
+            logger.info(f"Pruned {removed} unused blobs for {app_name}")
+        return removed
+
+    def _write_blob(self, app_name: str, digest: str, source: BinaryIO):
+        """Write a blob atomically, verifying its content hash"""
+        blob_path = self._blob_path(app_name, digest)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=blob_path.parent, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    sha.update(chunk)
+                    out.write(chunk)
+
+            if sha.hexdigest() != digest:
+                raise BlobStoreError(f"Content of blob {digest[:12]} doesn't match its hash")
+
+            os.replace(tmp_path, blob_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _app_dir(self, app_name: str) -> Path:
+        return self.root / app_name
+
+    def _blob_path(self, app_name: str, digest: str) -> Path:
+        return self._app_dir(app_name) / digest[:2] / digest
+
+
+def _check_hash(digest: str):
+    if not isinstance(digest, str) or not HASH_PATTERN.match(digest):
+        raise BlobStoreError(f"Invalid blob hash: {digest!r}")
+
+
+def _check_path(path: str) -> str:
+    """Reject manifest paths that would escape the build context"""
+    parts = Path(path).parts
+    if not path or path.startswith("/") or ".." in parts:
+        raise BlobStoreError(f"Invalid path in manifest: {path!r}")
+    return path
@@ -0,0 +1,398 @@
+"""
+Build Context Streaming for Vesla
+Indexes uploaded code tarballs and streams them to the Docker daemon as a build context
+"""
+
+import copy
+import fnmatch
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Files whose content runtime detection needs to read
+CAPTURED_FILES = {"package.json"}
+
+# Largest captured file kept in memory
+MAX_CAPTURED_SIZE = 1024 * 1024
+
+# Files left out of the tree hash: vesla.yaml only carries deploy settings,
+# so changing it alone shouldn't count as a source change
+TREE_HASH_EXCLUDES = {"vesla.yaml"}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ContextError(Exception):
+    """Raised when an uploaded tarball can't be used as a build context"""
+    pass
+
+
+class SourceIndex:
+    """
+    File listing of an uploaded source tree
+
+    Built from the tarball's member index in a single decompression pass, so
+    runtime detection never needs an extracted copy of the tree on disk.
+    """
+
+    def __init__(self, files: Set[str], dirs: Set[str], contents: Dict[str, bytes],
+                 data_end: int = 0, digests: Optional[Dict[str, str]] = None,
+                 tree_hash: Optional[str] = None):
+        self.files = files
+        self.dirs = dirs
+        self.contents = contents
+        self.digests = digests or {}  # SHA-256 of hashed files
+        self.tree_hash = tree_hash
+        self.data_end = data_end  # Offset of the end-of-archive marker
+        self.top_level = {name for name in files | dirs if "/" not in name}
+
+    @classmethod
+    def from_tarball(cls, tarball_path: str, captured_files: Optional[Set[str]] = None,
+                     hashed_files: Optional[Set[str]] = None,
+                     hash_tree: bool = False) -> "SourceIndex":
+        """
+        Index a code tarball (gzipped or plain)
+
+        Args:
+            tarball_path: Path to code tarball (.tar.gz or .tar)
+            captured_files: Paths whose content should be kept for later reads
+            hashed_files: Paths whose SHA-256 should be computed, at any size
+            hash_tree: Compute tree_hash, a digest of every path, permission
+                and file content that ignores timestamps, owners and member order
+
+        Returns:
+            SourceIndex of the tarball
+
+        Raises:
+            ContextError: If the tarball can't be read
+        """
+        captured_files = CAPTURED_FILES if captured_files is None else captured_files
+        hashed_files = hashed_files or set()
+        files, dirs, contents, digests = set(), set(), {}, {}
+        tree_entries = []
+        data_end = 0
+
+        try:
+            with tarfile.open(tarball_path, "r|*") as tar:
+                for member in tar:
+                    data_end = member.offset_data + _padded(member.size if member.isreg() else 0)
+
+                    name = normalize_name(member.name)
+                    if not name:
+                        continue
+
+                    if member.isdir():
+                        dirs.add(name)
+                        continue
+
+                    files.add(name)
+                    dirs.update(_parents(name))
+                    in_tree = hash_tree and name not in TREE_HASH_EXCLUDES
+
+                    if not member.isreg():
+                        if in_tree:
+                            tree_entries.append(f"{name}\0link\0{member.linkname}")
+                        continue
+
+                    digest = None
+                    if name in captured_files and member.size <= MAX_CAPTURED_SIZE:
+                        contents[name] = tar.extractfile(member).read()
+                        if name in hashed_files or in_tree:
+                            digest = hashlib.sha256(contents[name]).hexdigest()
+                    elif name in hashed_files or in_tree:
+                        sha = hashlib.sha256()
+                        data = tar.extractfile(member)
+                        for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+                            sha.update(chunk)
+                        digest = sha.hexdigest()
+
+                    if name in hashed_files:
+                        digests[name] = digest
+                    if in_tree:
+                        tree_entries.append(f"{name}\0file\0{member.mode & 0o777:o}\0{digest}")
+
+        except (tarfile.TarError, OSError, EOFError) as e:
+            raise ContextError(f"Invalid code tarball: {e}")
+
+        tree_hash = None
+        if hash_tree:
+            # Directories come from the file paths, so uploads with and
+            # without explicit directory members hash the same
+            tree_entries.extend(f"{name}\0dir" for name in dirs)
+            tree_hash = hashlib.sha256("\n".join(sorted(tree_entries)).encode("utf-8", "surrogateescape")).hexdigest()
+
+        logger.debug(f"Indexed {len(files)} files from {tarball_path}")
+        return cls(files, dirs, contents, data_end, digests, tree_hash)
+
+    def exists(self, path: str) -> bool:
+        """Check whether a file or directory exists in the tree"""
+        path = normalize_name(path)
+        return path in self.files or path in self.dirs
+
+    def glob(self, pattern: str) -> List[str]:
+        """Match top-level file names against a shell-style pattern"""
+        return sorted(name for name in self.files
+                      if "/" not in name and fnmatch.fnmatch(name, pattern))
+
+    def read_text(self, path: str) -> Optional[str]:
+        """Content of a captured file, or None if it wasn't captured"""
+        content = self.contents.get(normalize_name(path))
+        return content.decode("utf-8", errors="replace") if content is not None else None
+
+
+def normalize_name(name: str) -> str:
+    """Strip the './' prefix and trailing slashes tar member names may carry"""
+    while name.startswith("./"):
+        name = name[2:]
+    name = name.strip("/")
+    return "" if name == "." else name
+
+
+def stream_context(tarball_path: str, index: SourceIndex,
+                   extra_files: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    """
+    Stream an uploaded tarball to the daemon as an uncompressed build context
+
+    The archive's members are decompressed and passed through untouched, then
+    extra_files (e.g. a generated Dockerfile) are appended as new members
+    before the end-of-archive marker. Memory use is bounded by CHUNK_SIZE.
+
+    Args:
+        tarball_path: Path to code tarball (.tar.gz or .tar)
+        index: SourceIndex of the same tarball
+        extra_files: Mapping of member name to text content to add
+
+    Yields:
+        Chunks of the uncompressed tar stream
+    """
+    opener = gzip.open if is_gzipped(tarball_path) else open
+    with opener(tarball_path, "rb") as source:
+        remaining = index.data_end
+        while remaining > 0:
+            chunk = source.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ContextError("Code tarball ended unexpectedly")
+            remaining -= len(chunk)
+            yield chunk
+
+    yield from _extra_members(extra_files)
+
+
+def subset_context(tarball_path: str, names: Set[str],
+                   extra_files: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    """
+    Stream a build context holding only some files of an uploaded tarball
+
+    Used for dependency images, whose context is just the lockfiles. Members
+    are written with mtime 0 so identical files give identical contexts.
+
+    Args:
+        tarball_path: Path to code tarball (.tar.gz or .tar)
+        names: Paths of the regular files to include
+        extra_files: Mapping of member name to text content to add
+
+    Yields:
+        Chunks of the uncompressed tar stream
+    """
+    try:
+        with tarfile.open(tarball_path, "r|*") as tar:
+            for member in tar:
+                name = normalize_name(member.name)
+                if name not in names or not member.isreg():
+                    continue
+
+                info = tarfile.TarInfo(name)
+                info.size = member.size
+                info.mode = member.mode
+                info.mtime = 0
+                yield info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+
+                data = tar.extractfile(member)
+                for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+                    yield chunk
+                yield b"\0" * (_padded(member.size) - member.size)
+    except (tarfile.TarError, OSError, EOFError) as e:
+        raise ContextError(f"Invalid code tarball: {e}")
+
+    yield from _extra_members(extra_files)
+
+
+def split_tarball(tarball_path: str, paths: Dict[str, str]) -> Dict[str, str]:
+    """
+    Write one uncompressed tarball per subdirectory of an uploaded tarball
+
+    Used for project deploys, where one upload holds several apps. Each
+    output holds the files under its subdirectory, renamed relative to it,
+    so it can be built like an upload of that app alone. The upload is read
+    in a single pass however many apps it holds, plus a second one if a hard
+    link points outside its app: such links are written as regular files
+    with their target's content.
+
+    Args:
+        tarball_path: Path to code tarball (.tar.gz or .tar)
+        paths: Mapping of key (e.g. app name) to subdirectory; '' is the whole tree
+
+    Returns:
+        Mapping of the same keys to paths of the written tarballs; the
+        caller removes them
+
+    Raises:
+        ContextError: If the upload can't be read, a hard link's target is
+            missing or a subdirectory has no files
+    """
+    prefixes = {key: normalize_name(path) for key, path in paths.items()}
+    outputs, counts = {}, dict.fromkeys(prefixes, 0)
+    outside_links = []  # (key, renamed member, target) of hard links to files outside their app
+
+    try:
+        for key in prefixes:
+            fd, output_path = tempfile.mkstemp(suffix=".tar", prefix=f"vesla-{key}-")
+            os.close(fd)
+            outputs[key] = tarfile.open(output_path, "w", format=tarfile.GNU_FORMAT)
+
+        with tarfile.open(tarball_path, "r|*") as tar:
+            for member in tar:
+                name = normalize_name(member.name)
+                targets = [(key, _relative(name, prefix)) for key, prefix in prefixes.items()]
+                targets = [(key, relative) for key, relative in targets if relative]
+                if not name or not targets:
+                    continue
+
+                data = None
+                if member.isreg():
+                    # Buffer once; small files stay in memory
+                    data = tempfile.SpooledTemporaryFile(max_size=MAX_CAPTURED_SIZE)
+                    shutil.copyfileobj(tar.extractfile(member), data, CHUNK_SIZE)
+
+                for key, relative in targets:
+                    info = copy.copy(member)
+                    info.name = relative
+                    if member.islnk():
+                        target = normalize_name(member.linkname)
+                        info.linkname = _relative(target, prefixes[key])
+                        if not info.linkname:
+                            outside_links.append((key, info, target))
+                            continue
+                    if data is not None:
+                        data.seek(0)
+                        counts[key] += 1
+                    outputs[key].addfile(info, data)
+
+                if data is not None:
+                    data.close()
+
+        if outside_links:
+            _copy_link_targets(tarball_path, outputs, outside_links, counts)
+
+    except (tarfile.TarError, OSError, EOFError) as e:
+        _remove_outputs(outputs)
+        raise ContextError(f"Invalid code tarball: {e}")
+    except ContextError:
+        _remove_outputs(outputs)
+        raise
+
+    for output in outputs.values():
+        output.close()
+
+    empty = [paths[key] or "." for key, count in counts.items() if not count]
+    if empty:
+        _remove_outputs(outputs)
+        raise ContextError(f"No files under {', '.join(empty)}")
+
+    return {key: output.name for key, output in outputs.items()}
+
+
+def _copy_link_targets(tarball_path: str, outputs: Dict[str, tarfile.TarFile],
+                       links: List[Tuple[str, tarfile.TarInfo, str]], counts: Dict[str, int]):
+    """
+    Write hard links whose target is outside their app as regular files
+
+    Raises:
+        ContextError: If a link's target isn't a regular file in the upload
+    """
+    wanted = {}  # Target path -> (key, link member) of the links to it
+    for key, info, target in links:
+        wanted.setdefault(target, []).append((key, info))
+
+    with tarfile.open(tarball_path, "r|*") as tar:
+        for member in tar:
+            links_to = wanted.get(normalize_name(member.name))
+            if not links_to or not member.isreg():
+                continue
+            del wanted[normalize_name(member.name)]
+
+            data = tempfile.SpooledTemporaryFile(max_size=MAX_CAPTURED_SIZE)
+            shutil.copyfileobj(tar.extractfile(member), data, CHUNK_SIZE)
+            for key, info in links_to:
+                info.type = tarfile.REGTYPE
+                info.linkname = ""
+                info.size = member.size
+                data.seek(0)
+                outputs[key].addfile(info, data)
+                counts[key] += 1
+            data.close()
+
+            if not wanted:
+                return
+
+    target, links_to = next(iter(wanted.items()))
+    key, info = links_to[0]
+    raise ContextError(f"Hard link {info.name} of {key} points to {target}, which isn't a file in the upload")
+
+
+def _relative(name: str, prefix: str) -> Optional[str]:
+    """Member path relative to a subdirectory, None if it's outside (or the subdirectory itself)"""
+    if not prefix:
+        return name
+    if name.startswith(prefix + "/"):
+        return name[len(prefix) + 1:]
+    return None
+
+
+def _remove_outputs(outputs: Dict[str, tarfile.TarFile]):
+    for output in outputs.values():
+        output.close()
+        try:
+            os.unlink(output.name)
+        except OSError:
+            pass
+
+
+def _extra_members(extra_files: Optional[Dict[str, str]]) -> Iterator[bytes]:
+    """Tar members for generated files, followed by the end-of-archive marker"""
+    for name, content in (extra_files or {}).items():
+        data = content.encode("utf-8")
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = 0  # Deterministic, so generated files never bust the layer cache
+        yield info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+        yield data + b"\0" * (_padded(len(data)) - len(data))
+
+    # End-of-archive marker
+    yield b"\0" * (tarfile.BLOCKSIZE * 2)
+
+
+def is_gzipped(path: str) -> bool:
+    """Check for the gzip magic number"""
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def _padded(size: int) -> int:
+    """Size rounded up to a whole number of tar blocks"""
+    blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+    return (blocks + (1 if remainder else 0)) * tarfile.BLOCKSIZE
+
+
+def _parents(name: str) -> List[str]:
+    """All parent directories of a member path"""
+    parts = name.split("/")[:-1]
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
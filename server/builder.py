@@ -3,584 +3,644 @@ Docker Image Builder for Vesla
 Handles runtime detection and Docker image building
 """
 
-import os
+import hashlib
 import logging
-import tarfile
+import os
+import re
+import subprocess
 import tempfile
-import shutil
-from pathlib import Path
-from typing import Optional, Tuple
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Tuple
 import docker
-from docker.errors import BuildError as DockerBuildError, APIError
+from docker.errors import APIError, ImageNotFound
+
+from build_context import SourceIndex, ContextError, is_gzipped, stream_context, subset_context
+from buildpack_registry import Buildpack, BuildpackRegistry, BuildpackError, Detection
+from deps_cache import DepsCache
+from metrics import BUILD_CACHE, phase
 
 logger = logging.getLogger(__name__)
 
+# Build output lines marking a build step and a step served from the layer cache,
+# for the classic builder and BuildKit (--progress=plain)
+CLASSIC_STEP = re.compile(r"^Step \d+/\d+ : (?!FROM )")
+CLASSIC_CACHED = re.compile(r"^ ---> Using cache$")
+BUILDKIT_STEP = re.compile(r"^#(\d+) \[[^\]]*\d+/\d+\] (?!FROM )")
+BUILDKIT_CACHED = re.compile(r"^#(\d+) CACHED$")
+
 
 class BuildError(Exception):
     """Custom exception for build errors"""
     pass
 
 
+class BuildResult:
+    """Outcome of ImageBuilder.build_image"""
+
+    def __init__(self, image_id: str, build_time: float, source_hash: str, reused: bool = False):
+        self.image_id = image_id
+        self.build_time = build_time
+        self.source_hash = source_hash
+        self.reused = reused  # True if an earlier image was reused instead of building
+
+
 class ImageBuilder:
     """Builds Docker images from application code"""
 
-    def __init__(self, docker_client: docker.DockerClient):
+    def __init__(self, docker_client: docker.DockerClient, buildkit: bool = False,
+                 buildpacks: Optional[BuildpackRegistry] = None,
+                 deps_cache: Optional[DepsCache] = None,
+                 max_concurrent_builds: Optional[int] = None):
+        """
+        Args:
+            docker_client: Docker client
+            buildkit: Build with BuildKit and dependency cache mounts by default
+            buildpacks: Buildpack registry (defaults to the built-in buildpacks)
+            deps_cache: Cache of dependency images; without it the dependency
+                stage is part of every app build
+            max_concurrent_builds: Docker builds allowed at once across all
+                jobs (unlimited if None); further builds wait for a slot
+        """
         self.docker = docker_client
+        self.buildkit = buildkit
+        self.buildpacks = buildpacks or BuildpackRegistry.load()
+        self.deps_cache = deps_cache
+        self._build_slots = threading.BoundedSemaphore(max_concurrent_builds) if max_concurrent_builds else None
 
-    def detect_runtime(self, build_dir: Path) -> str:
+    def detect_runtime(self, source: SourceIndex, config: Optional[dict] = None) -> Detection:
         """
         Detect application runtime from project files
 
+        A runtime set in vesla.yaml takes precedence over marker files.
+
+        Args:
+            source: Index of the uploaded source tree
+            config: vesla.yaml configuration
+
         Returns:
-            Runtime type: 'dockerfile', 'python', 'node', 'go', 'ruby', 'php',
-            'java', 'rust', 'dotnet', 'static', or 'unknown'
+            Detection naming the buildpack and the files that matched it;
+            its runtime is 'unknown' if no buildpack matched
+
+        Raises:
+            BuildError: If vesla.yaml names a runtime with no buildpack
         """
-        # Check for Dockerfile first (user-provided)
-        if (build_dir / "Dockerfile").exists():
-            logger.info("Found Dockerfile - using custom build")
-            return "dockerfile"
-
-        # Check for Go
-        if (build_dir / "go.mod").exists() or (build_dir / "main.go").exists():
-            logger.info("Detected Go runtime")
-            return "go"
-
-        # Check for Rust
-        if (build_dir / "Cargo.toml").exists():
-            logger.info("Detected Rust runtime")
-            return "rust"
-
-        # Check for Python
-        if (build_dir / "requirements.txt").exists() or \
-           (build_dir / "pyproject.toml").exists() or \
-           (build_dir / "Pipfile").exists() or \
-           (build_dir / "setup.py").exists():
-            logger.info("Detected Python runtime")
-            return "python"
-
-        # Check for Node.js
-        if (build_dir / "package.json").exists():
-            logger.info("Detected Node.js runtime")
-            return "node"
-
-        # Check for Ruby
-        if (build_dir / "Gemfile").exists() or \
-           (build_dir / "config.ru").exists():
-            logger.info("Detected Ruby runtime")
-            return "ruby"
-
-        # Check for PHP
-        if (build_dir / "composer.json").exists() or \
-           (build_dir / "index.php").exists():
-            logger.info("Detected PHP runtime")
-            return "php"
-
-        # Check for Java/Maven
-        if (build_dir / "pom.xml").exists():
-            logger.info("Detected Java (Maven) runtime")
-            return "java-maven"
-
-        # Check for Java/Gradle
-        if (build_dir / "build.gradle").exists() or \
-           (build_dir / "build.gradle.kts").exists():
-            logger.info("Detected Java (Gradle) runtime")
-            return "java-gradle"
-
-        # Check for .NET
-        if any(build_dir.glob("*.csproj")) or \
-           any(build_dir.glob("*.fsproj")) or \
-           any(build_dir.glob("*.vbproj")):
-            logger.info("Detected .NET runtime")
-            return "dotnet"
-
-        # Check for static site (should be last)
-        if (build_dir / "index.html").exists():
-            logger.info("Detected static site")
-            return "static"
-
-        logger.warning("Could not detect runtime")
-        return "unknown"
-
-    def generate_dockerfile(self, runtime: str, build_dir: Path, config: dict) -> str:
+        runtime = (config or {}).get("runtime")
+        if runtime:
+            buildpack = self.buildpacks.get(runtime)
+            if not buildpack:
+                raise BuildError(f"Unknown runtime in vesla.yaml: {runtime}")
+            detection = Detection(buildpack, ["vesla.yaml"])
+        else:
+            detection = self.buildpacks.detect(source)
+
+        if detection.buildpack:
+            logger.info(f"Detected runtime {detection}")
+        else:
+            logger.warning("Could not detect runtime")
+        return detection
+
+    def generate_dockerfile(self, runtime: str, source: SourceIndex, config: dict,
+                            buildkit: bool = False, deps_image: Optional[str] = None) -> str:
         """
         Generate secure Dockerfile content based on runtime
 
         Args:
-            runtime: Runtime type (python, node, go, ruby, php, java, rust, dotnet, static)
-            build_dir: Build directory path
+            runtime: Buildpack name (python, node, go, ruby, php, java-maven, ...)
+            source: Index of the uploaded source tree
             config: vesla.yaml configuration
+            buildkit: Add BuildKit cache mounts for the runtime's package caches
+            deps_image: Dependency image to build on, if the buildpack has one
 
         Returns:
             Dockerfile content as string
         """
-        port = config.get("env", {}).get("PORT", "5000")
-
-        if runtime == "python":
-            entrypoint = self._detect_python_entrypoint(build_dir)
-            dockerfile = f"""FROM python:3.11-slim
-
-# Create non-root user
-RUN useradd -m -u 1000 appuser
-
-WORKDIR /app
-
-# Copy requirements first for better caching
-COPY requirements.txt* pyproject.toml* Pipfile* setup.py* ./
-RUN pip install --no-cache-dir -U pip && \\
-    (pip install --no-cache-dir -r requirements.txt || \\
-     pip install --no-cache-dir . || \\
-     ([ -f Pipfile ] && pip install pipenv && pipenv install --system --deploy))
-
-# Copy application code
-COPY . .
-
-# Change ownership to non-root user
-RUN chown -R appuser:appuser /app
-
-USER appuser
-
-EXPOSE {port}
-
-{entrypoint}
-"""
-
-        elif runtime == "node":
-            start_cmd = self._detect_node_start(build_dir)
-            dockerfile = f"""FROM node:20-slim
-
-# Create non-root user
-RUN useradd -m -u 1000 appuser
-
-WORKDIR /app
-
-# Copy package files first for better caching
-COPY package*.json ./
-RUN npm ci --only=production || npm install --production
-
-# Copy application code
-COPY . .
-
-# Change ownership to non-root user
-RUN chown -R appuser:appuser /app
-
-USER appuser
-
-EXPOSE {port}
-
-{start_cmd}
-"""
-
-        elif runtime == "go":
-            dockerfile = f"""# Build stage
-FROM golang:1.21-alpine AS builder
-
-WORKDIR /app
-
-# Copy go mod files
-COPY go.mod go.sum* ./
-RUN go mod download
-
-# Copy source code
-COPY . .
-
-# Build binary
-RUN CGO_ENABLED=0 GOOS=linux go build -a -installsuffix cgo -o app .
-
-# Runtime stage
-FROM alpine:3.19
-
-# Install ca-certificates for HTTPS
-RUN apk --no-cache add ca-certificates
-
-# Create non-root user
-RUN adduser -D -u 1000 appuser
-
-WORKDIR /app
-
-# Copy binary from builder
-COPY --from=builder /app/app .
-
-# Change ownership
-RUN chown appuser:appuser /app/app
-
-USER appuser
-
-EXPOSE {port}
-
-CMD ["./app"]
-"""
-
-        elif runtime == "rust":
-            dockerfile = f"""# Build stage
-FROM rust:1.75-slim AS builder
-
-WORKDIR /app
-
-# Copy manifests
-COPY Cargo.toml Cargo.lock* ./
-
-# Copy source code
-COPY . .
-
-# Build release binary
-RUN cargo build --release
-
-# Runtime stage
-FROM debian:bookworm-slim
-
-# Install runtime dependencies
-RUN apt-get update && apt-get install -y \\
-    ca-certificates \\
-    && rm -rf /var/lib/apt/lists/*
-
-# Create non-root user
-RUN useradd -m -u 1000 appuser
-
-WORKDIR /app
-
-# Copy binary from builder
-COPY --from=builder /app/target/release/* ./
-
-# Change ownership
-RUN chown -R appuser:appuser /app
-
-USER appuser
-
-EXPOSE {port}
-
-CMD ["./app"]
-"""
-
-        elif runtime == "ruby":
-            entrypoint = self._detect_ruby_entrypoint(build_dir)
-            dockerfile = f"""FROM ruby:3.2-slim
-
-# Install dependencies
-RUN apt-get update && apt-get install -y \\
-    build-essential \\
-    libpq-dev \\
-    && rm -rf /var/lib/apt/lists/*
-
-# Create non-root user
-RUN useradd -m -u 1000 appuser
-
-WORKDIR /app
-
-# Copy Gemfile
-COPY Gemfile Gemfile.lock* ./
-RUN bundle install --deployment --without development test
-
-# Copy application code
-COPY . .
-
-# Change ownership
-RUN chown -R appuser:appuser /app
-
-USER appuser
-
-EXPOSE {port}
-
-{entrypoint}
-"""
-
-        elif runtime == "php":
-            dockerfile = f"""FROM php:8.2-fpm-alpine
-
-# Install dependencies
-RUN apk add --no-cache nginx supervisor
-
-# Create non-root user
-RUN adduser -D -u 1000 appuser
-
-WORKDIR /app
-
-# Copy composer files if exist
-COPY composer.json composer.lock* ./
-RUN if [ -f composer.json ]; then \\
-        php -r "copy('https://getcomposer.org/installer', 'composer-setup.php');" && \\
-        php composer-setup.php --install-dir=/usr/local/bin --filename=composer && \\
-        composer install --no-dev --optimize-autoloader; \\
-    fi
-
-# Copy application code
-COPY . .
-
-# Configure PHP-FPM to run as appuser
-RUN sed -i 's/user = www-data/user = appuser/g' /usr/local/etc/php-fpm.d/www.conf && \\
-    sed -i 's/group = www-data/group = appuser/g' /usr/local/etc/php-fpm.d/www.conf
-
-# Change ownership
-RUN chown -R appuser:appuser /app
-
-EXPOSE {port}
-
-CMD ["php-fpm"]
-"""
-
-        elif runtime == "java-maven":
-            dockerfile = f"""# Build stage
-FROM maven:3.9-eclipse-temurin-21-alpine AS builder
-
-WORKDIR /app
-
-# Copy pom.xml
-COPY pom.xml .
-RUN mvn dependency:go-offline
-
-# Copy source and build
-COPY src ./src
-RUN mvn package -DskipTests
-
-# Runtime stage
-FROM eclipse-temurin:21-jre-alpine
-
-# Create non-root user
-RUN adduser -D -u 1000 appuser
-
-WORKDIR /app
-
-# Copy jar from builder
-COPY --from=builder /app/target/*.jar app.jar
-
-# Change ownership
-RUN chown appuser:appuser /app/app.jar
+        buildpack = self.buildpacks.get(runtime)
+        if not buildpack or buildpack.template is None:
+            raise BuildError(f"Cannot generate Dockerfile for runtime: {runtime}")
 
-USER appuser
+        try:
+            return buildpack.render(source, config, buildkit=buildkit, deps_image=deps_image)
+        except BuildpackError as e:
+            raise BuildError(str(e))
 
-EXPOSE {port}
+    def generate_files(self, runtime: str, source: SourceIndex, config: dict,
+                       buildkit: bool = False) -> Dict[str, str]:
+        """
+        Generate the files a buildpack adds to the build context
 
-CMD ["java", "-jar", "app.jar"]
-"""
+        Returns:
+            Mapping of build context path to file content (empty for most runtimes)
+        """
+        buildpack = self.buildpacks.get(runtime)
+        if not buildpack:
+            return {}
 
-        elif runtime == "java-gradle":
-            dockerfile = f"""# Build stage
-FROM gradle:8.5-jdk21-alpine AS builder
+        try:
+            return buildpack.render_files(source, config, buildkit=buildkit)
+        except BuildpackError as e:
+            raise BuildError(str(e))
 
-WORKDIR /app
+    @staticmethod
+    def release_tag(app_name: str, release: int) -> str:
+        """Image tag of an app release, e.g. myapp:r12"""
+        return f"{app_name}:r{release}"
 
-# Copy gradle files
-COPY build.gradle* settings.gradle* gradlew* gradle/ ./
+    @staticmethod
+    def content_tag(app_name: str, image_id: str) -> str:
+        """Image tag derived from the image's content digest, e.g. myapp:sha-3f2a9c1d0b7e"""
+        return f"{app_name}:sha-{image_id.split(':')[-1][:12]}"
 
-# Copy source and build
-COPY . .
-RUN gradle build --no-daemon -x test
+    def build_image(self, app_name: str, tarball_path: str, vesla_config: dict,
+                    max_build_time: int = 600,
+                    log_callback: Optional[Callable[[str], None]] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    release: Optional[int] = None,
+                    cache_from: Optional[str] = None,
+                    known_images: Optional[Dict[str, str]] = None) -> "BuildResult":
+        """
+        Build Docker image from tarball
 
-# Runtime stage
-FROM eclipse-temurin:21-jre-alpine
+        The tarball is indexed in a single pass for runtime detection and then
+        streamed to the daemon as the build context; it is never extracted.
+        The image is tagged with the release number, its content digest and
+        'latest'.
 
-# Create non-root user
-RUN adduser -D -u 1000 appuser
+        The same pass hashes the source tree. Together with the runtime and
+        the generated Dockerfile this gives the build's source hash; if
+        known_images has an image for it, that image is reused and nothing
+        is built.
 
-WORKDIR /app
+        Args:
+            app_name: Application name (used for image tag)
+            tarball_path: Path to code tarball (.tar.gz or .tar)
+            vesla_config: Parsed vesla.yaml configuration
+            max_build_time: Maximum build time in seconds
+            log_callback: Called with each line of build output as it arrives
+            cancel_event: When set, the build is aborted at the next output line
+            release: Release number the image is built for
+            cache_from: Image (usually the previous release) whose layers the
+                build may reuse
+            known_images: Source hashes of earlier builds mapped to their image IDs
 
-# Copy jar from builder
-COPY --from=builder /app/build/libs/*.jar app.jar
+        Returns:
+            BuildResult with the image ID, build time and source hash
 
-# Change ownership
-RUN chown appuser:appuser /app/app.jar
+        Raises:
+            BuildError: If build fails, times out or is cancelled
+        """
+        start_time = time.time()
 
-USER appuser
+        try:
+            hashed_files = self.buildpacks.deps_files if self.deps_cache else None
+            with phase("index"):
+                source = SourceIndex.from_tarball(tarball_path, hashed_files=hashed_files, hash_tree=True)
+        except ContextError as e:
+            raise BuildError(str(e))
+
+        # Detect runtime
+        with phase("detect"):
+            detection = self.detect_runtime(source, vesla_config)
+        if not detection.buildpack:
+            raise BuildError("Could not detect application runtime. Please provide a Dockerfile.")
+        runtime = detection.runtime
+        if log_callback:
+            log_callback(f"Detected runtime {detection}")
+
+        buildkit = bool(vesla_config.get("buildkit", self.buildkit))
+
+        # Everything the image depends on besides the source tree is in the
+        # Dockerfile and the generated files
+        dockerfile_content = deps = None
+        generated_files = {}
+        if detection.buildpack.template is not None:
+            if self.deps_cache and detection.buildpack.deps_template is not None:
+                deps = self._deps_image_spec(detection.buildpack, source, vesla_config, buildkit)
+            dockerfile_content = self.generate_dockerfile(
+                runtime, source, vesla_config, buildkit=buildkit, deps_image=deps[0] if deps else None
+            )
+            generated_files = self.generate_files(runtime, source, vesla_config, buildkit=buildkit)
+        source_hash = self.source_hash(source, runtime, dockerfile_content, generated_files)
+
+        image_tag = self.release_tag(app_name, release) if release else f"{app_name}:latest"
+
+        image_id = (known_images or {}).get(source_hash)
+        if image_id and not self._image_exists(image_id):
+            image_id = None
+        if known_images is not None:
+            BUILD_CACHE.labels(cache="source", result="hit" if image_id else "miss").inc()
+
+        if image_id:
+            logger.info(f"Source of {app_name} unchanged, reusing image {image_id[:19]}")
+            if log_callback:
+                log_callback(f"Source unchanged, reusing image {self.content_tag(app_name, image_id)}")
+            self._tag_build(app_name, image_id, image_tag)
+            return BuildResult(image_id, time.time() - start_time, source_hash, reused=True)
+
+        # Build Docker image
+        build = self._build_with_buildkit if buildkit else self._build_from_context
+        logger.info(f"Building Docker image: {image_tag}" + (" (BuildKit)" if buildkit else ""))
+
+        if cache_from and not self._image_exists(cache_from):
+            cache_from = None
+
+        # Waiting for a slot doesn't count towards max_build_time
+        start_time += self._acquire_build_slot(app_name, log_callback, cancel_event)
+
+        # The dependency image is the build's base; keep it until the build is done
+        if deps:
+            self.deps_cache.pin(deps[0])
 
-EXPOSE {port}
+        try:
+            if dockerfile_content is None:
+                # User-provided Dockerfile: send the upload to the daemon untouched
+                encoding = "gzip" if is_gzipped(tarball_path) else None
+                with open(tarball_path, "rb") as context, phase("build"):
+                    image_id = build(
+                        context, image_tag, start_time, max_build_time,
+                        log_callback, cancel_event, encoding=encoding, cache_from=cache_from
+                    )
+            else:
+                if deps:
+                    with phase("deps_image"):
+                        deps_ready = self._ensure_deps_image(
+                            *deps, tarball_path, build, start_time, max_build_time, log_callback, cancel_event
+                        )
+                    if not deps_ready:
+                        dockerfile_content = self.generate_dockerfile(runtime, source, vesla_config, buildkit=buildkit)
 
-CMD ["java", "-jar", "app.jar"]
-"""
+                logger.info(f"Generated Dockerfile for {runtime} runtime")
+                context = stream_context(tarball_path, source, {**generated_files, "Dockerfile": dockerfile_content})
+                with phase("build"):
+                    image_id = build(
+                        context, image_tag, start_time, max_build_time,
+                        log_callback, cancel_event, cache_from=cache_from
+                    )
 
-        elif runtime == "dotnet":
-            dockerfile = f"""# Build stage
-FROM mcr.microsoft.com/dotnet/sdk:8.0 AS builder
+            self._tag_build(app_name, image_id, image_tag if release else None)
 
-WORKDIR /app
+            build_time = time.time() - start_time
+            logger.info(f"Successfully built image {image_tag} in {build_time:.2f}s")
 
-# Copy project files
-COPY *.csproj* *.fsproj* *.vbproj* ./
-RUN dotnet restore || true
+            return BuildResult(image_id, build_time, source_hash)
 
-# Copy source and build
-COPY . .
-RUN dotnet publish -c Release -o out
+        except ContextError as e:
+            raise BuildError(str(e))
+        except APIError as e:
+            raise BuildError(f"Docker API error: {str(e)}")
+        finally:
+            if deps:
+                self.deps_cache.unpin(deps[0])
+            if self._build_slots:
+                self._build_slots.release()
+
+    @staticmethod
+    def source_hash(source: SourceIndex, runtime: str, dockerfile: Optional[str],
+                    files: Optional[Dict[str, str]] = None) -> str:
+        """
+        Hash identifying a build's inputs
 
-# Runtime stage
-FROM mcr.microsoft.com/dotnet/aspnet:8.0-alpine
+        Args:
+            source: Index of the upload, with tree_hash computed
+            runtime: Buildpack name
+            dockerfile: Generated Dockerfile, or None for the project's own
+            files: Other generated files added to the build context
 
-# Create non-root user
-RUN adduser -D -u 1000 appuser
+        Returns:
+            SHA-256 hex digest
+        """
+        sha = hashlib.sha256()
+        generated = [part for path in sorted(files or {}) for part in (path, files[path])]
+        for part in (source.tree_hash or "", runtime, dockerfile or "", *generated):
+            sha.update(part.encode("utf-8"))
+            sha.update(b"\0")
+        return sha.hexdigest()
+
+    def _tag_build(self, app_name: str, image_id: str, release_tag: Optional[str]):
+        """Add the content tag, plus the release tag and 'latest' for releases"""
+        image = self.docker.images.get(image_id)
+        image.tag(*self.content_tag(app_name, image_id).split(":"))
+        if release_tag:
+            image.tag(*release_tag.split(":"))
+            image.tag(app_name, "latest")
+
+    def _deps_image_spec(self, buildpack: Buildpack, source: SourceIndex, vesla_config: dict,
+                         buildkit: bool) -> Tuple[str, str, Dict[str, str]]:
+        """
+        Work out the dependency image for an upload's lockfiles
 
-WORKDIR /app
+        Returns:
+            Tuple of (image tag, dependency stage Dockerfile, lockfile digests)
+        """
+        dockerfile = buildpack.render_deps(source, vesla_config, buildkit)
+        digests = {name: source.digests[name] for name in buildpack.deps_files if name in source.digests}
+        return self.deps_cache.tag_for(buildpack.name, dockerfile, digests), dockerfile, digests
+
+    def _ensure_deps_image(self, tag: str, dockerfile: str, digests: Dict[str, str],
+                           tarball_path: str, build: Callable,
+                           start_time: float, max_build_time: int,
+                           log_callback: Optional[Callable[[str], None]],
+                           cancel_event: Optional[threading.Event]) -> bool:
+        """
+        Make sure a dependency image exists, building it on a cache miss
 
-# Copy built app
-COPY --from=builder /app/out .
+        The image is built from a context holding only the lockfiles, so it
+        is reused by every later build with the same dependencies.
 
-# Change ownership
-RUN chown -R appuser:appuser /app
+        Returns:
+            True if the image is available, False if it couldn't be built, in
+            which case the dependency stage is built inline as before
 
-USER appuser
+        Raises:
+            BuildError: If the build is cancelled
+        """
+        def build_deps():
+            if log_callback:
+                log_callback(f"Building dependency image {tag}")
+            context = subset_context(tarball_path, set(digests), {"Dockerfile": dockerfile})
+            build(context, tag, start_time, max_build_time, log_callback, cancel_event)
 
-EXPOSE {port}
+        try:
+            hit = self.deps_cache.get_or_build(tag, build_deps)
+        except (BuildError, ContextError, APIError) as e:
+            if cancel_event is not None and cancel_event.is_set():
+                raise BuildError("Build cancelled")
+            logger.warning(f"Could not build dependency image {tag}, installing dependencies inline: {e}")
+            if log_callback:
+                log_callback(f"Dependency image build failed, installing dependencies inline: {e}")
+            return False
+
+        if hit and log_callback:
+            log_callback(f"Using cached dependency image {tag}")
+        return True
+
+    def _acquire_build_slot(self, app_name: str,
+                            log_callback: Optional[Callable[[str], None]],
+                            cancel_event: Optional[threading.Event]) -> float:
+        """
+        Wait until fewer than max_concurrent_builds builds are running
 
-ENV ASPNETCORE_URLS=http://+:{port}
+        Returns:
+            Seconds spent waiting
 
-ENTRYPOINT ["dotnet", "app.dll"]
-"""
+        Raises:
+            BuildError: If the build is cancelled while waiting
+        """
+        if not self._build_slots or self._build_slots.acquire(blocking=False):
+            return 0.0
 
-        elif runtime == "static":
-            dockerfile = f"""FROM nginx:1.25-alpine
+        logger.info(f"Build of {app_name} waiting for a build slot")
+        if log_callback:
+            log_callback("Waiting for a free build slot")
 
-# Copy static files
-COPY . /usr/share/nginx/html
+        started = time.time()
+        while not self._build_slots.acquire(timeout=1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise BuildError("Build cancelled")
+        return time.time() - started
 
-# Copy custom nginx config if exists
-COPY nginx.conf /etc/nginx/nginx.conf 2>/dev/null || true
+    def _image_exists(self, tag: str) -> bool:
+        try:
+            self.docker.images.get(tag)
+            return True
+        except ImageNotFound:
+            return False
+
+    def _build_from_context(self, context, image_tag: str, start_time: float,
+                            max_build_time: int,
+                            log_callback: Optional[Callable[[str], None]],
+                            cancel_event: Optional[threading.Event],
+                            encoding: Optional[str] = None,
+                            cache_from: Optional[str] = None) -> str:
+        """
+        Send a tar build context to the daemon and follow the build
 
-# Create non-root user (nginx alpine already has nginx user)
-RUN chown -R nginx:nginx /usr/share/nginx/html
+        Args:
+            context: File object or iterator of bytes holding the tar stream
+            image_tag: Tag for the built image
+            start_time: When the build started (for the deadline)
+            max_build_time: Maximum build time in seconds
+            log_callback: Called with each line of build output
+            cancel_event: When set, the build is aborted
+            encoding: Content encoding of the context, e.g. 'gzip'
+            cache_from: Image whose layers may be reused
 
-# Run as non-root
-USER nginx
+        Returns:
+            Built image ID
+        """
+        build_output = self.docker.api.build(
+            fileobj=context,
+            custom_context=True,
+            encoding=encoding,
+            tag=image_tag,
+            cache_from=[cache_from] if cache_from else None,
+            rm=True,  # Remove intermediate containers
+            decode=True,
+            timeout=max_build_time
+        )
+
+        image_id = self._stream_build_output(
+            build_output,
+            deadline=start_time + max_build_time,
+            log_callback=log_callback,
+            cancel_event=cancel_event
+        )
+
+        return image_id or self.docker.images.get(image_tag).id
+
+    def _build_with_buildkit(self, context, image_tag: str, start_time: float,
+                             max_build_time: int,
+                             log_callback: Optional[Callable[[str], None]],
+                             cancel_event: Optional[threading.Event],
+                             encoding: Optional[str] = None,
+                             cache_from: Optional[str] = None) -> str:
+        """
+        Build with BuildKit through the docker CLI, streaming the context on stdin
 
-EXPOSE 80
-"""
+        docker-py only speaks the legacy builder API, so BuildKit builds (and
+        with them RUN --mount=type=cache) go through `docker build -`. The
+        CLI detects gzip contexts itself, so encoding is unused here. Images
+        carry inline cache metadata so later builds can use them as cache_from.
 
-        else:
-            raise BuildError(f"Cannot generate Dockerfile for runtime: {runtime}")
+        Returns:
+            Built image ID
+        """
+        fd, iidfile = tempfile.mkstemp(prefix="vesla-iid-")
+        os.close(fd)
 
-        return dockerfile
-
-    def _detect_python_entrypoint(self, build_dir: Path) -> str:
-        """Detect Python application entrypoint"""
-        # Check for common entry points
-        if (build_dir / "app.py").exists():
-            return 'CMD ["python", "app.py"]'
-        elif (build_dir / "main.py").exists():
-            return 'CMD ["python", "main.py"]'
-        elif (build_dir / "wsgi.py").exists():
-            return 'CMD ["gunicorn", "--bind", "0.0.0.0:5000", "wsgi:app"]'
-        elif (build_dir / "manage.py").exists():
-            # Django app
-            return 'CMD ["python", "manage.py", "runserver", "0.0.0.0:8000"]'
-        else:
-            # Default
-            return 'CMD ["python", "app.py"]'
+        command = ["docker", "build", "--progress=plain", "--tag", image_tag, "--iidfile", iidfile,
+                   "--build-arg", "BUILDKIT_INLINE_CACHE=1"]
+        if cache_from:
+            command += ["--cache-from", cache_from]
+        command.append("-")
+        env = dict(os.environ, DOCKER_BUILDKIT="1")
 
-    def _detect_node_start(self, build_dir: Path) -> str:
-        """Detect Node.js start command"""
-        # Try to read package.json for start script
-        import json
         try:
-            with open(build_dir / "package.json") as f:
-                package = json.load(f)
-                scripts = package.get("scripts", {})
-                if "start" in scripts:
-                    return 'CMD ["npm", "start"]'
-        except Exception as e:
-            logger.warning(f"Could not parse package.json: {e}")
-
-        # Check for common entry points
-        if (build_dir / "index.js").exists():
-            return 'CMD ["node", "index.js"]'
-        elif (build_dir / "server.js").exists():
-            return 'CMD ["node", "server.js"]'
-        elif (build_dir / "app.js").exists():
-            return 'CMD ["node", "app.js"]'
-        else:
-            return 'CMD ["npm", "start"]'
-
-    def _detect_ruby_entrypoint(self, build_dir: Path) -> str:
-        """Detect Ruby application entrypoint"""
-        # Check for Rack config (Rails, Sinatra, etc.)
-        if (build_dir / "config.ru").exists():
-            return 'CMD ["bundle", "exec", "rackup", "-o", "0.0.0.0"]'
-        # Check for Rails
-        elif (build_dir / "config" / "environment.rb").exists():
-            return 'CMD ["bundle", "exec", "rails", "server", "-b", "0.0.0.0"]'
-        # Check for Sinatra
-        elif (build_dir / "app.rb").exists():
-            return 'CMD ["bundle", "exec", "ruby", "app.rb", "-o", "0.0.0.0"]'
-        else:
-            return 'CMD ["bundle", "exec", "ruby", "app.rb"]'
+            try:
+                process = subprocess.Popen(
+                    command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, env=env
+                )
+            except OSError as e:
+                raise BuildError(f"Could not run docker CLI for BuildKit build: {e}")
+
+            feeder = threading.Thread(target=_feed_stdin, args=(process, context), daemon=True)
+            feeder.start()
+
+            stopped = []
+            watchdog = threading.Thread(
+                target=_watch_build,
+                args=(process, start_time + max_build_time, cancel_event, stopped),
+                daemon=True
+            )
+            watchdog.start()
+
+            recent = deque(maxlen=20)
+            steps, cached = set(), set()
+            for raw_line in process.stdout:
+                line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+                recent.append(line)
+                step = BUILDKIT_STEP.match(line) or BUILDKIT_CACHED.match(line)
+                if step:
+                    (steps if step.re is BUILDKIT_STEP else cached).add(step.group(1))
+                logger.debug(line)
+                if log_callback and line:
+                    log_callback(line)
+
+            process.wait()
+            feeder.join(timeout=5)
+            _count_layer_cache(len(steps), len(steps & cached))
+
+            if stopped:
+                raise BuildError(stopped[0])
+            if process.returncode != 0:
+                errors = [line for line in recent if "ERROR" in line or "error" in line]
+                raise BuildError("\n".join(errors or list(recent)[-5:]) or "BuildKit build failed")
+
+            with open(iidfile) as f:
+                return f.read().strip()
 
-    def build_image(self, app_name: str, tarball_path: str, vesla_config: dict,
-                    max_build_time: int = 600) -> Tuple[str, float]:
+        finally:
+            os.unlink(iidfile)
+
+    def _stream_build_output(self, build_output, deadline: float,
+                             log_callback: Optional[Callable[[str], None]] = None,
+                             cancel_event: Optional[threading.Event] = None) -> Optional[str]:
         """
-        Build Docker image from tarball
+        Consume streamed build output chunk by chunk
 
-        Args:
-            app_name: Application name (used for image tag)
-            tarball_path: Path to code tarball
-            vesla_config: Parsed vesla.yaml configuration
-            max_build_time: Maximum build time in seconds
+        Each line is handed to log_callback as soon as the daemon sends it, so
+        nothing is buffered here. Closing the stream early drops the connection,
+        which makes the daemon abort the build.
 
         Returns:
-            Tuple of (image_id, build_time_seconds)
+            Image ID reported by the daemon, if any
 
         Raises:
-            BuildError: If build fails
+            BuildError: If the build reports an error, exceeds the deadline or is cancelled
         """
-        import time
-        start_time = time.time()
-
-        # Create temporary build directory
-        build_dir = Path(tempfile.mkdtemp(prefix=f"vesla-build-{app_name}-"))
+        image_id = None
+        steps = cached = 0
 
         try:
-            logger.info(f"Extracting tarball to {build_dir}")
-            with tarfile.open(tarball_path, "r:gz") as tar:
-                tar.extractall(build_dir)
-
-            # Detect runtime
-            runtime = self.detect_runtime(build_dir)
-            if runtime == "unknown":
-                raise BuildError("Could not detect application runtime. Please provide a Dockerfile.")
-
-            # Generate Dockerfile if needed
-            if runtime != "dockerfile":
-                dockerfile_content = self.generate_dockerfile(runtime, build_dir, vesla_config)
-                dockerfile_path = build_dir / "Dockerfile"
-                dockerfile_path.write_text(dockerfile_content)
-                logger.info(f"Generated Dockerfile for {runtime} runtime")
+            for chunk in build_output:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise BuildError("Build cancelled")
+                if time.time() > deadline:
+                    raise BuildError("Build exceeded maximum build time")
+
+                if "error" in chunk:
+                    message = chunk["error"].strip()
+                    if log_callback:
+                        log_callback(message)
+                    raise BuildError(message)
+
+                if "stream" in chunk:
+                    line = chunk["stream"].rstrip("\n")
+                    logger.debug(line)
+                    if CLASSIC_STEP.match(line):
+                        steps += 1
+                    elif CLASSIC_CACHED.match(line):
+                        cached += 1
+                    if log_callback and line:
+                        log_callback(line)
+                elif "status" in chunk and "progress" not in chunk:
+                    # Base image pulls (per-layer progress bars are skipped)
+                    if log_callback:
+                        log_callback(chunk["status"])
+                elif "aux" in chunk and "ID" in chunk["aux"]:
+                    image_id = chunk["aux"]["ID"]
+        finally:
+            close = getattr(build_output, "close", None)
+            if close:
+                close()
 
-            # Build Docker image
-            image_tag = f"{app_name}:latest"
-            logger.info(f"Building Docker image: {image_tag}")
+        _count_layer_cache(steps, cached)
+        return image_id
 
-            try:
-                image, build_logs = self.docker.images.build(
-                    path=str(build_dir),
-                    tag=image_tag,
-                    rm=True,  # Remove intermediate containers
-                    timeout=max_build_time
-                )
+    def remove_app_images(self, app_name: str, releases: Iterable[dict]):
+        """
+        Remove the 'latest' tag of a deleted app and the tags of its releases
 
-                # Log build output
-                for log in build_logs:
-                    if 'stream' in log:
-                        logger.debug(log['stream'].strip())
-                    elif 'error' in log:
-                        logger.error(log['error'])
+        Untagged layers are left for the image collector's dangling prune.
 
-                build_time = time.time() - start_time
-                logger.info(f"Successfully built image {image_tag} in {build_time:.2f}s")
+        Args:
+            app_name: Application name
+            releases: Release records whose tags should go
+        """
+        tags = [f"{app_name}:latest"] + [tag for release in releases for tag in release["tags"]]
+        for tag in tags:
+            try:
+                self.docker.images.remove(tag)
+            except ImageNotFound:
+                pass
+            except APIError as e:
+                logger.warning(f"Could not remove image {tag}: {e}")
+
+
+def _count_layer_cache(steps: int, cached: int):
+    """Record a build's layer cache hits and misses (FROM steps aren't counted)"""
+    if cached:
+        BUILD_CACHE.labels(cache="layer", result="hit").inc(cached)
+    if steps > cached:
+        BUILD_CACHE.labels(cache="layer", result="miss").inc(steps - cached)
+
+
+def _feed_stdin(process: subprocess.Popen, context):
+    """Write a build context (file object or iterator of bytes) to a process's stdin"""
+    if hasattr(context, "read"):
+        chunks = iter(lambda: context.read(64 * 1024), b"")
+    else:
+        chunks = context
+
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # The build process exited (or was killed) before reading everything
+        pass
+    except Exception as e:
+        logger.error(f"Failed to stream build context: {e}")
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except Exception:
+            pass
 
-                return image.id, build_time
 
-            except DockerBuildError as e:
-                raise BuildError(f"Docker build failed: {str(e)}")
-            except APIError as e:
-                raise BuildError(f"Docker API error: {str(e)}")
+def _watch_build(process: subprocess.Popen, deadline: float,
+                 cancel_event: Optional[threading.Event], stopped: list):
+    """Kill a build process once it is cancelled or runs past its deadline"""
+    while process.poll() is None:
+        if cancel_event is not None and cancel_event.is_set():
+            stopped.append("Build cancelled")
+        elif time.time() > deadline:
+            stopped.append("Build exceeded maximum build time")
 
-        finally:
-            # Clean up build directory
-            try:
-                shutil.rmtree(build_dir)
-                logger.debug(f"Cleaned up build directory: {build_dir}")
-            except Exception as e:
-                logger.warning(f"Failed to clean up build directory: {e}")
+        if stopped:
+            process.kill()
+            return
 
-    def cleanup_old_images(self, app_name: str):
-        """Remove old/dangling images for an app"""
-        try:
-            # Remove dangling images
-            self.docker.images.prune(filters={"dangling": True})
-            logger.info(f"Cleaned up dangling images for {app_name}")
-        except Exception as e:
-            logger.warning(f"Failed to cleanup old images: {e}")
+        time.sleep(1)
@@ -0,0 +1,364 @@
+"""
+Buildpack Registry for Vesla
+Loads buildpack definitions and matches them against uploaded source trees
+"""
+
+import fnmatch
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import yaml
+from jinja2 import Environment, StrictUndefined, TemplateError
+
+from build_context import SourceIndex
+
+logger = logging.getLogger(__name__)
+
+# Buildpacks shipped with Vesla
+BUILTIN_DIR = Path(__file__).parent / "buildpacks"
+
+# Package caches mounted into RUN steps of BuildKit builds. Cache IDs are
+# shared by every app on the host, so caches persist across deploys and apps.
+CACHE_MOUNTS = {
+    "pip": "/root/.cache/pip",
+    "npm": "/root/.npm",
+    "go-mod": "/go/pkg/mod",
+    "go-build": "/root/.cache/go-build",
+    "cargo-registry": "/usr/local/cargo/registry",
+    "cargo-git": "/usr/local/cargo/git",
+    "maven": "/root/.m2",
+    "gradle": "/home/gradle/.gradle",
+    "bundler": "/root/.bundle/cache",
+    "composer": "/root/.cache/composer",
+    "nuget": "/root/.nuget/packages",
+}
+
+
+class BuildpackError(Exception):
+    """Raised for invalid buildpack definitions or templates"""
+    pass
+
+
+class Buildpack:
+    """
+    A runtime Vesla knows how to containerize
+
+    Defined by a YAML file naming the buildpack, its detection priority, the
+    top-level marker files (names or shell-style patterns) that identify it
+    and the Jinja template of its Dockerfile. A buildpack without a template
+    builds the project's own Dockerfile.
+
+    A buildpack may also declare its dependency stage: the lockfiles it reads
+    and a template that installs dependencies from them alone. That stage is
+    built as a separate image which the main template can start FROM.
+
+    Templates of generated files (e.g. a web server config) can be declared
+    too; they are rendered into the build context next to the Dockerfile.
+    """
+
+    def __init__(self, name: str, priority: int, markers: List[str],
+                 template=None, description: str = "", source: Optional[Path] = None,
+                 deps_files: Optional[List[str]] = None, deps_template=None,
+                 files: Optional[Dict[str, object]] = None):
+        self.name = name
+        self.priority = priority
+        self.markers = markers
+        self.template = template
+        self.description = description
+        self.source = source
+        self.deps_files = deps_files or []
+        self.deps_template = deps_template
+        self.files = files or {}  # Context path -> template
+
+    def render(self, source: SourceIndex, config: dict, buildkit: bool = False,
+               deps_image: Optional[str] = None) -> str:
+        """
+        Render the buildpack's Dockerfile
+
+        Args:
+            source: Index of the uploaded source tree
+            config: vesla.yaml configuration
+            buildkit: Add BuildKit cache mounts for the runtime's package caches
+            deps_image: Dependency image to build on instead of inlining the
+                dependency stage
+
+        Returns:
+            Dockerfile content as string
+
+        Raises:
+            BuildpackError: If the buildpack has no template or rendering fails
+        """
+        if self.template is None:
+            raise BuildpackError(f"Buildpack {self.name} uses the project's Dockerfile")
+
+        deps = ""
+        if self.deps_template is not None and not deps_image:
+            deps = self.render_deps(source, config, buildkit)
+
+        return self._render(self.template, source, config, buildkit, deps=deps, deps_image=deps_image)
+
+    def render_deps(self, source: SourceIndex, config: dict, buildkit: bool = False) -> str:
+        """
+        Render the Dockerfile of the buildpack's dependency stage
+
+        Returns:
+            Dockerfile content as string
+
+        Raises:
+            BuildpackError: If the buildpack has no dependency stage or rendering fails
+        """
+        if self.deps_template is None:
+            raise BuildpackError(f"Buildpack {self.name} has no dependency stage")
+        return self._render(self.deps_template, source, config, buildkit)
+
+    def render_files(self, source: SourceIndex, config: dict, buildkit: bool = False) -> Dict[str, str]:
+        """
+        Render the buildpack's generated files
+
+        Returns:
+            Mapping of build context path to file content
+
+        Raises:
+            BuildpackError: If rendering fails
+        """
+        return {path: self._render(template, source, config, buildkit)
+                for path, template in self.files.items()}
+
+    def _render(self, template, source: SourceIndex, config: dict, buildkit: bool, **extra) -> str:
+        """Render a template with the variables every buildpack template gets"""
+        def mount(*caches: str) -> str:
+            """RUN flags mounting the named package caches (BuildKit only)"""
+            if not buildkit:
+                return ""
+            return "".join(f"--mount=type=cache,id=vesla-{name},target={CACHE_MOUNTS[name]} "
+                           for name in caches)
+
+        def read_json(path: str) -> dict:
+            """Parse a captured JSON file, {} if it's missing or invalid"""
+            try:
+                data = json.loads(source.read_text(path) or "{}")
+            except ValueError as e:
+                logger.warning(f"Could not parse {path}: {e}")
+                return {}
+            return data if isinstance(data, dict) else {}
+
+        try:
+            return template.render(
+                app=config.get("app", "app"),
+                port=config.get("env", {}).get("PORT", "5000"),
+                config=config,
+                source=source,
+                buildkit=buildkit,
+                mount=mount,
+                cache_mounts=CACHE_MOUNTS,
+                read_json=read_json,
+                **extra
+            )
+        except TemplateError as e:
+            raise BuildpackError(f"Could not render {self.name} Dockerfile: {e}")
+
+    def to_dict(self) -> dict:
+        """Serialize buildpack metadata for the API"""
+        return {
+            "name": self.name,
+            "priority": self.priority,
+            "markers": self.markers,
+            "deps_files": self.deps_files,
+            "files": sorted(self.files),
+            "description": self.description,
+            "source": str(self.source) if self.source else None,
+        }
+
+
+class Detection:
+    """Result of runtime detection and the marker files that decided it"""
+
+    def __init__(self, buildpack: Optional[Buildpack], evidence: List[str],
+                 candidates: Optional[List[str]] = None):
+        self.buildpack = buildpack
+        self.evidence = evidence
+        self.candidates = candidates or []
+
+    @property
+    def runtime(self) -> str:
+        return self.buildpack.name if self.buildpack else "unknown"
+
+    def __str__(self) -> str:
+        if not self.buildpack:
+            return "no buildpack matched"
+        text = f"{self.runtime} (matched {', '.join(self.evidence)}"
+        others = [name for name in self.candidates if name != self.runtime]
+        if others:
+            text += f"; also matched {', '.join(others)}"
+        return text + ")"
+
+
+class BuildpackRegistry:
+    """
+    Buildpacks by name plus a marker index for detection
+
+    Exact marker names go into a dict and patterns are compiled up front, so
+    detecting a runtime is one pass over the tree's top-level entries no
+    matter how many buildpacks are registered.
+    """
+
+    def __init__(self, buildpacks: Optional[List[Buildpack]] = None):
+        self.buildpacks: Dict[str, Buildpack] = {}
+        self._exact: Dict[str, List[Buildpack]] = {}
+        self._patterns = []
+        for buildpack in buildpacks or []:
+            self.register(buildpack)
+
+    @classmethod
+    def load(cls, extra_dir: Optional[str] = None) -> "BuildpackRegistry":
+        """
+        Load the built-in buildpacks, then site-specific ones
+
+        Args:
+            extra_dir: Directory of additional buildpack definitions. A
+                buildpack with the same name as a built-in replaces it.
+
+        Returns:
+            BuildpackRegistry with all buildpacks registered
+
+        Raises:
+            BuildpackError: If a definition or template is invalid
+        """
+        registry = cls()
+        registry.load_dir(BUILTIN_DIR)
+        if extra_dir:
+            registry.load_dir(Path(extra_dir))
+        return registry
+
+    def load_dir(self, directory: Path):
+        """Register every *.yaml buildpack definition in a directory"""
+        if not directory.is_dir():
+            raise BuildpackError(f"Buildpack directory not found: {directory}")
+
+        environment = _template_environment()
+        for path in sorted(directory.glob("*.yaml")):
+            self.register(_load_buildpack(path, environment))
+
+    def register(self, buildpack: Buildpack):
+        """Add a buildpack, replacing any existing one with the same name"""
+        if buildpack.name in self.buildpacks:
+            logger.info(f"Buildpack {buildpack.name} overridden by {buildpack.source}")
+        self.buildpacks[buildpack.name] = buildpack
+        self._index()
+
+    def get(self, name: str) -> Optional[Buildpack]:
+        return self.buildpacks.get(name)
+
+    @property
+    def deps_files(self) -> Set[str]:
+        """Lockfiles of every buildpack with a dependency stage"""
+        return {name for buildpack in self.buildpacks.values() for name in buildpack.deps_files}
+
+    def detect(self, source: SourceIndex) -> Detection:
+        """
+        Pick the buildpack for a source tree
+
+        Every top-level entry is looked up once in the marker index. Among
+        the buildpacks with a matching marker, the highest priority wins.
+
+        Returns:
+            Detection with the chosen buildpack (None if nothing matched),
+            the markers that matched it and all matching buildpack names
+        """
+        evidence: Dict[str, List[str]] = {}
+
+        for name in source.top_level:
+            for buildpack in self._exact.get(name, ()):
+                evidence.setdefault(buildpack.name, []).append(name)
+            for pattern, buildpack in self._patterns:
+                if pattern.match(name):
+                    evidence.setdefault(buildpack.name, []).append(name)
+
+        if not evidence:
+            return Detection(None, [])
+
+        ranked = sorted(evidence, key=lambda name: (-self.buildpacks[name].priority, name))
+        return Detection(self.buildpacks[ranked[0]], sorted(evidence[ranked[0]]), ranked)
+
+    def _index(self):
+        """Rebuild the marker index from the registered buildpacks"""
+        self._exact, self._patterns = {}, []
+        for buildpack in self.buildpacks.values():
+            for marker in buildpack.markers:
+                if any(char in marker for char in "*?["):
+                    self._patterns.append((re.compile(fnmatch.translate(marker)), buildpack))
+                else:
+                    self._exact.setdefault(marker, []).append(buildpack)
+
+
+def _template_environment() -> Environment:
+    return Environment(
+        trim_blocks=True,
+        lstrip_blocks=True,
+        keep_trailing_newline=True,
+        undefined=StrictUndefined,
+    )
+
+
+def _load_buildpack(path: Path, environment: Environment) -> Buildpack:
+    """Parse a buildpack definition and compile its template"""
+    try:
+        with open(path) as f:
+            definition = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        raise BuildpackError(f"Could not read buildpack {path}: {e}")
+
+    name = definition.get("name")
+    markers = definition.get("markers") or []
+    if not name or not isinstance(markers, list) or not markers:
+        raise BuildpackError(f"Buildpack {path} needs a name and a list of markers")
+    for marker in markers:
+        if not isinstance(marker, str) or "/" in marker:
+            raise BuildpackError(f"Buildpack {name}: markers must be top-level names, got {marker!r}")
+
+    template = None
+    if definition.get("template"):
+        template = _load_template(path.parent / definition["template"], environment, name)
+
+    deps = definition.get("deps") or {}
+    deps_files = deps.get("files") or []
+    deps_template = None
+    if deps:
+        if not deps.get("template") or not isinstance(deps_files, list) or not deps_files:
+            raise BuildpackError(f"Buildpack {name}: deps needs a template and a list of files")
+        if any(not isinstance(f, str) or "/" in f for f in deps_files):
+            raise BuildpackError(f"Buildpack {name}: deps files must be top-level names")
+        deps_template = _load_template(path.parent / deps["template"], environment, name)
+
+    files = definition.get("files") or {}
+    if not isinstance(files, dict):
+        raise BuildpackError(f"Buildpack {name}: files must map context paths to templates")
+    for target in files:
+        parts = str(target).split("/")
+        if str(target).startswith("/") or ".." in parts or target == "Dockerfile":
+            raise BuildpackError(f"Buildpack {name}: invalid generated file path {target!r}")
+    files = {target: _load_template(path.parent / template, environment, name)
+             for target, template in files.items()}
+
+    return Buildpack(
+        name=name,
+        priority=int(definition.get("priority", 0)),
+        markers=markers,
+        template=template,
+        description=definition.get("description", ""),
+        source=path,
+        deps_files=deps_files,
+        deps_template=deps_template,
+        files=files,
+    )
+
+
+def _load_template(path: Path, environment: Environment, name: str):
+    """Read and compile a buildpack template"""
+    try:
+        return environment.from_string(path.read_text())
+    except (OSError, TemplateError) as e:
+        raise BuildpackError(f"Could not load template {path.name} for buildpack {name}: {e}")
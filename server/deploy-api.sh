@@ -40,6 +40,10 @@ if docker ps -a --format '{{.Names}}' | grep -q '^vesla-api$'; then
     echo "✓ Removed old container"
 fi
 
+# Create the data directory before Compose does, so it belongs to the
+# user running this script instead of root
+mkdir -p data
+
 # Deploy with docker-compose
 echo
 echo "Deploying with Docker Compose..."
@@ -3,94 +3,450 @@ Container Deployer for Vesla
 Handles Docker container deployment with Traefik integration
 """
 
+import heapq
+import http.client
 import logging
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
 import docker
-from docker.errors import APIError, NotFound
-from typing import Optional, Dict
+from docker.errors import APIError, DockerException, NotFound
+from typing import Callable, Optional, Dict, Iterator, List, Pattern, Tuple, Union
+
+from metrics import phase
 
 logger = logging.getLogger(__name__)
 
+# Seconds a single readiness probe may take
+PROBE_TIMEOUT = 5
+
+# Container log lines included when a container never becomes ready
+READY_LOG_LINES = 30
+
+# Longest partial line buffered from a log stream before it is passed on
+MAX_LOG_LINE = 64 * 1024
+
+# Lines buffered between replica log readers and a client following them
+LOG_QUEUE_SIZE = 1000
+
+# Fields of an app in list_all_apps()
+APP_FIELDS = ("name", "domain", "status", "id", "image", "created", "replicas", "running")
+
 
 class DeploymentError(Exception):
     """Custom exception for deployment errors"""
     pass
 
 
+class DeployResult:
+    """Outcome of starting an app's containers"""
+
+    def __init__(self, container_ids: List[str], ready_time: float):
+        self.container_ids = container_ids  # One per replica started
+        self.ready_time = ready_time  # Seconds from start until every container passed its health check
+
+    @property
+    def container_id(self) -> str:
+        """ID of the first replica"""
+        return self.container_ids[0]
+
+
+class LogFilter:
+    """Which log lines to return: a time range, output streams and a pattern"""
+
+    def __init__(self, since: Optional[float] = None, until: Optional[float] = None,
+                 stdout: bool = True, stderr: bool = True, pattern: Optional[Pattern] = None):
+        self.since = since  # Unix time
+        self.until = until  # Unix time
+        self.stdout = stdout
+        self.stderr = stderr
+        self.pattern = pattern  # Searched in each line's message, after the timestamp
+
+    def docker_args(self, **overrides) -> dict:
+        """Arguments for container.logs() that Docker applies itself"""
+        args = {"since": self.since, "until": self.until, "stdout": self.stdout, "stderr": self.stderr}
+        args.update(overrides)
+        return {key: value for key, value in args.items() if value is not None}
+
+
 class ContainerDeployer:
     """Deploys and manages Docker containers with Traefik labels"""
 
-    def __init__(self, docker_client: docker.DockerClient, network_name: str):
+    def __init__(self, docker_client: docker.DockerClient, network_name: str, max_replicas: int = 10):
         self.docker = docker_client
         self.network_name = network_name
+        self.max_replicas = max_replicas
 
-    def deploy_container(self, app_name: str, image_id: str, vesla_config: dict) -> str:
+    def deploy_container(self, app_name: str, image_id: str, vesla_config: dict,
+                         log_callback: Optional[Callable[[str], None]] = None) -> DeployResult:
         """
-        Deploy a container with Traefik labels
+        Deploy an app's containers with Traefik labels
+
+        The app runs 'replicas' containers (default 1). They all carry the
+        same traefik.http.services.<app> labels, so Traefik load-balances
+        across them. The first is named after the app (or the rollout), the
+        others get a '.N' suffix, e.g. myapp, myapp.2, myapp.3.
+
+        With the default 'recreate' rollout the existing containers are
+        stopped before the new ones start. With 'blue-green' the new
+        containers start under a versioned name next to the old ones (Traefik
+        routes to both), and the old ones are drained and removed only once
+        every new one is ready.
+
+        Either way the deploy only succeeds once the new containers are ready:
+        each is probed on the Docker network (GET health_check.path, or a TCP
+        connect without a path) until success_threshold probes in a row pass.
+        If a container exits, restarts or never becomes ready, all new
+        containers are removed.
 
         Args:
             app_name: Application name (used for container name)
             image_id: Docker image ID to deploy
             vesla_config: Parsed vesla.yaml configuration
+            log_callback: Called with progress lines, e.g. readiness probes
 
         Returns:
-            Container ID
+            DeployResult with the container IDs and time to ready
 
         Raises:
-            DeploymentError: If deployment fails
+            DeploymentError: If deployment fails or a container never becomes
+                ready; the error includes the container's recent logs
         """
         domain = vesla_config.get("domain")
         if not domain:
             raise DeploymentError("No domain specified in vesla.yaml")
 
-        # Stop and remove existing container if exists
-        self._stop_existing_container(app_name)
+        rollout = self._prepare_rollout(vesla_config)
+        health = self._prepare_health_check(vesla_config, rollout)
+        replicas = self._prepare_replicas(vesla_config)
+        port = self._prepare_port(vesla_config)
+        existing = self._get_app_containers(app_name)
 
-        # Prepare environment variables
-        env_vars = self._prepare_environment(vesla_config)
+        if rollout["strategy"] == "blue-green":
+            # Unique per rollout; app names can't contain '.', so it can't
+            # be another app's container name either
+            base_name = f"{app_name}.{uuid.uuid4().hex[:8]}"
+        else:
+            # Stop and remove existing containers first
+            with phase("container_stop"):
+                self._remove_containers(existing)
+            existing = []
+            base_name = app_name
+
+        logger.info(f"Deploying {replicas} container(s) {base_name} for {app_name} ({rollout['strategy']})")
+        started = self._start_replicas(app_name, image_id, vesla_config, base_name, range(1, replicas + 1))
+        ready_time = self._wait_for_replicas(app_name, started, vesla_config["domain"], port, health,
+                                             log_callback, keeping_old=bool(existing))
+
+        if existing:
+            # Give Traefik time to pick up the new backends, then drain the old ones
+            time.sleep(rollout["drain_seconds"])
+            with phase("container_stop"):
+                self._remove_containers(existing)
+
+        logger.info(f"Successfully deployed {len(started)} container(s) for {app_name}")
+        logger.info(f"App accessible at: https://{domain}")
+
+        return DeployResult([container.id for container in started], ready_time)
+
+    def scale(self, app_name: str, image_id: str, vesla_config: dict, replicas: int,
+              log_callback: Optional[Callable[[str], None]] = None) -> DeployResult:
+        """
+        Change the number of containers an app runs, without a rollout
+
+        Scaling up starts the missing replicas from the app's current image
+        and waits until they are ready; running replicas are left alone.
+        Scaling down stops the highest-numbered replicas.
+
+        Args:
+            app_name: Application name
+            image_id: Image of the app's current release
+            vesla_config: vesla.yaml of the app's current release
+            replicas: Number of containers to run
+            log_callback: Called with progress lines
+
+        Returns:
+            DeployResult with the IDs of the containers now running the app
+            and the time the new ones took to become ready
+
+        Raises:
+            DeploymentError: If the app has no containers, replicas is out of
+                range or a new replica never becomes ready
+        """
+        replicas = self._prepare_replicas(dict(vesla_config, replicas=replicas))
+        port = self._prepare_port(vesla_config)
+        existing = sorted(self._get_app_containers(app_name), key=_replica_index)
+        if not existing:
+            raise DeploymentError(f"App {app_name} has no containers to scale")
+
+        ready_time = 0.0
+        if replicas < len(existing):
+            removed = existing[replicas:]
+            if log_callback:
+                log_callback(f"Stopping {', '.join(c.name for c in removed)}")
+            with phase("container_stop"):
+                self._remove_containers(removed)
+            kept = existing[:replicas]
+        else:
+            used = {_replica_index(container) for container in existing}
+            missing = [index for index in range(1, len(existing) + replicas + 1) if index not in used]
+            missing = missing[:replicas - len(existing)]
+            base_name = _base_name(existing[0])
+
+            started = self._start_replicas(app_name, image_id, vesla_config, base_name, missing)
+            if started:
+                health = self._prepare_health_check(vesla_config, self._prepare_rollout(vesla_config))
+                ready_time = self._wait_for_replicas(app_name, started, vesla_config["domain"], port, health,
+                                                     log_callback, keeping_old=True)
+            kept = existing + started
+
+        logger.info(f"Scaled {app_name} to {replicas} container(s)")
+        return DeployResult([container.id for container in kept], ready_time)
+
+    def _start_replicas(self, app_name: str, image_id: str, vesla_config: dict,
+                        base_name: str, indexes) -> List:
+        """
+        Start one container per replica index
 
-        # Prepare resource limits
+        Raises:
+            DeploymentError: If a container can't be started; the ones already
+                started are removed
+        """
+        env_vars = self._prepare_environment(vesla_config)
         resources = self._prepare_resources(vesla_config)
+        labels = self._prepare_traefik_labels(app_name, vesla_config["domain"], vesla_config)
+        started = []
 
-        # Prepare Traefik labels
-        labels = self._prepare_traefik_labels(app_name, domain, vesla_config)
+        try:
+            for index in indexes:
+                with phase("container_start"):
+                    started.append(self.docker.containers.run(
+                        image=image_id,
+                        name=base_name if index == 1 else f"{base_name}.{index}",
+                        detach=True,
+                        network=self.network_name,
+                        environment=env_vars,
+                        labels=dict(labels, **{"vesla.replica": str(index)}),
+                        restart_policy={"Name": "unless-stopped"},
+                        **resources
+                    ))
+        except APIError as e:
+            self._remove_containers(started)
+            raise DeploymentError(f"Failed to deploy container: {str(e)}")
 
-        # Get port from config
-        port = vesla_config.get("env", {}).get("PORT", "5000")
+        return started
+
+    def _wait_for_replicas(self, app_name: str, containers: List, domain: str, port: int, health: dict,
+                           log_callback: Optional[Callable[[str], None]], keeping_old: bool) -> float:
+        """
+        Wait until every new container is ready
+
+        Returns:
+            Seconds until the last one was ready
+
+        Raises:
+            DeploymentError: If one never becomes ready; all of them are removed
+        """
+        start_time = time.time()
 
         try:
-            logger.info(f"Deploying container for {app_name}")
-
-            container = self.docker.containers.run(
-                image=image_id,
-                name=app_name,
-                detach=True,
-                network=self.network_name,
-                environment=env_vars,
-                labels=labels,
-                restart_policy={"Name": "unless-stopped"},
-                **resources
-            )
+            with phase("container_ready"):
+                for container in containers:
+                    self._wait_until_ready(container, port, domain, health, log_callback)
+        except DeploymentError:
+            if keeping_old:
+                logger.error(f"New container for {app_name} never became ready, keeping the old ones")
+            else:
+                logger.error(f"New container for {app_name} never became ready")
+            self._remove_containers(containers)
+            raise
+
+        return time.time() - start_time
+
+    def _prepare_rollout(self, vesla_config: dict) -> dict:
+        """Rollout settings from vesla.yaml, with defaults"""
+        rollout_config = vesla_config.get("rollout", {})
+        if isinstance(rollout_config, str):
+            rollout_config = {"strategy": rollout_config}
+
+        strategy = rollout_config.get("strategy", "recreate")
+        if strategy not in ("recreate", "blue-green"):
+            raise DeploymentError(f"Unknown rollout strategy: {strategy}")
+
+        return {
+            "strategy": strategy,
+            "ready_timeout": int(rollout_config.get("ready_timeout", 60)),
+            "drain_seconds": int(rollout_config.get("drain_seconds", 5)),
+        }
 
-            logger.info(f"Successfully deployed container {container.id[:12]} for {app_name}")
-            logger.info(f"App accessible at: https://{domain}")
+    def _prepare_health_check(self, vesla_config: dict, rollout: dict) -> dict:
+        """
+        Readiness probe settings from vesla.yaml, with defaults
 
-            return container.id
+        health_check is either a path or a mapping with path, timeout (seconds
+        to wait for readiness, default rollout.ready_timeout), interval
+        (seconds between probes) and success_threshold (passing probes in a
+        row). Without a path, readiness means accepting TCP connections.
+        """
+        health_config = vesla_config.get("health_check") or {}
+        if isinstance(health_config, str):
+            health_config = {"path": health_config}
+        if not isinstance(health_config, dict):
+            raise DeploymentError("health_check must be a path or a mapping")
 
-        except APIError as e:
-            raise DeploymentError(f"Failed to deploy container: {str(e)}")
+        path = health_config.get("path")
+        if path is not None and (not isinstance(path, str) or not path.startswith("/")):
+            raise DeploymentError(f"health_check path must start with '/': {path!r}")
 
-    def _stop_existing_container(self, app_name: str):
-        """Stop and remove existing container if it exists"""
         try:
-            container = self.docker.containers.get(app_name)
-            logger.info(f"Stopping existing container: {app_name}")
-            container.stop(timeout=10)
-            container.remove()
-            logger.info(f"Removed existing container: {app_name}")
-        except NotFound:
-            logger.debug(f"No existing container found for {app_name}")
-        except Exception as e:
-            logger.warning(f"Error stopping existing container: {e}")
+            settings = {
+                "path": path,
+                "timeout": float(health_config.get("timeout", rollout["ready_timeout"])),
+                "interval": float(health_config.get("interval", 1)),
+                "success_threshold": int(health_config.get("success_threshold", 1)),
+            }
+        except (TypeError, ValueError):
+            raise DeploymentError("health_check timeout, interval and success_threshold must be numbers")
+
+        if settings["timeout"] <= 0 or settings["interval"] <= 0 or settings["success_threshold"] < 1:
+            raise DeploymentError("health_check timeout and interval must be positive "
+                                  "and success_threshold at least 1")
+        return settings
+
+    def _prepare_replicas(self, vesla_config: dict) -> int:
+        """Number of containers to run, from vesla.yaml"""
+        replicas = vesla_config.get("replicas", 1)
+        if isinstance(replicas, bool) or not isinstance(replicas, int) or not 1 <= replicas <= self.max_replicas:
+            raise DeploymentError(f"replicas must be a whole number from 1 to {self.max_replicas}")
+        return replicas
+
+    def _get_app_containers(self, app_name: str) -> List:
+        """All containers of an app, newest first"""
+        containers = self.docker.containers.list(
+            all=True,
+            filters={"label": [f"vesla.app={app_name}", "vesla.managed=true"]}
+        )
+        return sorted(containers, key=lambda c: c.attrs.get("Created", ""), reverse=True)
+
+    def _get_app_container(self, app_name: str):
+        """The container serving an app: the newest running one, else the newest"""
+        containers = self._get_app_containers(app_name)
+        if not containers:
+            raise NotFound(f"No containers for app {app_name}")
+        running = [c for c in containers if c.status == "running"]
+        return (running or containers)[0]
+
+    def _wait_until_ready(self, container, port: int, domain: str, health: dict,
+                          log_callback: Optional[Callable[[str], None]] = None) -> float:
+        """
+        Probe a new container until it passes its health check
+
+        A probe passes when the container answers on the Docker network and,
+        if the image defines a Docker HEALTHCHECK, Docker reports it healthy.
+        The container is ready after success_threshold passing probes in a row.
+
+        Returns:
+            Seconds from the start of the wait until the container was ready
+
+        Raises:
+            DeploymentError: As soon as the container exits, restarts or is
+                reported unhealthy, or if it isn't ready within the timeout
+        """
+        start_time = time.time()
+        deadline = start_time + health["timeout"]
+        target = f"GET {health['path']}" if health["path"] else f"port {port}"
+        passed, failure = 0, "container not running"
+
+        if log_callback:
+            log_callback(f"Waiting for {container.name} to pass its health check ({target})")
+
+        while True:
+            container.reload()
+            state = container.attrs.get("State", {})
+            docker_health = (state.get("Health") or {}).get("Status")
+
+            if container.status in ("exited", "dead") or state.get("Restarting") or container.attrs.get("RestartCount"):
+                raise self._not_ready(container, f"exited during startup (exit code {state.get('ExitCode')})")
+            if docker_health == "unhealthy":
+                raise self._not_ready(container, "is unhealthy according to its Docker HEALTHCHECK")
+
+            if container.status == "running":
+                ok, failure = self._probe(container, port, domain, health["path"])
+                if ok and docker_health not in (None, "healthy"):
+                    ok, failure = False, f"Docker HEALTHCHECK is {docker_health}"
+                passed = passed + 1 if ok else 0
+
+                if passed >= health["success_threshold"]:
+                    ready_time = time.time() - start_time
+                    logger.info(f"Container {container.name} ready on port {port} after {ready_time:.2f}s")
+                    if log_callback:
+                        log_callback(f"{container.name} is ready after {ready_time:.2f}s")
+                    return ready_time
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise self._not_ready(container, f"not ready after {health['timeout']:g}s ({failure})")
+            time.sleep(min(health["interval"], remaining))
+
+    def _probe(self, container, port: int, domain: str, path: Optional[str]) -> Tuple[bool, str]:
+        """
+        Probe a container once over the Docker network
+
+        Returns:
+            Tuple of (passed, description of the outcome)
+        """
+        networks = container.attrs["NetworkSettings"]["Networks"]
+        ip_address = networks.get(self.network_name, {}).get("IPAddress")
+        if not ip_address:
+            return False, f"no address on network {self.network_name}"
+
+        if not path:
+            try:
+                with socket.create_connection((ip_address, port), timeout=PROBE_TIMEOUT):
+                    return True, f"port {port} accepts connections"
+            except OSError as e:
+                return False, f"port {port}: {e}"
+
+        connection = http.client.HTTPConnection(ip_address, port, timeout=PROBE_TIMEOUT)
+        try:
+            # The app's own domain, for frameworks that check the Host header
+            connection.request("GET", path, headers={"Host": domain, "User-Agent": "vesla-health-check"})
+            status = connection.getresponse().status
+        except (OSError, http.client.HTTPException) as e:
+            return False, f"GET {path}: {e or type(e).__name__}"
+        finally:
+            connection.close()
+
+        return 200 <= status < 400, f"GET {path} returned {status}"
+
+    def _not_ready(self, container, reason: str) -> DeploymentError:
+        """Readiness failure for a container, with its most recent log lines"""
+        message = f"Container {container.name} {reason}"
+        try:
+            logs = container.logs(tail=READY_LOG_LINES).decode("utf-8", errors="replace").rstrip()
+        except APIError as e:
+            logger.warning(f"Could not read logs of {container.name}: {e}")
+            logs = ""
+        if logs:
+            message += f"\nLast {READY_LOG_LINES} log lines:\n{logs}"
+        return DeploymentError(message)
+
+    def _remove_containers(self, containers: List):
+        """Stop and remove containers, ignoring ones that are already gone"""
+        for container in containers:
+            try:
+                logger.info(f"Stopping existing container: {container.name}")
+                container.stop(timeout=10)
+                container.remove()
+                logger.info(f"Removed existing container: {container.name}")
+            except NotFound:
+                logger.debug(f"Container already removed: {container.name}")
+            except Exception as e:
+                logger.warning(f"Error stopping existing container: {e}")
 
     def _prepare_environment(self, vesla_config: dict) -> Dict[str, str]:
         """Prepare environment variables for container"""
@@ -102,6 +458,18 @@ class ContainerDeployer:
 
         return env_vars
 
+    def _prepare_port(self, vesla_config: dict) -> int:
+        """
+        Port the app listens on, from env.PORT
+
+        Raises:
+            DeploymentError: If PORT isn't a port number
+        """
+        port = str(self._prepare_environment(vesla_config)["PORT"])
+        if not port.isdigit() or not 1 <= int(port) <= 65535:
+            raise DeploymentError(f"env.PORT must be a port number from 1 to 65535: {port!r}")
+        return int(port)
+
     def _prepare_resources(self, vesla_config: dict) -> dict:
         """Prepare resource limits for container"""
         resources_config = vesla_config.get("resources", {})
@@ -157,8 +525,9 @@ class ContainerDeployer:
         }
 
         # Add health check if specified
-        if "health_check" in vesla_config:
-            health_path = vesla_config["health_check"]
+        health_config = vesla_config.get("health_check")
+        health_path = health_config.get("path") if isinstance(health_config, dict) else health_config
+        if health_path:
             labels[f"traefik.http.services.{app_name}.loadbalancer.healthcheck.path"] = health_path
             labels[f"traefik.http.services.{app_name}.loadbalancer.healthcheck.interval"] = "30s"
 
@@ -166,7 +535,10 @@ class ContainerDeployer:
 
     def get_container_status(self, app_name: str) -> Optional[dict]:
         """
-        Get status of a deployed container
+        Get status of a deployed app
+
+        The top-level fields describe the container serving the app (the
+        newest running one); 'replicas' lists every container of the app.
 
         Args:
             app_name: Application name
@@ -175,18 +547,18 @@ class ContainerDeployer:
             Dictionary with container status or None if not found
         """
         try:
-            container = self.docker.containers.get(app_name)
-            container.reload()  # Refresh status
-
-            return {
-                "id": container.id[:12],
-                "status": container.status,
-                "image": container.image.tags[0] if container.image.tags else container.image.id[:12],
-                "created": container.attrs["Created"],
-                "ports": container.attrs["NetworkSettings"]["Ports"],
-            }
-        except NotFound:
-            return None
+            containers = self.docker.api.containers(
+                all=True,
+                filters={"label": [f"vesla.app={app_name}", "vesla.managed=true"]}
+            )
+            if not containers:
+                return None
+            image_id = _serving(containers).get("ImageID", "")
+            try:
+                names = image_names([self.docker.api.inspect_image(image_id)])
+            except NotFound:
+                names = {}
+            return summarize_app(containers, names)
         except Exception as e:
             logger.error(f"Error getting container status: {e}")
             return None
@@ -202,9 +574,13 @@ class ContainerDeployer:
             True if successful, False otherwise
         """
         try:
-            container = self.docker.containers.get(app_name)
+            containers = self._get_app_containers(app_name)
+            if not containers:
+                raise NotFound(f"No containers for app {app_name}")
+
             logger.info(f"Stopping container: {app_name}")
-            container.stop(timeout=10)
+            for container in containers:
+                container.stop(timeout=10)
             return True
         except NotFound:
             logger.warning(f"Container not found: {app_name}")
@@ -224,14 +600,17 @@ class ContainerDeployer:
             True if successful, False otherwise
         """
         try:
-            container = self.docker.containers.get(app_name)
-            logger.info(f"Removing container: {app_name}")
+            containers = self._get_app_containers(app_name)
+            if not containers:
+                raise NotFound(f"No containers for app {app_name}")
 
-            # Stop if running
-            if container.status == "running":
-                container.stop(timeout=10)
+            logger.info(f"Removing container: {app_name}")
+            for container in containers:
+                # Stop if running
+                if container.status == "running":
+                    container.stop(timeout=10)
 
-            container.remove()
+                container.remove()
             return True
         except NotFound:
             logger.warning(f"Container not found: {app_name}")
@@ -240,56 +619,348 @@ class ContainerDeployer:
             logger.error(f"Error removing container: {e}")
             return False
 
-    def get_container_logs(self, app_name: str, tail: int = 100) -> Optional[str]:
+    def get_container_logs(self, app_name: str, tail: Union[int, str] = 100,
+                           log_filter: Optional[LogFilter] = None) -> Optional[str]:
         """
         Get container logs
 
+        With several replicas, the last tail lines of each running container
+        are merged by timestamp and every line is prefixed with its container.
+
         Args:
             app_name: Application name
-            tail: Number of lines to return
+            tail: Number of lines to return, or "all"
+            log_filter: Time range, output streams and pattern of lines to return
 
         Returns:
             Log output as string or None if container not found
         """
         try:
-            container = self.docker.containers.get(app_name)
-            logs = container.logs(tail=tail, timestamps=True)
-            return logs.decode("utf-8")
-        except NotFound:
-            logger.warning(f"Container not found: {app_name}")
-            return None
+            lines = self.stream_container_logs(app_name, tail=tail, log_filter=log_filter)
+            if lines is None:
+                logger.warning(f"Container not found: {app_name}")
+                return None
+            # Replicas return tail lines each; keep the newest tail overall
+            return "".join(deque(lines, maxlen=max(tail, 0) if isinstance(tail, int) else None))
         except Exception as e:
             logger.error(f"Error getting container logs: {e}")
             return None
 
-    def list_all_apps(self) -> list:
+    def stream_container_logs(self, app_name: str, tail: Union[int, str] = 100,
+                              log_filter: Optional[LogFilter] = None,
+                              follow: bool = False) -> Optional[Iterator[str]]:
         """
-        List all Vesla-managed containers
+        Stream container logs line by line
+
+        Lines are passed on as Docker produces them rather than collected, so
+        a large tail costs no more memory than a small one. With several
+        running replicas, each container's last tail lines are merged by
+        timestamp and prefixed with the container's name; when following,
+        new lines of all replicas are then interleaved as they arrive.
+
+        The filter's time range and output streams are passed to Docker; its
+        pattern is matched here, against the last tail lines, before the
+        lines leave the server.
+
+        Args:
+            app_name: Application name
+            tail: Number of lines to read per container, or "all"
+            log_filter: Time range, output streams and pattern of lines to return
+            follow: Keep streaming new lines until the containers stop, the
+                filter's until time passes or the caller closes the iterator
+
+        Returns:
+            Iterator of log lines ending in a newline, or None if the app
+            has no container
+        """
+        log_filter = log_filter or LogFilter()
+        containers = self._get_app_containers(app_name)
+        if not containers:
+            return None
+
+        running = sorted((c for c in containers if c.status == "running"), key=_replica_index)
+        if len(running) <= 1:
+            container = (running or containers)[0]
+            stream = container.logs(stream=True, follow=follow, tail=tail, timestamps=True,
+                                    **log_filter.docker_args())
+            return log_lines(stream, log_filter.pattern)
+
+        return self._merged_logs(running, tail, log_filter, follow)
+
+    def _merged_logs(self, containers: List, tail: Union[int, str], log_filter: LogFilter,
+                     follow: bool) -> Iterator[str]:
+        """Merge replica logs by timestamp up to now, then follow them all"""
+        now = time.time()
+        history = log_filter.docker_args(until=min(log_filter.until or now, now))
+        streams = [container.logs(stream=True, tail=tail, timestamps=True, **history)
+                   for container in containers]
+        try:
+            # Each container's lines are already in order, and lines start
+            # with an RFC 3339 UTC timestamp, so they merge as strings
+            yield from heapq.merge(*(
+                _prefixed(container.name, log_lines(stream, log_filter.pattern))
+                for container, stream in zip(containers, streams)
+            ))
+        finally:
+            for stream in streams:
+                _close_stream(stream)
+
+        if follow and (log_filter.until is None or log_filter.until > now):
+            live = log_filter.docker_args(since=max(log_filter.since or now, now))
+            yield from _follow_logs([
+                (container.name, container.logs(stream=True, follow=True, timestamps=True, **live))
+                for container in containers
+            ], log_filter.pattern)
+
+    def list_all_apps(self, fields: Optional[List[str]] = None) -> list:
+        """
+        List all Vesla-managed apps
+
+        Apps with several containers are listed once, described by their
+        serving container (the newest running one), with replica counts.
+        Built from one container list and one image list call joined in
+        memory, so the number of Docker API requests doesn't grow with the
+        number of apps.
+
+        Args:
+            fields: Keys of APP_FIELDS to include, all if None
 
         Returns:
-            List of dictionaries with app information
+            List of dictionaries with app information, sorted by name
         """
         try:
-            # Get all containers with vesla.managed label
-            containers = self.docker.containers.list(
+            # Summaries from the list call itself; the high-level client
+            # would inspect every container and look up every image
+            containers = self.docker.api.containers(
                 all=True,
                 filters={"label": "vesla.managed=true"}
             )
-
-            apps = []
-            for container in containers:
-                labels = container.labels
-                apps.append({
-                    "name": labels.get("vesla.app", container.name),
-                    "domain": labels.get("vesla.domain", "N/A"),
-                    "status": container.status,
-                    "id": container.id[:12],
-                    "image": container.image.tags[0] if container.image.tags else container.image.id[:12],
-                    "created": container.attrs["Created"]
-                })
-
-            return apps
+            names = image_names(self.docker.api.images()) if not fields or "image" in fields else {}
+            return summarize_apps(containers, names, fields)
 
         except Exception as e:
             logger.error(f"Error listing apps: {e}")
             return []
+
+
+def summarize_apps(containers: List[dict], names: Dict[str, str],
+                   fields: Optional[List[str]] = None) -> List[dict]:
+    """
+    App list entries from container summaries (as returned by the list API)
+
+    Args:
+        containers: Container summaries of Vesla-managed containers
+        names: Image names by image ID, see image_names()
+        fields: Keys of APP_FIELDS to include, all if None
+
+    Returns:
+        One dictionary per app, sorted by name
+    """
+    fields = list(fields or APP_FIELDS)
+    by_app = {}
+    for container in containers:
+        by_app.setdefault(_app_name(container), []).append(container)
+
+    apps = []
+    for name in sorted(by_app):
+        app_containers = by_app[name]
+        container = _serving(app_containers)
+        app = {
+            "name": name,
+            "domain": (container.get("Labels") or {}).get("vesla.domain", "N/A"),
+            "status": container.get("State"),
+            "id": container["Id"][:12],
+            "image": _image_name(container, names),
+            "created": _iso_time(container.get("Created", 0)),
+            "replicas": len(app_containers),
+            "running": sum(1 for c in app_containers if c.get("State") == "running"),
+        }
+        apps.append({field: app[field] for field in fields})
+    return apps
+
+
+def summarize_app(containers: List[dict], names: Dict[str, str]) -> Optional[dict]:
+    """
+    Status of one app from the summaries of its containers
+
+    Args:
+        containers: Container summaries of the app
+        names: Image names by image ID, see image_names()
+
+    Returns:
+        Status dictionary as returned by get_container_status(), None
+        without containers
+    """
+    if not containers:
+        return None
+    container = _serving(containers)
+    return {
+        "id": container["Id"][:12],
+        "status": container.get("State"),
+        "image": _image_name(container, names),
+        "created": _iso_time(container.get("Created", 0)),
+        "ports": _port_bindings(container.get("Ports")),
+        "running": sum(1 for c in containers if c.get("State") == "running"),
+        "replicas": [
+            {"replica": _label_index(c.get("Labels") or {}), "name": _container_name(c),
+             "id": c["Id"][:12], "status": c.get("State")}
+            for c in sorted(containers, key=lambda c: _label_index(c.get("Labels") or {}))
+        ],
+    }
+
+
+def image_names(images: List[dict]) -> Dict[str, str]:
+    """First tag of each image (short ID if untagged) by image ID"""
+    names = {}
+    for image in images:
+        tags = [tag for tag in image.get("RepoTags") or [] if tag != "<none>:<none>"]
+        names[image["Id"]] = tags[0] if tags else image["Id"].split(":")[-1][:12]
+    return names
+
+
+def _app_name(container: dict) -> str:
+    return (container.get("Labels") or {}).get("vesla.app") or _container_name(container)
+
+
+def _container_name(container: dict) -> str:
+    return (container.get("Names") or ["/"])[0].lstrip("/")
+
+
+def _serving(containers: List[dict]) -> dict:
+    """The summary of the container serving an app: the newest running one, else the newest"""
+    newest = sorted(containers, key=lambda c: c.get("Created", 0), reverse=True)
+    return next((c for c in newest if c.get("State") == "running"), newest[0])
+
+
+def _image_name(container: dict, names: Dict[str, str]) -> str:
+    image_id = container.get("ImageID", "")
+    return names.get(image_id) or container.get("Image") or image_id.split(":")[-1][:12]
+
+
+def _port_bindings(ports: Optional[List[dict]]) -> dict:
+    """A summary's port list in the NetworkSettings.Ports format of inspect"""
+    bindings = {}
+    for port in ports or []:
+        key = f"{port['PrivatePort']}/{port.get('Type', 'tcp')}"
+        bindings.setdefault(key, None)
+        if port.get("PublicPort"):
+            bindings[key] = (bindings[key] or []) + [
+                {"HostIp": port.get("IP", ""), "HostPort": str(port["PublicPort"])}
+            ]
+    return bindings
+
+
+def log_lines(stream, pattern: Optional[Pattern] = None) -> Iterator[str]:
+    """
+    Split a Docker log stream into lines, closing it once the caller stops reading
+
+    Lines are timestamped; with a pattern, only lines whose message (the
+    part after the timestamp) matches are passed on.
+    """
+    partial = b""
+    try:
+        for chunk in stream:
+            *lines, partial = (partial + chunk).split(b"\n")
+            if len(partial) > MAX_LOG_LINE:
+                lines.append(partial)
+                partial = b""
+            yield from _matching(lines, pattern)
+        if partial:
+            yield from _matching([partial], pattern)
+    finally:
+        _close_stream(stream)
+
+
+def _matching(lines: List[bytes], pattern: Optional[Pattern]) -> Iterator[str]:
+    """Decoded lines whose message matches the pattern"""
+    for line in lines:
+        text = line.decode("utf-8", errors="replace")
+        if pattern is None or pattern.search(text.partition(" ")[2]):
+            yield text + "\n"
+
+
+def _prefixed(name: str, lines: Iterator[str]) -> Iterator[str]:
+    """Insert the container name after each line's timestamp"""
+    for line in lines:
+        timestamp, _, message = line.partition(" ")
+        yield f"{timestamp} [{name}] {message}"
+
+
+def _follow_logs(sources: List[Tuple[str, object]], pattern: Optional[Pattern] = None) -> Iterator[str]:
+    """
+    Interleave followed log streams of several containers as lines arrive
+
+    A reader thread per stream feeds a queue of at most LOG_QUEUE_SIZE
+    lines, so a slow client holds the readers back instead of letting
+    lines pile up in memory. Closing the iterator closes every stream.
+    """
+    lines = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    finished = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                lines.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(name, stream):
+        try:
+            for line in _prefixed(name, log_lines(stream, pattern)):
+                if not put(line):
+                    return
+        except Exception as e:
+            logger.warning(f"Log stream of {name} failed: {e}")
+        finally:
+            put(finished)
+
+    for name, stream in sources:
+        threading.Thread(target=read, args=(name, stream), name=f"vesla-logs-{name}", daemon=True).start()
+
+    try:
+        remaining = len(sources)
+        while remaining:
+            item = lines.get()
+            if item is finished:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        stop.set()
+        for _, stream in sources:
+            _close_stream(stream)
+
+
+def _close_stream(stream):
+    """Close a Docker stream, which may already be closed"""
+    try:
+        stream.close()
+    except (OSError, DockerException):
+        pass
+
+
+def _iso_time(timestamp: int) -> str:
+    """Unix time as the ISO 8601 format Docker's inspect output uses"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _base_name(container) -> str:
+    """Name of a container without its '.<replica>' suffix"""
+    suffix = f".{_replica_index(container)}"
+    return container.name[:-len(suffix)] if container.name.endswith(suffix) else container.name
+
+
+def _replica_index(container) -> int:
+    """Replica number of a container (1 for containers from before replicas)"""
+    return _label_index(container.labels)
+
+
+def _label_index(labels: Dict[str, str]) -> int:
+    """Replica number from a container's labels"""
+    try:
+        return int(labels.get("vesla.replica", 1))
+    except (TypeError, ValueError):
+        return 1
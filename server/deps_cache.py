@@ -0,0 +1,199 @@
+"""
+Dependency Image Cache for Vesla
+Keeps images with installed dependencies, keyed by lockfile content, for reuse across deploys
+"""
+
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict
+
+import docker
+from docker.errors import APIError, ImageNotFound
+
+from metrics import BUILD_CACHE
+
+logger = logging.getLogger(__name__)
+
+# Repository every dependency image is tagged in
+REPOSITORY = "vesla-deps"
+
+
+class DepsCache:
+    """
+    LRU cache of dependency images within a disk budget
+
+    A dependency image is a buildpack's dependency stage built from an
+    upload's lockfiles alone. Its tag is derived from the lockfile hashes and
+    the rendered stage (which names the base image), so any app with the same
+    dependencies reuses it, and changing a lockfile or the base image gives a
+    new tag. When the images' total size exceeds the budget, the least
+    recently used ones are removed, except images being checked or built and
+    those pinned by a build that uses them.
+    """
+
+    def __init__(self, docker_client: docker.DockerClient, max_size: int):
+        """
+        Args:
+            docker_client: Docker client
+            max_size: Disk budget in bytes, as reported by Docker image sizes
+        """
+        self.docker = docker_client
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # tag -> size, oldest use first
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Lock] = {}  # tag -> lock, while get_or_build() runs for it
+        self._waiting = Counter()  # tag -> get_or_build() calls in progress
+        self._pinned = Counter()  # tag -> builds using the image
+
+    def load(self):
+        """Adopt dependency images left by earlier server runs, oldest first"""
+        try:
+            images = self.docker.images.list(name=REPOSITORY)
+        except APIError as e:
+            logger.warning(f"Could not list dependency images: {e}")
+            return
+
+        with self._lock:
+            for image in sorted(images, key=lambda image: image.attrs.get("Created", "")):
+                for tag in image.tags:
+                    if tag.startswith(f"{REPOSITORY}:"):
+                        self._entries[tag] = image.attrs.get("Size", 0)
+
+        logger.info(f"Dependency image cache: {len(self._entries)} images, {self.size() // (1024 * 1024)} MB")
+
+    @staticmethod
+    def tag_for(runtime: str, dockerfile: str, digests: Dict[str, str]) -> str:
+        """
+        Tag of the dependency image for a dependency stage and its lockfiles
+
+        Args:
+            runtime: Buildpack name
+            dockerfile: Rendered dependency stage
+            digests: SHA-256 of each lockfile present in the upload
+
+        Returns:
+            Image tag in the dependency image repository
+        """
+        sha = hashlib.sha256(f"{runtime}\0{dockerfile}\0".encode("utf-8"))
+        for name in sorted(digests):
+            sha.update(f"{name}\0{digests[name]}\0".encode("utf-8"))
+        return f"{REPOSITORY}:{runtime}-{sha.hexdigest()[:16]}"
+
+    def get_or_build(self, tag: str, build: Callable[[], None]) -> bool:
+        """
+        Make sure a dependency image exists, building it on a cache miss
+
+        Concurrent calls for the same tag build it once; the others wait and
+        then count as hits.
+
+        Args:
+            tag: Dependency image tag from tag_for()
+            build: Builds the image and tags it as tag
+
+        Returns:
+            True on a cache hit, False if the image was built
+        """
+        with self._lock:
+            key_lock = self._building.setdefault(tag, threading.Lock())
+            self._waiting[tag] += 1
+
+        try:
+            with key_lock:
+                if self._exists(tag):
+                    with self._lock:
+                        self.hits += 1
+                    BUILD_CACHE.labels(cache="deps", result="hit").inc()
+                    return True
+
+                with self._lock:
+                    self.misses += 1
+                BUILD_CACHE.labels(cache="deps", result="miss").inc()
+
+                build()
+
+                try:
+                    size = self.docker.images.get(tag).attrs.get("Size", 0)
+                except APIError:
+                    size = 0
+
+                with self._lock:
+                    self._entries[tag] = size
+        finally:
+            with self._lock:
+                self._waiting[tag] -= 1
+                if not self._waiting[tag]:
+                    del self._waiting[tag]
+                    self._building.pop(tag, None)
+
+        self._evict(keep=tag)
+        return False
+
+    def pin(self, tag: str):
+        """Keep an image from being evicted while a build uses it; pair with unpin()"""
+        with self._lock:
+            self._pinned[tag] += 1
+
+    def unpin(self, tag: str):
+        """Release a pin taken with pin()"""
+        with self._lock:
+            self._pinned[tag] -= 1
+            if self._pinned[tag] <= 0:
+                del self._pinned[tag]
+
+    def size(self) -> int:
+        """Total size of cached dependency images in bytes"""
+        with self._lock:
+            return sum(self._entries.values())
+
+    def stats(self) -> dict:
+        """Cache counters and usage for the API"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "images": len(self._entries),
+                "size": sum(self._entries.values()),
+                "max_size": self.max_size,
+            }
+
+    def _exists(self, tag: str) -> bool:
+        """Check the cache and the daemon, forgetting images removed behind our back"""
+        with self._lock:
+            if tag not in self._entries:
+                return False
+            # Mark it used in the same step; eviction skips it from here on
+            self._entries.move_to_end(tag)
+
+        try:
+            self.docker.images.get(tag)
+            return True
+        except ImageNotFound:
+            with self._lock:
+                self._entries.pop(tag, None)
+            return False
+
+    def _evict(self, keep: str):
+        """Remove least recently used images until the cache fits its budget"""
+        while True:
+            with self._lock:
+                if sum(self._entries.values()) <= self.max_size:
+                    return
+                victim = next((tag for tag in self._entries
+                               if tag != keep and tag not in self._waiting and tag not in self._pinned), None)
+                if victim is None:
+                    return
+                del self._entries[victim]
+                self.evictions += 1
+
+            try:
+                # Untags only if an app image still builds on it; its layers go with that image
+                self.docker.images.remove(victim)
+                logger.info(f"Evicted dependency image {victim}")
+            except APIError as e:
+                logger.warning(f"Could not remove dependency image {victim}: {e}")
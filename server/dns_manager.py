@@ -14,8 +14,9 @@ logger = logging.getLogger(__name__)
 class DNSManager:
     """Manages DNS records via Digital Ocean API"""
 
-    def __init__(self, api_token: str):
+    def __init__(self, api_token: str, timeout: int = 10):
         self.api_token = api_token
+        self.timeout = timeout
         self.base_url = "https://api.digitalocean.com/v2"
         self.headers = {
             "Authorization": f"Bearer {self.api_token}",
@@ -45,7 +46,7 @@ class DNSManager:
 
         try:
             logger.info(f"Creating DNS A record: {subdomain}.{domain} -> {ip_address}")
-            response = requests.post(url, json=data, headers=self.headers)
+            response = requests.post(url, json=data, headers=self.headers, timeout=self.timeout)
 
             if response.status_code == 201:
                 logger.info(f"Successfully created A record for {subdomain}.{domain}")
@@ -76,7 +77,7 @@ class DNSManager:
         }
 
         try:
-            response = requests.put(url, json=data, headers=self.headers)
+            response = requests.put(url, json=data, headers=self.headers, timeout=self.timeout)
             if response.status_code == 200:
                 logger.info(f"Successfully updated A record for {subdomain}.{domain}")
                 return True
@@ -92,7 +93,7 @@ class DNSManager:
         url = f"{self.base_url}/domains/{domain}/records"
 
         try:
-            response = requests.get(url, headers=self.headers)
+            response = requests.get(url, headers=self.headers, timeout=self.timeout)
             if response.status_code == 200:
                 records = response.json().get("domain_records", [])
                 for record in records:
@@ -113,7 +114,7 @@ class DNSManager:
         url = f"{self.base_url}/domains/{domain}/records/{record_id}"
 
         try:
-            response = requests.delete(url, headers=self.headers)
+            response = requests.delete(url, headers=self.headers, timeout=self.timeout)
             if response.status_code == 204:
                 logger.info(f"Successfully deleted A record for {subdomain}.{domain}")
                 return True
@@ -0,0 +1,304 @@
+"""
+Image Garbage Collection for Vesla
+Removes images of old releases and dangling layers from a background thread
+"""
+
+import logging
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set
+
+import docker
+from docker.errors import APIError, ImageNotFound
+
+from metrics import GC_IMAGES_REMOVED, GC_RECLAIMED_BYTES, GC_RUN_SECONDS
+from releases import ReleaseStore, ReleaseError
+
+logger = logging.getLogger(__name__)
+
+# Tags Vesla gives app images: release (r12), content (sha-...) and latest
+APP_TAG = re.compile(r"^(r\d+|sha-[0-9a-f]{12}|latest)$")
+
+# Run reports kept for the API
+MAX_REPORTS = 20
+
+
+class ImageGC:
+    """
+    Background image garbage collector
+
+    A collection trims every app's release history to keep_releases and
+    removes the images no retained release points at, then prunes dangling
+    images. Images backing a container are never removed, and apps with a
+    deployment queued or running are skipped until the next run, so an image
+    that's being built or deployed can't disappear underneath it.
+
+    Collections run every interval seconds, on request, and early when free
+    space on the Docker data root drops below min_free_percent. Under disk
+    pressure the unused build cache is pruned as well.
+    """
+
+    def __init__(self, docker_client: docker.DockerClient, release_store: ReleaseStore,
+                 keep_releases: int = 5, interval: int = 3600, check_interval: int = 60,
+                 docker_root: str = "/var/lib/docker", min_free_percent: float = 10,
+                 pressure_cooldown: int = 600,
+                 is_busy: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            docker_client: Docker client
+            release_store: Release history of every app
+            keep_releases: Releases (and their images) kept per app
+            interval: Seconds between scheduled collections
+            check_interval: Seconds between free space checks
+            docker_root: Directory whose file system holds Docker's images
+            min_free_percent: Collect early when free space falls below this
+            pressure_cooldown: Minimum seconds between collections triggered
+                by disk pressure, in case a collection can't free enough
+            is_busy: Returns True for apps with a deployment queued or running
+        """
+        self.docker = docker_client
+        self.release_store = release_store
+        self.keep_releases = keep_releases
+        self.interval = interval
+        self.check_interval = check_interval
+        self.docker_root = docker_root
+        self.min_free_percent = min_free_percent
+        self.pressure_cooldown = pressure_cooldown
+        self.is_busy = is_busy or (lambda app_name: False)
+
+        self.runs = 0
+        self.images_removed = 0
+        self.reclaimed_bytes = 0
+        self.run_seconds = 0.0
+        self.reports = deque(maxlen=MAX_REPORTS)
+        self._running = False
+        self._requested = None
+        self._last_pressure_run = 0.0
+        self._disk_warned = False
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start collecting from a background thread"""
+        thread = threading.Thread(target=self._loop, name="vesla-image-gc", daemon=True)
+        thread.start()
+
+    def stop(self):
+        """Stop the background thread after the current collection"""
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self, reason: str = "requested"):
+        """Ask the background thread to collect now; repeated requests coalesce"""
+        with self._lock:
+            self._requested = self._requested or reason
+        self._wake.set()
+
+    def free_percent(self) -> Optional[float]:
+        """Free space on the Docker data root in percent, None if it can't be read"""
+        try:
+            usage = shutil.disk_usage(self.docker_root)
+        except OSError as e:
+            if not self._disk_warned:
+                logger.warning(f"Cannot check free space on {self.docker_root}: {e}; "
+                               "disk pressure won't trigger collections")
+                self._disk_warned = True
+            return None
+        return usage.free * 100 / usage.total if usage.total else None
+
+    def run(self, reason: str = "requested") -> dict:
+        """
+        Run one collection
+
+        Args:
+            reason: What triggered the collection, recorded in the report
+
+        Returns:
+            Report with the images removed, bytes reclaimed and duration
+        """
+        with self._run_lock:
+            with self._lock:
+                self._running = True
+            try:
+                return self._collect(reason)
+            finally:
+                with self._lock:
+                    self._running = False
+
+    def stats(self) -> dict:
+        """Collector counters and recent run reports for the API"""
+        with self._lock:
+            return {
+                "running": self._running,
+                "runs": self.runs,
+                "images_removed": self.images_removed,
+                "reclaimed_bytes": self.reclaimed_bytes,
+                "run_seconds": round(self.run_seconds, 2),
+                "keep_releases": self.keep_releases,
+                "interval": self.interval,
+                "min_free_percent": self.min_free_percent,
+                "free_percent": _rounded(self.free_percent()),
+                "last_run": self.reports[-1] if self.reports else None,
+                "reports": list(reversed(self.reports)),
+            }
+
+    def _loop(self):
+        """Background thread: collect on request, under disk pressure and every interval"""
+        next_run = time.time() + self.interval
+
+        while not self._stop.is_set():
+            self._wake.wait(self.check_interval)
+            if self._stop.is_set():
+                return
+
+            self._wake.clear()
+            with self._lock:
+                reason, self._requested = self._requested, None
+
+            if reason is None and self._under_pressure():
+                reason = "disk pressure"
+            if reason is None and time.time() >= next_run:
+                reason = "interval"
+            if reason is None:
+                continue
+
+            try:
+                self.run(reason)
+            except Exception as e:
+                logger.error(f"Image collection failed: {e}")
+            next_run = time.time() + self.interval
+
+    def _under_pressure(self) -> bool:
+        """Free space is low and the last pressure-triggered run isn't too recent"""
+        if time.time() - self._last_pressure_run < self.pressure_cooldown:
+            return False
+        free = self.free_percent()
+        return free is not None and free < self.min_free_percent
+
+    def _collect(self, reason: str) -> dict:
+        start_time = time.time()
+        free_before = self.free_percent()
+        pressure = reason == "disk pressure" or (free_before is not None and free_before < self.min_free_percent)
+        if pressure:
+            self._last_pressure_run = start_time
+
+        sizes = self._image_sizes()
+        in_use = self._images_in_use()
+        removed, reclaimed, skipped = 0, 0, []
+
+        for app_name in self.release_store.apps():
+            if self.is_busy(app_name):
+                skipped.append(app_name)
+                continue
+            try:
+                image_ids = self._collect_app(app_name, in_use)
+            except (ReleaseError, APIError) as e:
+                logger.warning(f"Could not collect images of {app_name}: {e}")
+                continue
+            removed += len(image_ids)
+            reclaimed += sum(sizes.get(image_id, 0) for image_id in image_ids)
+
+        try:
+            reclaimed += self.docker.images.prune(filters={"dangling": True}).get("SpaceReclaimed") or 0
+        except APIError as e:
+            logger.warning(f"Could not prune dangling images: {e}")
+
+        if pressure:
+            try:
+                reclaimed += self.docker.api.prune_builds().get("SpaceReclaimed") or 0
+            except APIError as e:
+                logger.warning(f"Could not prune build cache: {e}")
+
+        duration = time.time() - start_time
+        report = {
+            "reason": reason,
+            "started_at": start_time,
+            "duration": round(duration, 2),
+            "images_removed": removed,
+            "reclaimed_bytes": reclaimed,
+            "build_cache_pruned": pressure,
+            "skipped_apps": skipped,
+            "free_percent_before": _rounded(free_before),
+            "free_percent_after": _rounded(self.free_percent()),
+        }
+
+        with self._lock:
+            self.runs += 1
+            self.images_removed += removed
+            self.reclaimed_bytes += reclaimed
+            self.run_seconds += duration
+            self.reports.append(report)
+        GC_RUN_SECONDS.labels(reason=reason).observe(duration)
+        GC_RECLAIMED_BYTES.inc(reclaimed)
+        GC_IMAGES_REMOVED.inc(removed)
+
+        logger.info(f"Image collection ({reason}): removed {removed} images, "
+                    f"reclaimed {reclaimed // (1024 * 1024)} MB in {duration:.2f}s")
+        return report
+
+    def _collect_app(self, app_name: str, in_use: Set[str]) -> List[str]:
+        """
+        Trim an app's releases and remove its images nothing references
+
+        Returns:
+            IDs of the images removed
+        """
+        self.release_store.trim(app_name, self.keep_releases)
+        retained = self.release_store.list(app_name)
+        kept_ids = {release["image_id"] for release in retained}
+        kept_tags = {tag for release in retained for tag in release["tags"]}
+        removed = []
+
+        for image in self.docker.images.list(name=app_name):
+            tags = [tag for tag in image.tags if tag.rsplit(":", 1)[0] == app_name]
+            if not tags or any(not APP_TAG.match(tag.rsplit(":", 1)[1]) for tag in tags):
+                continue  # Not (only) tagged by Vesla
+
+            if image.id in kept_ids or image.id in in_use:
+                # Keep the image, but drop release tags of trimmed releases
+                stale = [tag for tag in tags if tag not in kept_tags and tag.split(":", 1)[1].startswith("r")]
+                self._remove_tags(stale)
+                continue
+
+            if self._remove_tags(tags):
+                removed.append(image.id)
+
+        return removed
+
+    def _remove_tags(self, tags) -> bool:
+        """Remove image tags; the image goes with its last tag. True if all were removed."""
+        ok = True
+        for tag in tags:
+            try:
+                self.docker.images.remove(tag)
+            except ImageNotFound:
+                pass
+            except APIError as e:
+                logger.warning(f"Could not remove image {tag}: {e}")
+                ok = False
+        return ok
+
+    def _images_in_use(self) -> Set[str]:
+        """IDs of images backing any container, running or not"""
+        # Container summaries carry the image ID; no inspect per container
+        return {container.get("ImageID") for container in self.docker.api.containers(all=True)}
+
+    def _image_sizes(self) -> Dict[str, int]:
+        """Bytes each image frees when removed (layers no other image shares), by ID"""
+        try:
+            df = self.docker.df()
+        except APIError as e:
+            logger.debug(f"Could not read Docker disk usage: {e}")
+            return {}
+        # SharedSize is -1 when the daemon didn't compute it
+        return {image["Id"]: image.get("Size", 0) - max(image.get("SharedSize", 0), 0)
+                for image in df.get("Images") or []}
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
@@ -0,0 +1,319 @@
+"""
+Deploy Job Queue for Vesla
+Schedules deployments onto background worker threads and tracks their progress
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled"""
+    pass
+
+
+class Job:
+    """A single deployment job, its progress and its log output"""
+
+    def __init__(self, app_name: str, max_log_lines: int = 5000, apps: Optional[List[str]] = None,
+                 kind: str = "deploy"):
+        self.id = uuid.uuid4().hex[:12]
+        self.app = app_name
+        self.kind = kind  # deploy, project, rollback, scale or autoscale
+        self.apps = apps or [app_name]  # Apps the job deploys; a project deploy has several
+        self.status = "queued"  # queued, running, success, error, cancelled, superseded
+        self.phase = "queued"
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self._logs = deque(maxlen=max_log_lines)
+        self._log_count = 0
+        self._lock = threading.Lock()
+        self._log_added = threading.Condition(self._lock)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def update(self, phase: str, progress: int):
+        """Record the phase the job is currently in"""
+        with self._lock:
+            self.phase = phase
+            self.progress = progress
+        logger.info(f"Job {self.id} ({self.app}): {phase} [{progress}%]")
+        self.log(f"==> {phase}")
+
+    def log(self, line: str):
+        """Append a line to the job's log buffer and wake up followers"""
+        with self._log_added:
+            self._logs.append(line.rstrip("\n"))
+            self._log_count += 1
+            self._log_added.notify_all()
+
+    def read_logs(self, offset: int = 0, timeout: float = 0) -> Tuple[List[str], int]:
+        """
+        Read log lines written after offset
+
+        Args:
+            offset: Number of lines already read by the caller
+            timeout: Seconds to wait for new lines if there are none yet
+
+        Returns:
+            Tuple of (lines, next_offset). Lines that fell out of the buffer
+            are skipped.
+        """
+        with self._log_added:
+            if self._log_count <= offset and timeout and not self.done:
+                self._log_added.wait(timeout)
+
+            first = self._log_count - len(self._logs)
+            start = max(offset, first)
+            lines = list(self._logs)[start - first:]
+            return lines, self._log_count
+
+    def cancel(self):
+        """Ask the job to stop at its next checkpoint"""
+        self.cancelled.set()
+        self.log("==> cancel requested")
+
+    def check_cancelled(self):
+        """Raise JobCancelled if the job has been cancelled"""
+        if self.cancelled.is_set():
+            raise JobCancelled("Job cancelled")
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds the job spent (or has spent so far) waiting in the queue"""
+        if self.started_at is not None:
+            return self.started_at - self.created_at
+        return (self.finished_at or time.time()) - self.created_at
+
+    def finish(self, status: str, error: Optional[str] = None, result: Optional[dict] = None):
+        """Record the job's outcome and wake up log followers"""
+        with self._log_added:
+            self.status = status
+            self.error = error
+            if result is not None:
+                self.result = result
+                self.phase = "done"
+                self.progress = 100
+            self.finished_at = time.time()
+            self._log_added.notify_all()
+
+    def to_dict(self) -> dict:
+        """Serialize job state for the API"""
+        with self._lock:
+            return {
+                "id": self.id,
+                "app": self.app,
+                "apps": self.apps,
+                "kind": self.kind,
+                "status": self.status,
+                "done": self.finished_at is not None,
+                "phase": self.phase,
+                "progress": self.progress,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "wait_time": round(self.wait_time, 2),
+            }
+
+
+class _QueueEntry:
+    """A job waiting for a worker, with what it needs to run"""
+
+    def __init__(self, job: Job, fn: Callable, args: tuple, cleanup: Optional[Callable]):
+        self.job = job
+        self.fn = fn
+        self.args = args
+        self.cleanup = cleanup
+
+    def discard(self):
+        """Release resources of a job that will never run"""
+        if self.cleanup:
+            try:
+                self.cleanup()
+            except Exception as e:
+                logger.warning(f"Cleanup for job {self.job.id} failed: {e}")
+
+
+class JobQueue:
+    """
+    Bounded, fair scheduler for deployment jobs
+
+    - At most max_concurrent_builds jobs run at once
+    - Jobs for the same app never run concurrently; a job deploying several
+      apps waits until none of them is busy
+    - A new job for an app replaces that app's job of the same kind still
+      waiting in the queue (a deploy replaces a deploy, a scale a scale)
+    - Runnable jobs start in submission order across apps
+    """
+
+    def __init__(self, max_concurrent_builds: int = 2, max_history: int = 200):
+        self.max_concurrent_builds = max_concurrent_builds
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self.pending = []
+        self.running = {}
+        self._cond = threading.Condition()
+
+        for i in range(max_concurrent_builds):
+            worker = threading.Thread(target=self._worker, name=f"vesla-deploy-{i}", daemon=True)
+            worker.start()
+
+    def submit(self, app_name: str, fn: Callable, *args, cleanup: Optional[Callable] = None,
+               apps: Optional[List[str]] = None, kind: str = "deploy") -> Job:
+        """
+        Queue a deployment job
+
+        Args:
+            app_name: Application name (or project name for several apps)
+            fn: Callable run as fn(job, *args); its return value becomes the job result
+            *args: Extra arguments passed to fn
+            cleanup: Called instead of fn if the job is superseded or cancelled
+                before it starts
+            apps: Apps the job deploys, if not just app_name
+            kind: Job kind; only a queued job of the same kind is superseded
+
+        Returns:
+            The queued Job
+        """
+        job = Job(app_name, apps=apps, kind=kind)
+        superseded = []
+
+        with self._cond:
+            for entry in [e for e in self.pending if e.job.app == app_name and e.job.kind == kind]:
+                self.pending.remove(entry)
+                superseded.append(entry)
+
+            self.pending.append(_QueueEntry(job, fn, args, cleanup))
+            self.jobs[job.id] = job
+            self._trim_history()
+            self._cond.notify()
+
+        for entry in superseded:
+            logger.info(f"Job {entry.job.id} for {app_name} superseded by {job.id}")
+            entry.job.log(f"==> superseded by job {job.id}")
+            entry.job.finish("superseded", error=f"Superseded by newer {kind} job {job.id}")
+            entry.discard()
+
+        logger.info(f"Queued job {job.id} for {app_name}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID"""
+        with self._cond:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job: Job):
+        """Cancel a job: drop it from the queue, or signal it if it's running"""
+        with self._cond:
+            entry = next((e for e in self.pending if e.job is job), None)
+            if entry:
+                self.pending.remove(entry)
+
+        if entry:
+            job.log("==> cancelled while queued")
+            job.finish("cancelled", error="Job cancelled")
+            entry.discard()
+        else:
+            job.cancel()
+
+    def position(self, job: Job) -> Optional[int]:
+        """1-based position of a queued job, or None if it isn't queued"""
+        with self._cond:
+            for index, entry in enumerate(self.pending):
+                if entry.job is job:
+                    return index + 1
+        return None
+
+    def is_active(self, app_name: str) -> bool:
+        """Check whether an app has a job queued or running"""
+        with self._cond:
+            return app_name in self.running or any(app_name in e.job.apps for e in self.pending)
+
+    def stats(self) -> dict:
+        """Current queue depth, running jobs and wait times"""
+        with self._cond:
+            queued = [e.job for e in self.pending]
+            running = list({job.id: job for job in self.running.values()}.values())
+
+        return {
+            "max_concurrent_builds": self.max_concurrent_builds,
+            "depth": len(queued),
+            "in_flight": len(running),
+            "oldest_wait": round(max((job.wait_time for job in queued), default=0), 2),
+            "running": [{"id": job.id, "app": job.app, "phase": job.phase} for job in running],
+            "queued": [{"id": job.id, "app": job.app, "wait_time": round(job.wait_time, 2)}
+                       for job in queued],
+        }
+
+    def _next_entry(self) -> Optional[_QueueEntry]:
+        """Pop the oldest queued job whose apps have nothing running or queued before it"""
+        blocked = set(self.running)
+        for entry in self.pending:
+            if blocked.isdisjoint(entry.job.apps):
+                self.pending.remove(entry)
+                return entry
+            blocked.update(entry.job.apps)
+        return None
+
+    def _worker(self):
+        """Worker thread: run runnable jobs one at a time"""
+        while True:
+            with self._cond:
+                entry = self._next_entry()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self._next_entry()
+                for app_name in entry.job.apps:
+                    self.running[app_name] = entry.job
+
+            try:
+                if entry.job.cancelled.is_set():
+                    entry.job.finish("cancelled", error="Job cancelled")
+                    entry.discard()
+                else:
+                    self._run(entry.job, entry.fn, *entry.args)
+            finally:
+                with self._cond:
+                    for app_name in entry.job.apps:
+                        del self.running[app_name]
+                    self._cond.notify_all()
+
+    def _run(self, job: Job, fn: Callable, *args):
+        """Run the job and record its outcome"""
+        with job._lock:
+            job.status = "running"
+            job.started_at = time.time()
+
+        try:
+            result = fn(job, *args)
+            job.finish("success", result=result)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.app}) failed: {e}")
+            status = "cancelled" if isinstance(e, JobCancelled) else "error"
+            job.log(f"==> {status}: {e}")
+            job.finish(status, error=str(e))
+
+    def _trim_history(self):
+        """Forget the oldest finished jobs once history is full"""
+        excess = len(self.jobs) - self.max_history
+        if excess <= 0:
+            return
+
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:excess]:
+            del self.jobs[job_id]
@@ -0,0 +1,669 @@
+"""
+Log Archive for Vesla
+Collects the output of every Vesla-managed container into compressed, indexed segments on disk
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import docker
+from docker.errors import DockerException
+
+from deployer import log_lines
+
+logger = logging.getLogger(__name__)
+
+# Words that are indexed and searched for: runs of letters, digits and
+# underscores, lowercased
+TOKEN = re.compile(r"[a-z0-9_]{2,64}")
+
+# A block is compressed and written once it holds this many lines or characters
+BLOCK_LINES = 2000
+BLOCK_BYTES = 128 * 1024
+
+# Sealed segment indexes kept in memory for searches
+INDEX_CACHE_SIZE = 256
+
+# Seconds between retention runs
+RETENTION_INTERVAL = 300
+
+# Seconds to wait before reconnecting to a dropped event stream
+RECONNECT_DELAY = 5
+
+# Most matches a search returns
+MAX_SEARCH_LIMIT = 1000
+
+
+class _Segment:
+    """
+    One hour of an app's logs
+
+    <hour>.log.gz holds blocks of lines, each a separate gzip member so it
+    can be read on its own. <hour>.blocks lists each block's offset, length,
+    line count and time range. <hour>.idx.gz maps every token to the blocks
+    containing it; it is written when the segment is sealed, until then the
+    postings are kept in memory.
+    """
+
+    def __init__(self, app_name: str, hour: str, base: Path):
+        self.app = app_name
+        self.hour = hour  # UTC, YYYYMMDDHH
+        self.base = base
+        self.blocks = []
+        self.postings = {}  # Token -> block numbers, while the segment is open
+
+    @property
+    def data_path(self) -> Path:
+        return self.base.with_name(f"{self.hour}.log.gz")
+
+    @property
+    def blocks_path(self) -> Path:
+        return self.base.with_name(f"{self.hour}.blocks")
+
+    @property
+    def index_path(self) -> Path:
+        return self.base.with_name(f"{self.hour}.idx.gz")
+
+    def paths(self) -> List[Path]:
+        return [self.data_path, self.blocks_path, self.index_path]
+
+    def read_block(self, block: dict) -> str:
+        """Decompress one block"""
+        with open(self.data_path, "rb") as f:
+            f.seek(block["offset"])
+            return gzip.decompress(f.read(block["length"])).decode("utf-8", errors="replace")
+
+
+class _AppLog:
+    """An app's open segment and the block being filled"""
+
+    def __init__(self, app_name: str):
+        self.app = app_name
+        self.lock = threading.Lock()
+        self.segment = None
+        self.lines = []  # (time, line, container ID)
+        self.size = 0
+        self.started = None  # When the first buffered line arrived
+
+
+class LogArchive:
+    """
+    Persistent, searchable archive of container logs
+
+    A follower thread per running Vesla-managed container streams its
+    output as it is written, so logs survive the container being removed on
+    redeploy. Lines of all of an app's replicas are buffered into blocks and
+    written to hourly segments under directory/<app>/. Blocks are flushed
+    when they fill up or flush_interval seconds after their first line.
+
+    Searches look up their words in each segment's token index and only
+    decompress the blocks containing all of them, newest first. Segments
+    are removed once they are older than max_age or the archive outgrows
+    max_size, oldest first.
+
+    Each container's position (the time of its last written line) is saved
+    with every flush, so after a restart collection resumes where it left
+    off, including for containers that stopped in the meantime.
+    """
+
+    def __init__(self, docker_client: docker.DockerClient, directory: Path,
+                 max_size: int = 2 * 1024 ** 3, max_age: int = 14 * 86400,
+                 flush_interval: int = 10):
+        """
+        Args:
+            docker_client: Docker client
+            directory: Directory for segments
+            max_size: Bytes the archive may use on disk
+            max_age: Seconds segments are kept
+            flush_interval: Seconds lines may wait in memory before being written
+        """
+        self.docker = docker_client
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+
+        self.bytes = 0
+        self.lines_written = 0
+        self.segments_removed = 0
+        self.last_error = None
+        self._apps = {}  # App name -> _AppLog
+        self._catalog = {}  # App name -> hours with a segment
+        self._cursors = {}  # Container ID -> time of the last line read
+        self._saved_cursors = {}  # Container ID -> time of the last line written
+        self._cursors_saved_at = None
+        self._followers = {}  # Container ID -> log stream
+        self._events = None
+        self._index_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Load the archive, then collect logs from background threads"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load_cursors()
+        self._load_catalog()
+        threading.Thread(target=self._watch, name="vesla-log-events", daemon=True).start()
+        threading.Thread(target=self._loop, name="vesla-log-flush", daemon=True).start()
+
+    def stop(self):
+        """Stop collecting and write out buffered lines"""
+        self._stop.set()
+        with self._lock:
+            streams = [self._events] + list(self._followers.values())
+        for stream in streams:
+            _close(stream)
+        self.flush(force=True)
+
+    def flush(self, force: bool = False):
+        """Write buffered blocks older than flush_interval (all if force) and save positions"""
+        now = time.time()
+        for app_log in list(self._apps.values()):
+            with app_log.lock:
+                if app_log.lines and (force or now - app_log.started >= self.flush_interval):
+                    self._write_block(app_log)
+        self._save_cursors()
+
+    def search(self, query: str, apps: Optional[List[str]] = None, start: Optional[float] = None,
+               end: Optional[float] = None, limit: int = 100) -> dict:
+        """
+        Find log lines containing every word of a query
+
+        Args:
+            query: Words to look for, case-insensitive
+            apps: Apps to search, all if None
+            start: Only lines at or after this Unix time
+            end: Only lines at or before this Unix time
+            limit: Most matches to return
+
+        Returns:
+            Matches newest first, with whether more were found and how many
+            blocks had to be read
+
+        Raises:
+            ValueError: If the query has no searchable words
+        """
+        tokens = set(TOKEN.findall(query.lower()))
+        if not tokens:
+            raise ValueError("Query has no words to search for (letters, digits or _, 2+ characters)")
+
+        started = time.perf_counter()
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+        selected = sorted(self._catalog_apps() if apps is None else set(apps))
+        matches, scanned = [], 0
+
+        # Lines not yet written are the newest
+        for app_name in selected:
+            app_log = self._apps.get(app_name)
+            if app_log is not None:
+                with app_log.lock:
+                    buffered = [line for _, line, _ in app_log.lines]
+                matches.extend(_matches(app_name, buffered, tokens, start, end))
+
+        # A segment only holds lines from before the end of its hour
+        start_hour = _hour(start - 3600) if start is not None else ""
+        stopped = False
+        for hour in self._hours(selected, start_hour):
+            matches.sort(key=lambda match: match["time"], reverse=True)
+            if len(matches) >= limit and matches[limit - 1]["time"] >= _hour_end(hour):
+                stopped = True
+                break
+            for app_name in selected:
+                segment, postings = self._load_segment(app_name, hour)
+                if segment is None:
+                    continue
+                app_times = []
+                blocks = [segment.blocks[number] for number in _candidates(postings, tokens)]
+                for block in sorted(blocks, key=lambda block: block["last"], reverse=True):
+                    if len(app_times) >= limit and app_times[limit - 1] >= block["last"]:
+                        stopped = True
+                        break  # The remaining blocks only hold older lines
+                    if (start is not None and block["last"] < start) or (end is not None and block["first"] > end):
+                        continue
+                    try:
+                        text = segment.read_block(block)
+                    except OSError:
+                        break  # Removed by retention since the index was loaded
+                    scanned += 1
+                    block_matches = list(_matches(app_name, text.splitlines(), tokens, start, end))
+                    app_times = sorted(app_times + [match["time"] for match in block_matches], reverse=True)
+                    matches.extend(block_matches)
+
+        matches.sort(key=lambda match: match["time"], reverse=True)
+
+        return {
+            "matches": matches[:limit],
+            "truncated": stopped or len(matches) > limit,
+            "scanned_blocks": scanned,
+            "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def stats(self) -> dict:
+        """Archive size, collection state and settings for the API"""
+        with self._lock:
+            return {
+                "directory": str(self.directory),
+                "bytes": self.bytes,
+                "max_size": self.max_size,
+                "max_age": self.max_age,
+                "apps": len(self._catalog),
+                "segments": sum(len(hours) for hours in self._catalog.values()),
+                "following": len(self._followers),
+                "lines_written": self.lines_written,
+                "segments_removed": self.segments_removed,
+                "last_error": self.last_error,
+            }
+
+    # Collection
+
+    def _watch(self):
+        """Background thread: follow containers as they start, resubscribing when events drop"""
+        while not self._stop.is_set():
+            try:
+                # Subscribe first, so containers started while attaching aren't missed
+                self._events = self.docker.events(decode=True, filters={
+                    "type": "container", "event": "start", "label": "vesla.managed=true"
+                })
+                self._attach_all()
+                for event in self._events:
+                    if self._stop.is_set():
+                        return
+                    attributes = (event.get("Actor") or {}).get("Attributes") or {}
+                    container_id = (event.get("Actor") or {}).get("ID") or event.get("id")
+                    self._attach(container_id, attributes.get("vesla.app") or attributes.get("name"),
+                                 attributes.get("name", container_id[:12]), follow=True)
+                error = "event stream closed"
+            except (DockerException, OSError) as e:
+                error = str(e)
+
+            if self._stop.is_set():
+                return
+            with self._lock:
+                self.last_error = error
+            logger.warning(f"Log archive lost Docker events: {error}; reconnecting in {RECONNECT_DELAY}s")
+            self._stop.wait(RECONNECT_DELAY)
+
+    def _attach_all(self):
+        """Follow every running container and catch up on those that stopped unread"""
+        containers = self.docker.api.containers(all=True, filters={"label": "vesla.managed=true"})
+        with self._lock:
+            existing = {container["Id"] for container in containers}
+            for container_id in set(self._cursors) - existing:
+                del self._cursors[container_id]
+                self._saved_cursors.pop(container_id, None)
+
+        for container in containers:
+            container_id = container["Id"]
+            labels = container.get("Labels") or {}
+            name = (container.get("Names") or ["/" + container_id[:12]])[0].lstrip("/")
+            running = container.get("State") == "running"
+            # Stopped containers are read up to their end if they were read
+            # before, or were created after the archive last saved its state
+            unread = (container_id in self._cursors or
+                      (self._cursors_saved_at is not None and container.get("Created", 0) >= self._cursors_saved_at))
+            if running or unread:
+                self._attach(container_id, labels.get("vesla.app") or name, name, follow=running)
+
+    def _attach(self, container_id: str, app_name: str, name: str, follow: bool):
+        with self._lock:
+            if container_id in self._followers:
+                return
+            self._followers[container_id] = None
+        threading.Thread(target=self._collect, args=(container_id, app_name, name, follow),
+                         name=f"vesla-log-{name}", daemon=True).start()
+
+    def _collect(self, container_id: str, app_name: str, name: str, follow: bool):
+        """Follower thread: append a container's lines until its output ends"""
+        resume = self._cursors.get(container_id)
+        try:
+            stream = self.docker.api.logs(container_id, stream=True, follow=follow,
+                                          timestamps=True, since=resume)
+            with self._lock:
+                self._followers[container_id] = stream
+            for line in log_lines(stream):
+                stamp, _, message = line.rstrip("\n").partition(" ")
+                line_time = _parse_time(stamp)
+                if line_time is None or (resume is not None and line_time <= resume):
+                    continue  # since= includes the line the last run ended on
+                self._append(app_name, line_time, f"{stamp} [{name}] {message}", container_id)
+        except (DockerException, OSError) as e:
+            logger.warning(f"Could not collect logs of {name}: {e}")
+        finally:
+            with self._lock:
+                self._followers.pop(container_id, None)
+
+    def _append(self, app_name: str, line_time: float, line: str, container_id: str):
+        with self._lock:
+            app_log = self._apps.get(app_name)
+            if app_log is None:
+                app_log = self._apps[app_name] = _AppLog(app_name)
+            self._cursors[container_id] = line_time
+        with app_log.lock:
+            app_log.lines.append((line_time, line, container_id))
+            app_log.size += len(line)
+            if app_log.started is None:
+                app_log.started = time.time()
+            if len(app_log.lines) >= BLOCK_LINES or app_log.size >= BLOCK_BYTES:
+                self._write_block(app_log)
+
+    # Storage
+
+    def _write_block(self, app_log: _AppLog):
+        """Compress and append the buffered lines as one block; call with app_log.lock held"""
+        app_name = app_log.app
+        hour = _hour(time.time())
+        segment = app_log.segment
+        if segment is None or segment.hour != hour:
+            if segment is not None:
+                self._seal(segment)
+            segment = app_log.segment = self._open_segment(app_name, hour)
+
+        lines = [line for _, line, _ in app_log.lines]
+        data = gzip.compress("".join(f"{line}\n" for line in lines).encode("utf-8"), compresslevel=6)
+        times = [line_time for line_time, _, _ in app_log.lines]
+
+        try:
+            with open(segment.data_path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            block = {"offset": offset, "length": len(data), "lines": len(lines),
+                     "first": min(times), "last": max(times)}
+            with open(segment.blocks_path, "a") as f:
+                f.write(json.dumps(block) + "\n")
+        except OSError as e:
+            # Keep the lines buffered and try again at the next flush
+            logger.error(f"Could not write logs of {app_name}: {e}")
+            with self._lock:
+                self.last_error = str(e)
+            return
+
+        number = len(segment.blocks)
+        segment.blocks.append(block)
+        for token in _line_tokens(lines):
+            segment.postings.setdefault(token, []).append(number)
+
+        with self._lock:
+            for line_time, _, container_id in app_log.lines:
+                self._saved_cursors[container_id] = line_time
+            self.bytes += len(data) + len(json.dumps(block)) + 1
+            self.lines_written += len(lines)
+
+        app_log.lines, app_log.size, app_log.started = [], 0, None
+
+    def _open_segment(self, app_name: str, hour: str) -> _Segment:
+        """Open an app's segment for an hour, picking up where an earlier run left it"""
+        (self.directory / app_name).mkdir(parents=True, exist_ok=True)
+        segment = _Segment(app_name, hour, self.directory / app_name / hour)
+        with self._lock:
+            self._catalog.setdefault(app_name, set()).add(hour)
+            self._index_cache.pop(str(segment.base), None)
+        if segment.blocks_path.exists():
+            segment.blocks = _read_blocks(segment)
+            segment.postings = _build_postings(segment)
+        return segment
+
+    def _seal(self, segment: _Segment):
+        """Write an open segment's token index to disk"""
+        try:
+            _write_index(segment, segment.postings)
+        except OSError as e:
+            logger.error(f"Could not write log index {segment.index_path}: {e}")
+        segment.postings = {}
+
+    def _load_segment(self, app_name: str, hour: str) -> Tuple[Optional[_Segment], Dict[str, List[int]]]:
+        """A segment and its postings: from memory if it's open, else from its index file"""
+        app_log = self._apps.get(app_name)
+        if app_log is not None:
+            with app_log.lock:
+                segment = app_log.segment
+                if segment is not None and segment.hour == hour:
+                    return segment, {token: list(blocks) for token, blocks in segment.postings.items()}
+
+        base = self.directory / app_name / hour
+        key = str(base)
+        with self._lock:
+            if hour not in self._catalog.get(app_name, ()):
+                return None, {}
+            cached = self._index_cache.get(key)
+            if cached is not None:
+                self._index_cache.move_to_end(key)
+                return cached
+
+        segment = _Segment(app_name, hour, base)
+        try:
+            segment.blocks = _read_blocks(segment)
+            if segment.index_path.exists():
+                with gzip.open(segment.index_path, "rt") as f:
+                    postings = json.load(f)
+            else:
+                postings = _build_postings(segment)
+                _write_index(segment, postings)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read log segment {base}: {e}")
+            return None, {}
+
+        with self._lock:
+            self._index_cache[key] = (segment, postings)
+            while len(self._index_cache) > INDEX_CACHE_SIZE:
+                self._index_cache.popitem(last=False)
+        return segment, postings
+
+    def _catalog_apps(self) -> Set[str]:
+        with self._lock:
+            return set(self._catalog) | set(self._apps)
+
+    def _hours(self, apps: List[str], start_hour: str) -> List[str]:
+        """Hours with a segment of any of the apps, newest first"""
+        with self._lock:
+            hours = {hour for app_name in apps for hour in self._catalog.get(app_name, ())}
+        return sorted((hour for hour in hours if hour >= start_hour), reverse=True)
+
+    def _load_catalog(self):
+        """Find the segments on disk and their total size"""
+        total = 0
+        for app_dir in self.directory.iterdir():
+            if not app_dir.is_dir():
+                continue
+            for path in app_dir.glob("*.blocks"):
+                self._catalog.setdefault(app_dir.name, set()).add(path.name.split(".")[0])
+            total += sum(path.stat().st_size for path in app_dir.iterdir() if path.is_file())
+        self.bytes = total
+
+    # Background work
+
+    def _loop(self):
+        """Background thread: flush buffered lines, seal past hours and enforce retention"""
+        next_retention = time.time()
+        while not self._stop.wait(min(self.flush_interval, RETENTION_INTERVAL)):
+            try:
+                self.flush()
+                self._seal_idle()
+                if time.time() >= next_retention:
+                    self._enforce_retention()
+                    next_retention = time.time() + RETENTION_INTERVAL
+            except Exception as e:
+                logger.error(f"Log archive maintenance failed: {e}")
+
+    def _seal_idle(self):
+        """Seal open segments of past hours whose app has nothing buffered"""
+        hour = _hour(time.time())
+        for app_log in list(self._apps.values()):
+            with app_log.lock:
+                if app_log.segment is not None and app_log.segment.hour != hour and not app_log.lines:
+                    self._seal(app_log.segment)
+                    app_log.segment = None
+
+    def _enforce_retention(self):
+        """Remove segments past max_age, then the oldest until the archive fits max_size"""
+        cutoff = _hour(time.time() - self.max_age)
+        with self._lock:
+            segments = sorted((hour, app_name) for app_name, hours in self._catalog.items() for hour in hours)
+        open_segments = {(app_log.segment.hour, app_name) for app_name, app_log in list(self._apps.items())
+                         if app_log.segment is not None}
+
+        sizes = {}
+        for hour, app_name in segments:
+            base = self.directory / app_name / hour
+            sizes[(hour, app_name)] = sum(path.stat().st_size for path in _Segment(app_name, hour, base).paths()
+                                          if path.exists())
+        total = sum(sizes.values())
+
+        for hour, app_name in segments:
+            if hour >= cutoff and total <= self.max_size:
+                break
+            if (hour, app_name) in open_segments:
+                continue
+            segment = _Segment(app_name, hour, self.directory / app_name / hour)
+            for path in segment.paths():
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= sizes[(hour, app_name)]
+            with self._lock:
+                self._catalog[app_name].discard(hour)
+                if not self._catalog[app_name]:
+                    del self._catalog[app_name]
+                self._index_cache.pop(str(segment.base), None)
+                self.segments_removed += 1
+            logger.info(f"Removed log segment {app_name}/{hour}")
+
+        with self._lock:
+            self.bytes = total
+
+    def _load_cursors(self):
+        path = self.directory / "cursors.json"
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read {path}: {e}")
+            return
+        self._cursors = dict(state.get("cursors", {}))
+        self._saved_cursors = dict(self._cursors)
+        self._cursors_saved_at = state.get("saved_at")
+
+    def _save_cursors(self):
+        """Save the position of every container's last written line"""
+        path = self.directory / "cursors.json"
+        with self._lock:
+            state = {"saved_at": time.time(), "cursors": dict(self._saved_cursors)}
+        try:
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not save log positions: {e}")
+
+
+def _read_blocks(segment: _Segment) -> List[dict]:
+    """Block list of a segment; a torn last entry from a crash is skipped"""
+    blocks = []
+    with open(segment.blocks_path) as f:
+        for entry in f:
+            try:
+                blocks.append(json.loads(entry))
+            except ValueError:
+                continue
+    return blocks
+
+
+def _build_postings(segment: _Segment) -> Dict[str, List[int]]:
+    """Token index of a segment, from reading all its blocks"""
+    postings = {}
+    for number, block in enumerate(segment.blocks):
+        for token in _line_tokens(segment.read_block(block).splitlines()):
+            postings.setdefault(token, []).append(number)
+    return postings
+
+
+def _write_index(segment: _Segment, postings: Dict[str, List[int]]):
+    tmp = segment.index_path.with_name(segment.index_path.name + ".tmp")
+    with gzip.open(tmp, "wt") as f:
+        json.dump(postings, f, separators=(",", ":"))
+    os.replace(tmp, segment.index_path)
+
+
+def _line_tokens(lines: List[str]) -> Set[str]:
+    """Tokens of the lines' messages; timestamps aren't indexed"""
+    tokens = set()
+    for line in lines:
+        tokens.update(TOKEN.findall(line.partition(" ")[2].lower()))
+    return tokens
+
+
+def _candidates(postings: Dict[str, List[int]], tokens: Set[str]) -> List[int]:
+    """Numbers of the blocks containing every token"""
+    blocks = None
+    for token in sorted(tokens, key=lambda token: len(postings.get(token, ()))):
+        found = set(postings.get(token, ()))
+        blocks = found if blocks is None else blocks & found
+        if not blocks:
+            return []
+    return sorted(blocks)
+
+
+def _matches(app_name: str, lines: List[str], tokens: Set[str], start: Optional[float],
+             end: Optional[float]) -> Iterator[dict]:
+    """Lines containing every token within the time range, newest first"""
+    for line in reversed(lines):
+        stamp, _, rest = line.partition(" ")
+        if not tokens <= set(TOKEN.findall(rest.lower())):
+            continue
+        line_time = _parse_time(stamp)
+        if line_time is None or (start is not None and line_time < start) or (end is not None and line_time > end):
+            continue
+        container, _, message = rest.partition("] ")
+        yield {
+            "app": app_name,
+            "time": line_time,
+            "timestamp": stamp,
+            "container": container.lstrip("["),
+            "message": message,
+        }
+
+
+def _parse_time(stamp: str) -> Optional[float]:
+    """Unix time of an RFC 3339 timestamp as Docker writes it (UTC, nanoseconds)"""
+    try:
+        seconds = datetime.strptime(stamp[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+    fraction = stamp[19:].rstrip("Z")
+    if fraction.startswith("."):
+        try:
+            seconds += float(fraction)
+        except ValueError:
+            pass
+    return seconds
+
+
+def _hour(timestamp: float) -> str:
+    """Segment name of the UTC hour a Unix time falls in"""
+    return datetime.fromtimestamp(max(timestamp, 0), timezone.utc).strftime("%Y%m%d%H")
+
+
+def _hour_end(hour: str) -> float:
+    """Unix time at the end of a segment's hour"""
+    return datetime.strptime(hour, "%Y%m%d%H").replace(tzinfo=timezone.utc).timestamp() + 3600
+
+
+def _close(stream):
+    if stream is None:
+        return
+    try:
+        stream.close()
+    except (OSError, DockerException):
+        pass
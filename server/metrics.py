@@ -0,0 +1,154 @@
+"""
+Prometheus Metrics for Vesla
+Deploy phase timings, cache and error counters, and queue gauges for /metrics
+"""
+
+import logging
+import time
+from functools import wraps
+from typing import Callable
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import CONTENT_TYPE_LATEST, ProcessCollector
+from prometheus_client.core import GaugeMetricFamily
+
+from jobs import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+# Everything Vesla exports, served by GET /metrics
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Seconds; phases range from milliseconds (detection) to minutes (builds)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+DEPLOY_PHASE_SECONDS = Histogram(
+    "vesla_deploy_phase_seconds", "Time spent in each phase of a deploy",
+    ["phase"], buckets=PHASE_BUCKETS, registry=REGISTRY
+)
+JOB_SECONDS = Histogram(
+    "vesla_job_duration_seconds", "Time from a job starting to it finishing",
+    ["kind", "result"], buckets=PHASE_BUCKETS, registry=REGISTRY
+)
+JOBS = Counter(
+    "vesla_jobs", "Finished jobs by kind and result",
+    ["kind", "result"], registry=REGISTRY
+)
+JOB_ERRORS = Counter(
+    "vesla_job_errors", "Failed jobs by kind and error type",
+    ["kind", "type"], registry=REGISTRY
+)
+BUILD_CACHE = Counter(
+    "vesla_build_cache", "Build cache lookups: unchanged source (source), "
+    "dependency images (deps) and Docker layers (layer)",
+    ["cache", "result"], registry=REGISTRY
+)
+GC_RUN_SECONDS = Histogram(
+    "vesla_gc_run_seconds", "Duration of image collection runs",
+    ["reason"], buckets=PHASE_BUCKETS, registry=REGISTRY
+)
+GC_RECLAIMED_BYTES = Counter(
+    "vesla_gc_reclaimed_bytes", "Disk space reclaimed by image collection",
+    registry=REGISTRY
+)
+GC_IMAGES_REMOVED = Counter(
+    "vesla_gc_images_removed", "Images removed by image collection",
+    registry=REGISTRY
+)
+AUTOSCALER_DECISIONS = Counter(
+    "vesla_autoscaler_decisions", "Autoscaler decisions by action (scale_up, scale_down, hold, error)",
+    ["action"], registry=REGISTRY
+)
+
+
+def phase(name: str):
+    """Context manager timing a deploy phase into vesla_deploy_phase_seconds"""
+    return DEPLOY_PHASE_SECONDS.labels(phase=name).time()
+
+
+def track_job(kind: str) -> Callable:
+    """
+    Decorate a job function to record its duration, result and error type
+
+    Also records how long the job waited in the queue as the 'queued' phase.
+
+    Args:
+        kind: Job kind label, e.g. 'deploy' or 'rollback'
+    """
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(job, *args, **kwargs):
+            DEPLOY_PHASE_SECONDS.labels(phase="queued").observe(job.wait_time)
+            start_time = time.time()
+            result = "error"
+            try:
+                value = fn(job, *args, **kwargs)
+                result = "success"
+                return value
+            except JobCancelled:
+                result = "cancelled"
+                raise
+            except Exception as e:
+                JOB_ERRORS.labels(kind=kind, type=type(e).__name__).inc()
+                raise
+            finally:
+                JOB_SECONDS.labels(kind=kind, result=result).observe(time.time() - start_time)
+                JOBS.labels(kind=kind, result=result).inc()
+        return wrapper
+    return decorator
+
+
+class StateCollector:
+    """
+    Gauges read from live server state at scrape time
+
+    Queue depth and cache sizes are owned by other components, so they are
+    sampled when Prometheus scrapes rather than tracked here.
+    """
+
+    def __init__(self, job_queue, deps_cache=None, image_gc=None, state_cache=None, log_archive=None):
+        self.job_queue = job_queue
+        self.deps_cache = deps_cache
+        self.image_gc = image_gc
+        self.state_cache = state_cache
+        self.log_archive = log_archive
+
+    def collect(self):
+        queue = self.job_queue.stats()
+        yield GaugeMetricFamily("vesla_deploys_queued", "Jobs waiting in the build queue", value=queue["depth"])
+        yield GaugeMetricFamily("vesla_deploys_in_flight", "Jobs currently running", value=queue["in_flight"])
+        yield GaugeMetricFamily("vesla_deploy_oldest_wait_seconds", "Wait time of the oldest queued job",
+                                value=queue["oldest_wait"])
+
+        if self.deps_cache is not None:
+            cache = self.deps_cache.stats()
+            yield GaugeMetricFamily("vesla_deps_cache_bytes", "Size of cached dependency images",
+                                    value=cache["size"])
+            yield GaugeMetricFamily("vesla_deps_cache_images", "Number of cached dependency images",
+                                    value=cache["images"])
+
+        if self.image_gc is not None:
+            free = self.image_gc.free_percent()
+            if free is not None:
+                yield GaugeMetricFamily("vesla_docker_free_percent", "Free space on the Docker data root",
+                                        value=free)
+
+        if self.state_cache is not None:
+            as_of = self.state_cache.as_of()
+            if as_of is not None:
+                yield GaugeMetricFamily("vesla_state_cache_age_seconds",
+                                        "Seconds since the container state cache was known current",
+                                        value=max(time.time() - as_of, 0))
+
+        if self.log_archive is not None:
+            archive = self.log_archive.stats()
+            yield GaugeMetricFamily("vesla_log_archive_bytes", "Size of the log archive on disk",
+                                    value=archive["bytes"])
+
+
+def render() -> bytes:
+    """All metrics in the Prometheus text format"""
+    return generate_latest(REGISTRY)
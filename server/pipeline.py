@@ -0,0 +1,123 @@
+"""
+Deploy Pipeline for Vesla
+Runs deployment steps as a small dependency graph, in parallel where possible
+"""
+
+import logging
+import time
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineError(Exception):
+    """Raised when a pipeline is defined incorrectly"""
+    pass
+
+
+class _Step:
+    """A named pipeline step and the steps it waits for"""
+
+    def __init__(self, name: str, fn: Callable, depends_on: Iterable[str]):
+        self.name = name
+        self.fn = fn
+        self.depends_on = set(depends_on)
+
+
+class DeployPipeline:
+    """
+    Dependency graph of deployment steps
+
+    Each step runs as soon as every step it depends on has finished, so
+    independent steps (e.g. DNS and the image build) overlap. A step's
+    callable receives the results of its dependencies as keyword arguments.
+    """
+
+    def __init__(self, executor: Executor, on_event: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            executor: Executor the steps run on
+            on_event: Called with a message whenever a step starts or finishes
+        """
+        self.executor = executor
+        self.on_event = on_event
+        self.steps = {}
+        self.results = {}
+        self.timings = {}
+
+    def add(self, name: str, fn: Callable, depends_on: Iterable[str] = ()) -> "DeployPipeline":
+        """
+        Add a step
+
+        Args:
+            name: Step name, also the key of its result and timing
+            fn: Callable run as fn(**{dependency: result})
+            depends_on: Names of steps that must finish first
+        """
+        if name in self.steps:
+            raise PipelineError(f"Duplicate pipeline step: {name}")
+        self.steps[name] = _Step(name, fn, depends_on)
+        return self
+
+    def run(self) -> Dict[str, object]:
+        """
+        Run all steps
+
+        Returns:
+            Mapping of step name to its result. Per-step durations in
+            seconds are left in self.timings.
+
+        Raises:
+            The first exception raised by a step, once steps already
+            running have finished. Steps that depend on it never start.
+        """
+        for step in self.steps.values():
+            unknown = step.depends_on - self.steps.keys()
+            if unknown:
+                raise PipelineError(f"Step {step.name} depends on unknown steps: {', '.join(sorted(unknown))}")
+
+        pending = dict(self.steps)
+        running = {}
+        error = None
+
+        while pending or running:
+            if error is None:
+                for step in [s for s in pending.values() if s.depends_on <= self.results.keys()]:
+                    del pending[step.name]
+                    running[self.executor.submit(self._run_step, step)] = step
+
+            if not running:
+                if error is None:
+                    raise PipelineError(f"Pipeline has a dependency cycle: {', '.join(sorted(pending))}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    self.results[step.name] = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+
+        if error is not None:
+            raise error
+
+        return self.results
+
+    def _run_step(self, step: _Step):
+        """Run one step with its dependencies' results and time it"""
+        self._emit(f"{step.name} started")
+        start = time.time()
+
+        try:
+            return step.fn(**{name: self.results[name] for name in step.depends_on})
+        finally:
+            self.timings[step.name] = round(time.time() - start, 2)
+            self._emit(f"{step.name} finished in {self.timings[step.name]}s")
+
+    def _emit(self, message: str):
+        logger.debug(message)
+        if self.on_event:
+            self.on_event(message)
@@ -0,0 +1,195 @@
+"""
+Release History for Vesla
+Records the image and configuration of each deploy so earlier releases can be redeployed
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReleaseError(Exception):
+    """Raised when a release doesn't exist or the history can't be read"""
+    pass
+
+
+class ReleaseStore:
+    """
+    Per-app release history, one JSON file per app
+
+    Release numbers increase monotonically per app and are never reused,
+    even after old releases are trimmed. Each release records the image it
+    deployed and the vesla.yaml it was deployed with.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def apps(self) -> List[str]:
+        """Names of apps with a release history"""
+        return sorted(path.stem for path in self.root.glob("*.json"))
+
+    def next_number(self, app_name: str) -> int:
+        """Number the next release of an app will get"""
+        with self._lock:
+            return self._read(app_name)["next"]
+
+    def add(self, app_name: str, number: int, image_id: str, tags: List[str], vesla_config: dict,
+            build_time: Optional[float] = None, source_hash: Optional[str] = None) -> dict:
+        """
+        Record a new release and make it current
+
+        Args:
+            app_name: Application name
+            number: Release number, from next_number()
+            image_id: ID of the deployed image
+            tags: Image tags pointing at this release
+            vesla_config: vesla.yaml the release was deployed with
+            build_time: Seconds spent building the image, if it was built
+            source_hash: Hash of the build inputs, for skipping identical builds
+
+        Returns:
+            The release record
+        """
+        with self._lock:
+            history = self._read(app_name)
+            release = {
+                "release": number,
+                "image_id": image_id,
+                "tags": tags,
+                "config": vesla_config,
+                "build_time": round(build_time, 2) if build_time is not None else None,
+                "source_hash": source_hash,
+                "created_at": time.time(),
+            }
+            history["releases"].append(release)
+            history["next"] = max(history["next"], number + 1)
+            history["current"] = release["release"]
+            self._write(app_name, history)
+            return release
+
+    def list(self, app_name: str) -> List[dict]:
+        """Releases of an app, newest first"""
+        with self._lock:
+            return list(reversed(self._read(app_name)["releases"]))
+
+    def get(self, app_name: str, number: int) -> dict:
+        """
+        Look up a release
+
+        Raises:
+            ReleaseError: If the release doesn't exist (or was trimmed)
+        """
+        for release in self.list(app_name):
+            if release["release"] == number:
+                return release
+        raise ReleaseError(f"Release {number} of {app_name} not found")
+
+    def current(self, app_name: str) -> Optional[dict]:
+        """The release currently deployed, if any"""
+        with self._lock:
+            history = self._read(app_name)
+        for release in history["releases"]:
+            if release["release"] == history["current"]:
+                return release
+        return None
+
+    def previous(self, app_name: str) -> dict:
+        """
+        The newest release older than the current one
+
+        Raises:
+            ReleaseError: If there is no earlier release to roll back to
+        """
+        current = self.current(app_name)
+        for release in self.list(app_name):
+            if current is None or release["release"] < current["release"]:
+                return release
+        raise ReleaseError(f"No earlier release of {app_name} to roll back to")
+
+    def set_current(self, app_name: str, number: int):
+        """Mark an existing release as deployed (after a rollback)"""
+        with self._lock:
+            history = self._read(app_name)
+            if not any(release["release"] == number for release in history["releases"]):
+                raise ReleaseError(f"Release {number} of {app_name} not found")
+            history["current"] = number
+            self._write(app_name, history)
+
+    def replicas(self, app_name: str) -> Optional[int]:
+        """Number of containers the app was last deployed or scaled to, if recorded"""
+        with self._lock:
+            return self._read(app_name).get("replicas")
+
+    def set_replicas(self, app_name: str, replicas: int):
+        """Record the number of containers an app runs, so later deploys keep it"""
+        with self._lock:
+            history = self._read(app_name)
+            history["replicas"] = replicas
+            self._write(app_name, history)
+
+    def trim(self, app_name: str, keep: int) -> List[dict]:
+        """
+        Forget all but the newest releases; the current release is always kept
+
+        Args:
+            app_name: Application name
+            keep: Number of releases to keep
+
+        Returns:
+            The removed releases
+        """
+        with self._lock:
+            history = self._read(app_name)
+            newest = {release["release"] for release in history["releases"][-max(keep, 1):]}
+            newest.add(history["current"])
+
+            kept, removed = [], []
+            for release in history["releases"]:
+                (kept if release["release"] in newest else removed).append(release)
+
+            if removed:
+                history["releases"] = kept
+                self._write(app_name, history)
+            return removed
+
+    def delete(self, app_name: str):
+        """Drop an app's history entirely"""
+        with self._lock:
+            try:
+                self._path(app_name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _path(self, app_name: str) -> Path:
+        return self.root / f"{app_name}.json"
+
+    def _read(self, app_name: str) -> dict:
+        try:
+            with open(self._path(app_name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"next": 1, "current": None, "releases": []}
+        except (OSError, ValueError) as e:
+            raise ReleaseError(f"Could not read release history of {app_name}: {e}")
+
+    def _write(self, app_name: str, history: dict):
+        """Replace an app's history file atomically"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".releases-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(history, f, indent=2)
+            os.replace(tmp_path, self._path(app_name))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,174 @@
+"""
+Server IP Resolver for Vesla
+Resolves and caches the server's public IP address used for DNS records
+"""
+
+import ipaddress
+import logging
+import socket
+import threading
+import time
+import urllib.request
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ServerIPResolver:
+    """Resolves the server's public IP once and refreshes it in the background"""
+
+    def __init__(self, override: Optional[str] = None, ttl: int = 3600,
+                 lookup_url: str = "https://api.ipify.org", timeout: int = 5):
+        """
+        Args:
+            override: Public IP from config.yaml; skips all detection when set
+            ttl: Seconds before the cached IP is refreshed
+            lookup_url: External service returning the caller's IP as plain text
+            timeout: Timeout in seconds for the external lookup
+        """
+        self.override = override
+        self.ttl = ttl
+        self.lookup_url = lookup_url
+        self.timeout = timeout
+        self.ip = None
+        self.source = None
+        self.resolved_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._resolved = threading.Event()
+
+    def start(self):
+        """Resolve the IP and keep it fresh from a background thread"""
+        # The first refresh can fall through to the external lookup, so it
+        # runs on the thread too; get() falls back to local methods until then
+        thread = threading.Thread(target=self._refresh_loop, name="vesla-server-ip", daemon=True)
+        thread.start()
+
+    def stop(self):
+        """Stop background refreshes"""
+        self._stop.set()
+
+    def get(self) -> Optional[str]:
+        """
+        Get the cached public IP
+
+        Until the first refresh finishes, the config override or a public
+        address on a local interface is returned instead.
+
+        Returns:
+            Public IP address, or None if no public address could be found
+        """
+        with self._lock:
+            if self.ip or self._resolved.is_set():
+                return self.ip
+
+        if self.override and _is_public(self.override):
+            return self.override
+        return self._interface_ip()
+
+    def refresh(self) -> Optional[str]:
+        """
+        Resolve the public IP and update the cache
+
+        Order: config override, a public address on a local interface, then
+        the external lookup service. Private addresses are never returned.
+        The previous value is kept if every method fails.
+
+        Returns:
+            Public IP address, or None if none could be found
+        """
+        ip, source = self._resolve()
+
+        with self._lock:
+            if ip:
+                if ip != self.ip:
+                    logger.info(f"Server public IP: {ip} (from {source})")
+                self.ip, self.source = ip, source
+                self.resolved_at = time.time()
+            elif self.ip:
+                logger.warning(f"Could not refresh public IP, keeping {self.ip}")
+            else:
+                logger.error("Could not determine server public IP; DNS records will not be created")
+            self._resolved.set()
+            return self.ip
+
+    def to_dict(self) -> dict:
+        """Serialize resolver state for the API"""
+        with self._lock:
+            return {
+                "ip": self.ip,
+                "source": self.source,
+                "resolved_at": self.resolved_at or None,
+                "ttl": self.ttl,
+            }
+
+    def _refresh_loop(self):
+        """Background thread: resolve the IP now, then refresh it every ttl seconds"""
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Public IP refresh failed: {e}")
+                self._resolved.set()
+
+            if self.override and self.ip == self.override:
+                return  # A valid override never changes
+            self._stop.wait(self.ttl)
+
+    def _resolve(self) -> tuple:
+        """Return (ip, source) from the first method that yields a public IP"""
+        if self.override:
+            if _is_public(self.override):
+                return self.override, "config"
+            logger.error(f"Configured public IP {self.override} is not a public address, ignoring it")
+
+        ip = self._interface_ip()
+        if ip:
+            return ip, "interface"
+
+        ip = self._external_ip()
+        if ip:
+            return ip, "lookup"
+
+        return None, None
+
+    def _interface_ip(self) -> Optional[str]:
+        """Public IP of the interface that carries the default route, if it has one"""
+        try:
+            # UDP connect sends no packets; it only selects the outbound interface
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.connect(("1.1.1.1", 53))
+                ip = sock.getsockname()[0]
+        except OSError as e:
+            logger.debug(f"Could not determine outbound interface address: {e}")
+            return None
+
+        if _is_public(ip):
+            return ip
+
+        logger.debug(f"Outbound interface address {ip} is not public")
+        return None
+
+    def _external_ip(self) -> Optional[str]:
+        """Ask the external lookup service for our public IP"""
+        try:
+            with urllib.request.urlopen(self.lookup_url, timeout=self.timeout) as response:
+                ip = response.read().decode("utf-8").strip()
+        except Exception as e:
+            logger.warning(f"Public IP lookup via {self.lookup_url} failed: {e}")
+            return None
+
+        if _is_public(ip):
+            return ip
+
+        logger.warning(f"Public IP lookup returned unusable address: {ip!r}")
+        return None
+
+
+def _is_public(ip: str) -> bool:
+    """Check that ip is a valid, globally routable IPv4 address"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.version == 4 and address.is_global
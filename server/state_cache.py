@@ -0,0 +1,221 @@
+"""
+Container State Cache for Vesla
+Keeps an in-memory view of Vesla-managed containers and images, updated from Docker events
+"""
+
+import logging
+import threading
+import time
+from typing import List, Optional
+
+import docker
+from docker.errors import APIError, DockerException
+
+from deployer import image_names, summarize_app, summarize_apps
+
+logger = logging.getLogger(__name__)
+
+# Container event actions that change what the cache holds; exec_* events
+# from health checks and the like are ignored
+CONTAINER_ACTIONS = {
+    "create", "start", "restart", "stop", "die", "kill", "oom",
+    "pause", "unpause", "rename", "update", "destroy",
+}
+
+# Image event actions that change image tags
+IMAGE_ACTIONS = {"tag", "untag", "delete", "pull", "load", "import"}
+
+# Seconds to wait before reconnecting to a dropped event stream
+RECONNECT_DELAY = 5
+
+
+class StateCache:
+    """
+    Materialized view of Vesla-managed containers and image tags
+
+    The view holds the same container summaries Docker's list API returns
+    (only for containers labelled vesla.managed=true) and the name of every
+    image, so app listings and statuses are served from memory with the
+    same fields as ContainerDeployer.list_all_apps() and
+    get_container_status().
+
+    It is seeded once, then kept current from Docker's event stream: a
+    container event refreshes that container's summary with a filtered list
+    call, an image event refreshes the image names. A full resync every
+    resync_interval seconds catches anything the stream missed, and the
+    stream is resubscribed (followed by a resync) whenever it drops.
+
+    Readers should check as_of(): while the event stream is connected the
+    view is current, otherwise it is as old as the last event or resync.
+    """
+
+    def __init__(self, docker_client: docker.DockerClient, resync_interval: int = 300):
+        """
+        Args:
+            docker_client: Docker client
+            resync_interval: Seconds between full resyncs
+        """
+        self.docker = docker_client
+        self.resync_interval = resync_interval
+
+        self.containers = {}  # Container ID -> list API summary
+        self.images = {}  # Image ID -> name
+        self.seeded = False
+        self.synced_at = None
+        self.updated_at = None
+        self.events = 0
+        self.resyncs = 0
+        self.last_error = None
+        self._connected = False
+        self._stream = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Seed the view and keep it current from background threads"""
+        threading.Thread(target=self._watch, name="vesla-state-events", daemon=True).start()
+        threading.Thread(target=self._loop, name="vesla-state-resync", daemon=True).start()
+
+    def stop(self):
+        """Stop resyncing and close the event stream"""
+        self._stop.set()
+        stream = self._stream
+        if stream is not None:
+            stream.close()
+
+    def resync(self):
+        """
+        Replace the view with a fresh container and image listing
+
+        Raises:
+            DockerException: If the daemon can't be listed
+        """
+        containers = self.docker.api.containers(all=True, filters={"label": "vesla.managed=true"})
+        images = image_names(self.docker.api.images())
+        now = time.time()
+
+        with self._lock:
+            drift = {c["Id"] for c in containers} ^ set(self.containers)
+            self.containers = {c["Id"]: c for c in containers}
+            self.images = images
+            self.seeded = True
+            self.synced_at = self.updated_at = now
+            self.resyncs += 1
+            self.last_error = None
+
+        if drift and self.resyncs > 1:
+            logger.info(f"State cache resync corrected {len(drift)} containers")
+
+    def list_apps(self, fields: Optional[List[str]] = None) -> List[dict]:
+        """App list entries, as ContainerDeployer.list_all_apps() returns them"""
+        with self._lock:
+            containers = list(self.containers.values())
+            names = dict(self.images)
+        return summarize_apps(containers, names, fields)
+
+    def app_status(self, app_name: str) -> Optional[dict]:
+        """App status, as ContainerDeployer.get_container_status() returns it"""
+        with self._lock:
+            containers = [c for c in self.containers.values()
+                          if (c.get("Labels") or {}).get("vesla.app") == app_name]
+            names = dict(self.images)
+        return summarize_app(containers, names)
+
+    def as_of(self) -> Optional[float]:
+        """Time up to which the view is known to be current, None before the seed"""
+        with self._lock:
+            if not self.seeded:
+                return None
+            return time.time() if self._live() else self.updated_at
+
+    def stats(self) -> dict:
+        """Cache freshness and counters for the API"""
+        as_of = self.as_of()
+        with self._lock:
+            return {
+                "live": self._live(),
+                "as_of": as_of,
+                "synced_at": self.synced_at,
+                "containers": len(self.containers),
+                "images": len(self.images),
+                "events": self.events,
+                "resyncs": self.resyncs,
+                "resync_interval": self.resync_interval,
+                "last_error": self.last_error,
+            }
+
+    def _live(self) -> bool:
+        """Events are flowing and the last resync worked; call with the lock held"""
+        return self._connected and self.last_error is None
+
+    def _loop(self):
+        """Background thread: resync every resync_interval"""
+        while not self._stop.wait(self.resync_interval):
+            self._try_resync()
+
+    def _try_resync(self):
+        try:
+            self.resync()
+        except (DockerException, OSError) as e:
+            logger.warning(f"State cache resync failed: {e}")
+            with self._lock:
+                self.last_error = str(e)
+
+    def _watch(self):
+        """Background thread: follow the event stream, resubscribing when it drops"""
+        while not self._stop.is_set():
+            try:
+                # Subscribe before resyncing, so nothing between the two is lost
+                self._stream = self.docker.events(decode=True, filters={"type": ["container", "image"]})
+                with self._lock:
+                    self._connected = True
+                self._try_resync()
+                for event in self._stream:
+                    self._handle(event)
+                    if self._stop.is_set():
+                        return
+                error = "event stream closed"
+            except (DockerException, OSError) as e:
+                error = str(e)
+
+            with self._lock:
+                self._connected = False
+            if self._stop.is_set():
+                return
+            logger.warning(f"Docker event stream lost: {error}; reconnecting in {RECONNECT_DELAY}s")
+            self._stop.wait(RECONNECT_DELAY)
+
+    def _handle(self, event: dict):
+        """Apply one Docker event to the view"""
+        action = (event.get("Action") or event.get("status") or "").split(":")[0]
+        actor = event.get("Actor") or {}
+
+        try:
+            if event.get("Type") == "container" and action in CONTAINER_ACTIONS:
+                if (actor.get("Attributes") or {}).get("vesla.managed") != "true":
+                    return
+                self._refresh_container(actor.get("ID") or event.get("id"), action)
+            elif event.get("Type") == "image" and action in IMAGE_ACTIONS:
+                names = image_names(self.docker.api.images())
+                with self._lock:
+                    self.images = names
+            else:
+                return
+        except APIError as e:
+            logger.warning(f"Could not apply Docker event {event.get('Type')} {action}: {e}")
+            return
+
+        with self._lock:
+            self.events += 1
+            self.updated_at = time.time()
+
+    def _refresh_container(self, container_id: str, action: str):
+        """Replace one container's summary, or drop it once it's gone"""
+        summaries = [] if action == "destroy" else self.docker.api.containers(
+            all=True, filters={"id": container_id, "label": "vesla.managed=true"}
+        )
+        with self._lock:
+            if summaries:
+                self.containers[container_id] = summaries[0]
+            else:
+                self.containers.pop(container_id, None)